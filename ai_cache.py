@@ -0,0 +1,168 @@
+# AI回复缓存
+# 相同问题（相同上下文）直接复用已有回答；并发的相同问题只向上游发起一次请求
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# 归一化时忽略的结尾标点
+_TRAILING_PUNCTUATION = "?？!！。.~～ "
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    """归一化问题文本：去除首尾空白和结尾标点、合并空白、统一小写"""
+    text = _WHITESPACE_RE.sub(' ', question.strip()).lower()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def make_cache_key(question, history, history_turns):
+    """缓存键 = 归一化问题 + 最近history_turns轮对话的摘要"""
+    digest = hashlib.sha1(normalize_question(question).encode('utf-8'))
+    if history_turns > 0:
+        for user_msg, assistant_msg in history[-history_turns:]:
+            digest.update(b'\x00' + user_msg.encode('utf-8'))
+            digest.update(b'\x00' + assistant_msg.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _InFlightCall:
+    """正在进行中的上游请求，供相同问题的并发请求等待结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class ResponseCache:
+    """带TTL的LRU回复缓存，按条目数和字节数限制内存占用，并合并并发的相同请求
+
+    过期的条目不会在读取时删除，而是保留到被淘汰，AI服务不可用时可通过get_stale取回
+    """
+
+    def __init__(self, ttl=600, max_entries=1000, max_bytes=2 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # {key: (expires_at, value, size)}
+        self._in_flight = {}  # {key: _InFlightCall}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+
+    def get(self, key):
+        """读取未过期的缓存，不存在返回None"""
+        with self._lock:
+            value = self._get_locked(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """写入缓存，超过容量时按最近最少使用淘汰"""
+        size = len(key) + len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def get_stale(self, key):
+        """读取缓存，过期的回答也返回（AI服务不可用时的降级回复），不存在返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[1]
+
+    def begin(self, key):
+        """开始一次查询，返回(状态, 值或调用对象)
+
+        状态为'hit'时直接返回缓存值；为'wait'时调用方应等待已有请求的结果；
+        为'lead'时调用方负责请求上游，完成后必须调用finish。
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.hits += 1
+                return 'hit', value
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return 'wait', call
+            self.misses += 1
+            call = _InFlightCall()
+            self._in_flight[key] = call
+            return 'lead', call
+
+    def finish(self, key, call, value=None, error=None):
+        """结束由begin领取的请求：成功则写入缓存，并唤醒等待中的请求"""
+        if error is None and value is not None:
+            self.set(key, value)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        call.value = value
+        call.error = error
+        call.done.set()
+
+    def do(self, key, func):
+        """获取key对应的回复，未命中时调用func，func抛出的异常不会被缓存"""
+        state, result = self.begin(key)
+        if state == 'hit':
+            return result
+        if state == 'wait':
+            return result.wait()
+        try:
+            value = func()
+        except Exception as e:
+            self.finish(key, result, error=e)
+            raise
+        self.finish(key, result, value=value)
+        return value
+
+    def stats(self):
+        """命中/未命中/合并次数以及当前占用"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,  # 实际发往上游的请求数
+                'coalesced': self.coalesced,
+                'stale_hits': self.stale_hits,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'in_flight': len(self._in_flight)
+            }
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            # 过期条目保留到被LRU淘汰或覆盖，供get_stale在上游不可用时使用
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
@@ -0,0 +1,104 @@
+# AI回复后台任务队列
+# 将耗时的AI上游请求从Socket.IO事件处理函数中移出，交给固定数量的后台工作者执行
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT = metrics.histogram('jamp_ai_queue_wait_seconds', 'AI任务从提交到开始执行的等待时间',
+                               buckets=metrics.AI_BUCKETS)
+
+
+class AIReplyQueue:
+    """有界的AI任务队列，工作者数量即AI请求的最大并发数
+
+    threading模式下工作者阻塞等待任务，停止时放入退出标记唤醒；eventlet/gevent模式下轮询
+    """
+
+    def __init__(self, socketio, worker_count=4, max_size=50):
+        self.socketio = socketio
+        self._blocking = getattr(socketio, 'async_mode', None) == 'threading'
+        self.worker_count = worker_count
+        self.max_size = max_size
+        self._tasks = queue.Queue(maxsize=max_size)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        """启动后台工作者（重复调用无副作用）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.worker_count):
+            self.socketio.start_background_task(self._worker)
+
+    def stop(self):
+        """通知后台工作者退出（threading模式下工作者是非守护线程，退出服务前需要调用）"""
+        self._stopped = True
+        if self._blocking and self._started:
+            # 每个工作者一个退出标记；队列已满时工作者处理完当前任务后会看到_stopped
+            for _ in range(self.worker_count):
+                try:
+                    self._tasks.put_nowait(None)
+                except queue.Full:
+                    break
+
+    def submit(self, func, *args, **kwargs):
+        """提交任务，队列已满时返回False，由调用方决定如何提示用户"""
+        self.start()
+        try:
+            self._tasks.put_nowait((func, args, kwargs, time.monotonic()))
+        except queue.Full:
+            return False
+        return True
+
+    def depth(self):
+        """当前排队中（尚未开始执行）的任务数量"""
+        return self._tasks.qsize()
+
+    def active(self):
+        """当前正在执行的任务数量"""
+        return self._active
+
+    def stats(self):
+        """队列状态，供接口和日志使用"""
+        return {
+            'queued': self.depth(),
+            'active': self.active(),
+            'workers': self.worker_count,
+            'max_size': self.max_size
+        }
+
+    def _worker(self):
+        while not self._stopped:
+            if self._blocking:
+                task = self._tasks.get()
+                if task is None:
+                    self._tasks.task_done()
+                    break
+            else:
+                try:
+                    task = self._tasks.get_nowait()
+                except queue.Empty:
+                    # eventlet/gevent模式下使用socketio.sleep轮询，让出给其他协程
+                    self.socketio.sleep(0.05)
+                    continue
+            func, args, kwargs, submitted = task
+            QUEUE_WAIT.observe(time.monotonic() - submitted)
+            with self._lock:
+                self._active += 1
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"AI任务执行失败: {str(e)}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                self._tasks.task_done()
@@ -1,20 +1,72 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, abort
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import config
-import re
+import logging
+import os
+import random
+import threading
 import time
+import urllib.parse
+import uuid
+from datetime import datetime
+# 日志配置需在导入其他模块之前完成
+from log_config import configure_logging, fields, EVENT_LOGGER
+configure_logging(level=config.LOG_LEVEL, fmt=config.LOG_FORMAT,
+                  event_sample_rate=config.LOG_EVENT_SAMPLE_RATE, access_log=config.LOG_ACCESS)
+import metrics
 # 导入自定义的AI模块
 from simple_ai import bot_ai
+from ai_queue import AIReplyQueue
+from presence import create_presence_registry
+from room_metrics import RoomMetrics
+from message_buffer import create_message_buffer
+from chat_log import create_chat_log
+from scheduler import DelayedTaskQueue
+from message_parser import parse_message, is_url
+from rate_limit import RateLimiter, ConcurrencyLimiter
+from outbound_batch import RoomEmitter
+from broadcast_manager import create_client_manager
+from static_assets import StaticAssets, CompressedBody
 
-app = Flask(__name__)
+logger = logging.getLogger('jamp')
+events_log = logging.getLogger(EVENT_LOGGER)  # 逐条消息的日志，可采样或关闭
+
+# 静态资源由 static_file 提供（内容哈希地址、预压缩、ETag），不使用Flask默认的静态路由
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = config.SECRET_KEY
 
-# 配置Socket.IO
-socketio = SocketIO(app, cors_allowed_origins="*")
+# 静态资源缓存，模板中用 asset_url('css/style.css') 得到带内容哈希的地址
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'),
+                             compress=config.STATIC_COMPRESSION,
+                             max_age=config.STATIC_MAX_AGE,
+                             reload=config.STATIC_RELOAD)
+app.jinja_env.globals['asset_url'] = static_assets.url
+
+# 配置Socket.IO，配置了消息队列时多个服务进程之间互相转发广播；广播给聊天室时数据包只编码一次
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=config.SOCKETIO_MESSAGE_QUEUE,
+                    client_manager=create_client_manager(config.SOCKETIO_MESSAGE_QUEUE))
+
+# AI回复后台队列，避免上游请求阻塞事件处理
+ai_queue = AIReplyQueue(socketio, worker_count=config.AI_WORKER_COUNT, max_size=config.AI_QUEUE_MAX_SIZE)
+
+# 聊天室广播的统一出口，开启合并时将窗口内的事件合并为一帧发送，可选紧凑传输格式
+room_emitter = RoomEmitter(socketio,
+                           window=config.OUTBOUND_BATCH_WINDOW if config.OUTBOUND_BATCHING else 0,
+                           max_events=config.OUTBOUND_BATCH_MAX_EVENTS,
+                           excluded_rooms=config.OUTBOUND_BATCH_EXCLUDED_ROOMS,
+                           compact=config.WIRE_FORMAT == 'compact')
+
+# 延迟发送队列，机器人的欢迎语和@回复稍后发送，不阻塞事件处理
+delayed_tasks = DelayedTaskQueue(socketio)
+
+# 频率限制（每个服务进程各自计数）：用户发言、聊天室发言、用户AI提问，以及同时处理中的AI问题数
+message_limiter = RateLimiter(config.MESSAGE_RATE_PER_USER, config.MESSAGE_BURST_PER_USER)
+room_message_limiter = RateLimiter(config.MESSAGE_RATE_PER_ROOM, config.MESSAGE_BURST_PER_ROOM)
+ai_limiter = RateLimiter(config.AI_RATE_PER_USER, config.AI_BURST_PER_USER)
+ai_concurrency = ConcurrencyLimiter(config.AI_MAX_IN_FLIGHT)
 
-# 全局变量管理
-users = {}  # 存储在线用户 {session_id: username}
-room = "general"  # 默认聊天室
+# 聊天室消息指标（每个服务进程各自统计）
+room_metrics = RoomMetrics()
 
 # 机器人用户配置
 BOT_USERNAME = "川小农"
@@ -24,20 +76,87 @@ BOT_SESSION_ID = "bot_chuanxiaonong"  # 特殊的机器人会话ID
 MOVIE_USERNAME = "电影"
 MOVIE_SESSION_ID = "bot_movie"  # 特殊的电影用户会话ID
 
+# 在线用户索引 {session_id <-> username}，机器人用户和电影用户始终在线
+# 配置了STATE_REDIS_URL时保存在Redis中，由所有服务进程共享
+presence = create_presence_registry(reserved={
+    BOT_SESSION_ID: BOT_USERNAME,
+    MOVIE_SESSION_ID: MOVIE_USERNAME
+}, redis_url=config.STATE_REDIS_URL, prefix=config.STATE_KEY_PREFIX,
+   worker_ttl=config.PRESENCE_WORKER_TTL)
+
+# 每个聊天室最近消息的环形缓冲区，新加入或重连的用户据此补发错过的消息
+message_buffer = create_message_buffer(capacity=config.MESSAGE_BUFFER_SIZE,
+                                       max_rooms=config.MESSAGE_BUFFER_MAX_ROOMS,
+                                       redis_url=config.STATE_REDIS_URL,
+                                       prefix=config.STATE_KEY_PREFIX)
+
+# 聊天记录持久化，由后台线程批量写入SQLite，服务重启后可按条件搜索；数据库在服务启动或第一次写入、搜索时才打开
+chat_log = create_chat_log(config.CHAT_LOG_PATH, base_dir=config.DATA_DIR,
+                           batch_size=config.CHAT_LOG_BATCH_SIZE,
+                           flush_interval=config.CHAT_LOG_FLUSH_INTERVAL,
+                           max_queue=config.CHAT_LOG_QUEUE_MAX)
+
+# /metrics 中抓取时才读取的指标：队列长度、在线人数、广播次数、AI历史存储大小
+metrics.gauge_callback('jamp_queue_depth', '各后台队列中等待处理的任务数', lambda: {
+    ('ai',): ai_queue.depth(),
+    ('delayed',): delayed_tasks.pending(),
+    ('chat_log',): chat_log.stats()['pending'] if chat_log is not None else None
+}, ('queue',))
+metrics.gauge_callback('jamp_ai_active_requests', '正在请求AI上游的任务数', ai_queue.active)
+metrics.gauge_callback('jamp_connected_users', '在线用户数（不含系统用户）', lambda: sum(presence.rooms().values()))
+metrics.gauge_callback('jamp_rooms', '有成员的聊天室数', lambda: len(presence.rooms()))
+metrics.counter_callback('jamp_room_events_emitted_total', '发送到聊天室的事件数（每秒速率用rate()计算）',
+                         lambda: room_emitter.events)
+metrics.counter_callback('jamp_room_frames_sent_total', '发送到聊天室的帧数（开启合并时小于事件数）',
+                         lambda: room_emitter.frames)
+metrics.gauge_callback('jamp_ai_history_users', '内存中保存AI对话历史的用户数',
+                       lambda: bot_ai.history_store.memory_size()['users'])
+metrics.gauge_callback('jamp_ai_history_bytes', '内存中AI对话历史的大小（字节）',
+                       lambda: bot_ai.history_store.memory_size()['bytes'])
+
+def on_event(event):
+    """注册Socket.IO事件处理函数，记录处理耗时（/metrics），并可在运行时对该事件开启性能分析"""
+    def decorator(handler):
+        return socketio.on(event)(metrics.instrument_event(event, handler))
+    return decorator
+
 # 路由定义
+# 登录页只依赖config.SERVERS，渲染一次后复用渲染结果和压缩版本
+_login_page = None
+
 @app.route('/')
 def index():
     """登录页面"""
-    return render_template('login.html', servers=config.SERVERS)
+    global _login_page
+    page = _login_page
+    if page is None or config.STATIC_RELOAD:
+        html = render_template('login.html', servers=config.SERVERS)
+        page = _login_page = CompressedBody(html.encode('utf-8'), 'text/html; charset=utf-8',
+                                            compress=config.STATIC_COMPRESSION)
+    return page.response(request)
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    """静态资源：带内容哈希的地址长期缓存，按Accept-Encoding返回压缩版本，支持ETag/304"""
+    response = static_assets.response(request, filename)
+    if response is None:
+        abort(404)
+    return response
 
 @app.route('/chat')
 def chat():
     """聊天室页面"""
     username = request.args.get('username')
     server = request.args.get('server')
+    room = normalize_room(request.args.get('room'))
     if not username:
         return jsonify({"error": "用户名不能为空"}), 400
-    return render_template('chat.html', username=username, server=server)
+    if not room:
+        return jsonify({"error": f"聊天室名称长度不能超过{config.ROOM_NAME_MAX_LENGTH}个字符"}), 400
+    html = render_template('chat.html', username=username, server=server, room=room)
+    # 聊天室页面随用户名和聊天室变化，每次渲染后使用较快的压缩级别
+    return CompressedBody(html.encode('utf-8'), 'text/html; charset=utf-8',
+                          compress=config.STATIC_COMPRESSION, level=6).response(request)
 
 @app.route('/api/validate_username', methods=['POST'])
 def validate_username():
@@ -50,7 +169,7 @@ def validate_username():
         return jsonify({"valid": False, "message": "该用户名是系统机器人，不可使用"})
     
     # 检查用户名是否已经存在
-    if username in users.values():
+    if presence.is_online(username):
         return jsonify({"valid": False, "message": "用户名已被使用"})
     
     # 检查用户名长度
@@ -59,27 +178,115 @@ def validate_username():
     
     return jsonify({"valid": True})
 
+@app.route('/api/rooms')
+def list_rooms():
+    """聊天室列表及每个聊天室的成员数和消息速率"""
+    rooms = []
+    for name, members in sorted(presence.rooms().items()):
+        stats = room_metrics.stats(name)
+        stats.update({'name': name, 'members': members})
+        rooms.append(stats)
+    return jsonify({'rooms': rooms, 'outbound': room_emitter.stats()})
+
+@app.route('/api/ai/status')
+def ai_status():
+    """AI队列、上游连接池、熔断器、回复缓存与历史存储状态"""
+    status = ai_queue.stats()
+    status['http_pool'] = bot_ai.pool_stats()
+    status['breaker'] = bot_ai.breaker_stats()
+    status['cache'] = bot_ai.cache_stats()
+    status['history'] = bot_ai.history_store.size()
+    return jsonify(status)
+
+@app.route('/api/rate_limits')
+def rate_limit_status():
+    """各项频率限制的配置和计数（放行/拒绝次数），用于评估限制是否合适"""
+    return jsonify({
+        'message_per_user': message_limiter.stats(),
+        'message_per_room': room_message_limiter.stats(),
+        'ai_per_user': ai_limiter.stats(),
+        'ai_in_flight': ai_concurrency.stats()
+    })
+
+@app.route('/api/messages/search')
+def search_messages():
+    """搜索聊天记录，支持关键词q、聊天室room、发言人username、被@的用户mention、
+    时间范围since/until（时间戳或ISO格式日期）和分页（limit、上一页返回的cursor）"""
+    if chat_log is None:
+        return jsonify({"error": "未开启聊天记录"}), 404
+    args = request.args
+    try:
+        since = parse_time(args.get('since'))
+        until = parse_time(args.get('until'))
+        limit = min(int(args.get('limit', config.CHAT_LOG_PAGE_SIZE)), config.CHAT_LOG_PAGE_MAX)
+        cursor = int(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "参数格式错误"}), 400
+    if limit < 1:
+        return jsonify({"error": "参数格式错误"}), 400
+    return jsonify(chat_log.search(
+        query=args.get('q', '').strip() or None,
+        room=args.get('room') or None,
+        username=args.get('username') or None,
+        mention=args.get('mention') or None,
+        since=since,
+        until=until,
+        limit=limit,
+        cursor=cursor
+    ))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus文本格式的运行指标（每个服务进程各自统计）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET', 'POST', 'DELETE'])
+def event_profile():
+    """运行时性能分析（需开启PROFILING_ENABLED）：POST {"event": "send_message", "count": 100} 分析该事件接下来的count次调用，
+    GET ?event=send_message 返回按累计耗时排序的结果，DELETE 停止并清除"""
+    if not config.PROFILING_ENABLED:
+        return jsonify({"error": "未开启性能分析"}), 404
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        event = body.get('event')
+        try:
+            count = int(body.get('count', 100))
+        except (TypeError, ValueError):
+            return jsonify({"error": "参数格式错误"}), 400
+        if not event or count < 1:
+            return jsonify({"error": "参数格式错误"}), 400
+        metrics.profiler.enable(event, count)
+        logger.info("开启事件性能分析", extra=fields(event=event, count=count))
+        return jsonify(metrics.profiler.status())
+    if request.method == 'DELETE':
+        metrics.profiler.disable(request.args.get('event'))
+        return jsonify(metrics.profiler.status())
+    event = request.args.get('event')
+    if not event:
+        return jsonify(metrics.profiler.status())
+    report = metrics.profiler.report(event, limit=request.args.get('limit', 30, type=int),
+                                     sort=request.args.get('sort', 'cumulative'))
+    if report is None:
+        return jsonify({"error": "该事件还没有分析结果"}), 404
+    return Response(report, mimetype='text/plain')
+
 # Socket.IO事件处理
-@socketio.on('connect')
-def handle_connect():
+@on_event('connect')
+def handle_connect(auth=None):
     """处理客户端连接"""
-    print(f"客户端连接: {request.sid}")
+    events_log.debug("客户端连接", extra=fields(sid=request.sid))
+    # 无论以何种方式启动服务（python app.py、gunicorn、flask run），在本进程占用用户名之前开始续期心跳
+    start_presence_maintenance()
 
-@socketio.on('disconnect')
+@on_event('disconnect')
 def handle_disconnect():
     """处理客户端断开连接"""
-    if request.sid in users and request.sid != BOT_SESSION_ID and request.sid != MOVIE_SESSION_ID:  # 不处理机器人用户和电影用户的断开连接
-        username = users[request.sid]
-        del users[request.sid]
-        # 通知其他用户有用户离开
-        emit('user_left', {
-            'username': username,
-            'timestamp': get_current_timestamp(),
-            'online_users': get_online_users()
-        }, room=room)
-        print(f"用户离开: {username}")
+    username, room, version = presence.release(request.sid)  # 机器人用户和电影用户不会被释放
+    if username:
+        notify_user_left(username, room, version)
+        logger.info("用户离开", extra=fields(user=username, room=room))
 
-@socketio.on('join')
+@on_event('join')
 def handle_join(data):
     """处理用户加入聊天室"""
     username = data.get('username')
@@ -98,92 +305,99 @@ def handle_join(data):
         }, to=request.sid)
         return
     
-    # 检查用户名是否已经被其他用户使用
-    if username in users.values():
+    room = normalize_room(data.get('room'))
+    if not room:
+        emit('join_error', {
+            'message': f'聊天室名称长度不能超过{config.ROOM_NAME_MAX_LENGTH}个字符'
+        }, to=request.sid)
+        return
+    
+    # 检查并占用用户名（原子操作，防止多个用户同时通过验证后使用同一用户名）
+    version = presence.claim(request.sid, username, room)
+    if not version:
         # 发送错误消息给客户端
         emit('join_error', {
             'message': '用户名已被使用，请更换用户名'
         }, to=request.sid)
         return
     
-    # 保存用户信息
-    users[request.sid] = username
     join_room(room)
     
-    # 通知所有用户有新用户加入
-    emit('user_joined', {
+    # 通知所有用户有新用户加入（只发送变化的用户和版本号）
+    room_emitter.emit(room, 'user_joined', {
         'username': username,
         'timestamp': get_current_timestamp(),
-        'online_users': get_online_users()
-    }, room=room)
+        'version': version
+    })
     
-    # 发送欢迎消息给新用户
+    # 发送欢迎消息给新用户，附带在线列表的完整快照
     emit('welcome_message', {
-        'message': f"欢迎 {username} 加入聊天室！",
+        'message': f"欢迎 {username} 加入聊天室 {room}！",
         'timestamp': get_current_timestamp(),
-        'online_users': get_online_users()
+        'room': room,
+        'presence': presence.snapshot(room)
     }, to=request.sid)
     
-    # 机器人自动发送欢迎消息（仅新用户可见）
-    socketio.sleep(1)  # 延迟1秒发送
-    emit('new_message', {
-        'username': BOT_USERNAME,
-        'message': f"你好 {username}！我是AI助手川小农，有什么可以帮助你的吗？",
-        'timestamp': get_current_timestamp(),
-        'is_ai': True
-    }, to=request.sid)
+    # 补发客户端错过的消息（首次加入时last_seq为0，补发缓冲区中的全部消息）
+    send_backlog(room, data.get('last_seq'))
     
-    print(f"用户加入: {username}, 在线用户: {list(users.values())}")
+    # 机器人稍后自动发送欢迎消息（仅新用户可见）
+    delayed_tasks.call_later(config.BOT_REPLY_DELAY, send_bot_message,
+                             f"你好 {username}！我是AI助手川小农，有什么可以帮助你的吗？", to=request.sid)
+    
+    logger.info("用户加入", extra=fields(user=username, room=room, members=presence.room_size(room)))
 
-@socketio.on('send_message')
+@on_event('send_message')
 def handle_message(data):
     """处理用户发送的消息"""
-    username = users.get(request.sid)
+    username = presence.username_of(request.sid)
     if not username:
         return
+    room = presence.room_of(request.sid)
     
     message = data.get('message', '').strip()
     if not message or len(message) > config.MAX_MESSAGE_LENGTH:
         return
     
-    print(f"接收到消息: 用户={username}, 消息内容='{message}'")
+    # 频率限制：先检查用户，再检查聊天室
+    retry_after = message_limiter.try_acquire(username)
+    if retry_after:
+        notify_rate_limited('message', retry_after)
+        return
+    retry_after = room_message_limiter.try_acquire(room)
+    if retry_after:
+        notify_rate_limited('room', retry_after)
+        return
+    
+    events_log.debug("收到消息", extra=fields(user=username, room=room, length=len(message)))
+    room_metrics.record_message(room)
+    
+    # 一次解析得到命令、@的用户和链接
+    parsed = parse_message(message, reserved=(BOT_USERNAME,))
     
     # 处理@用户功能
     mentioned_users = []
-    if '@' in message:
-        # 简单的@用户检测，查找@后跟非空格字符的模式
-        import re
-        mentions = re.findall(r'@(\S+)', message)
-        mentioned_users = [mention for mention in mentions if mention in get_online_users()]
+    if parsed.mentions:
+        mentioned_users = [mention for mention in parsed.mentions if presence.in_room(mention, room)]
         
-        print(f"检测到@用户: {mentions}, 有效用户: {mentioned_users}")
+        events_log.debug("检测到@用户", extra=fields(mentions=parsed.mentions, valid=mentioned_users))
         
         # 检查是否@了机器人
-        if BOT_USERNAME in mentions:
-            print("检测到@川小农，准备触发AI响应")
-            # 延迟回复@消息
-            socketio.sleep(1)
+        if parsed.mentions_user(BOT_USERNAME):
             bot_responses = [
                 f"{username}，有什么我可以帮到你的吗？",
                 f"你好 {username}，很高兴收到你的消息！",
                 f"我是川小农，随时为你服务 {username}！",
                 f"收到你的@啦 {username}，需要什么帮助吗？"
             ]
-            import random
             bot_response = random.choice(bot_responses)
             
-            # 发送机器人回复
-            emit('new_message', {
-                'username': BOT_USERNAME,
-                'message': bot_response,
-                'timestamp': get_current_timestamp(),
-                'is_ai': True
-            }, room=room)
+            # 稍后发送机器人回复，用户自己的消息先广播
+            delayed_tasks.call_later(config.BOT_REPLY_DELAY, send_bot_message, bot_response, room=room)
     
     # 检查是否是特殊命令（以@开头的命令）
-    if message.startswith('@'):
-        print("消息以@开头，调用handle_special_command处理")
-        handle_special_command(username, message, get_current_timestamp(), room)
+    if parsed.is_command:
+        handle_special_command(username, parsed, get_current_timestamp(), room)
     else:
         # 构建消息数据
         message_data = {
@@ -194,111 +408,91 @@ def handle_message(data):
         }
         
         # 广播消息给所有用户
-        emit('new_message', message_data, room=room)
+        broadcast_message(room, message_data)
 
-@socketio.on('leave')
+@on_event('leave')
 def handle_leave():
     """处理用户主动离开聊天室"""
-    if request.sid in users:
-        username = users[request.sid]
-        del users[request.sid]
+    username, room, version = presence.release(request.sid)
+    if username:
         leave_room(room)
-        # 通知其他用户有用户离开
-        emit('user_left', {
-            'username': username,
-            'timestamp': get_current_timestamp(),
-            'online_users': list(users.values())
-        }, room=room)
-        print(f"用户主动离开: {username}")
+        notify_user_left(username, room, version)
+        logger.info("用户主动离开", extra=fields(user=username, room=room))
+
+@on_event('presence_resync')
+def handle_presence_resync():
+    """客户端发现在线列表版本缺失时，重新发送完整快照"""
+    room = presence.room_of(request.sid)
+    if room:
+        emit('presence_snapshot', presence.snapshot(room), to=request.sid)
 
 # 特殊命令处理
-def handle_special_command(username, message, timestamp, room):
-    """处理@xxx特殊命令"""
-    print(f"开始处理特殊命令: 消息='{message}'")
-    
-    # 解析命令格式: @命令名 参数
-    match = re.match(r'@(.+?)(\s+.*)?$', message)
-    if not match:
-        print(f"无法匹配命令格式: {message}")
-        # 尝试直接检查是否包含@川小农
-        if '@川小农' in message:
-            print("直接检测到@川小农，触发AI命令")
+def handle_special_command(username, parsed, timestamp, room):
+    """处理@xxx特殊命令，parsed为parse_message的解析结果"""
+    message = parsed.text
+    
+    command = parsed.command
+    params = parsed.params  # 已移除分隔符和反引号
+    if not command:
+        # 消息只有@和标点：包含@川小农时提问，否则当作普通消息处理
+        if parsed.addresses(BOT_USERNAME):
             # 提取@川小农后面的内容作为问题
-            question = message.split('@川小农', 1)[1].strip()
-            handle_ai_command(username, question, timestamp)
+            handle_ai_command(username, parsed.text_after(BOT_USERNAME), timestamp, room)
+        else:
+            broadcast_message(room, {
+                'username': username,
+                'message': message,
+                'timestamp': timestamp
+            })
         return
     
-    command = match.group(1).strip()
-    params = match.group(2) if match.group(2) else ''
-    params = params.strip()
-    
-    print(f"解析命令: 命令名={command}, 参数={params}")
-    
-    # 移除参数中可能包含的反引号
-    params = params.replace('`', '')
+    events_log.debug("特殊命令", extra=fields(user=username, command=command))
     
     # 根据不同命令进行处理
     if command == '电影':
         handle_movie_command(username, params, timestamp, room)
     elif command == '川小农':
-        print("命令匹配@川小农，调用handle_ai_command")
-        handle_ai_command(username, params, timestamp)
+        handle_ai_command(username, params, timestamp, room)
     else:
         # 检查是否是@用户提醒
-        if command in users.values():
-            print(f"@用户提醒: {command}")
+        if presence.in_room(command, room):
             # 发送@提醒消息
-            emit('new_message', {
+            broadcast_message(room, {
                 'username': username,
                 'message': message,
                 'timestamp': timestamp,
                 'is_mention': True,
                 'mention_target': command
-            }, room=room)
+            })
         else:
             # 检查是否包含@川小农
-            if '@川小农' in message:
-                print("消息中包含@川小农，触发AI命令")
-                # 提取@川小农后面的内容作为问题
-                question_part = message.split('@川小农', 1)[1]
-                # 移除可能的开头空格
-                question = question_part.lstrip()
-                handle_ai_command(username, question, timestamp)
+            if parsed.addresses(BOT_USERNAME):
+                # 提取@川小农后面的内容作为问题（包括"@川小农你好"这种不加分隔符的写法）
+                handle_ai_command(username, parsed.text_after(BOT_USERNAME), timestamp, room)
             else:
-                print(f"未知命令: {command}")
                 # 未知命令，当作普通消息处理
-                emit('new_message', {
+                broadcast_message(room, {
                     'username': username,
                     'message': message,
                     'timestamp': timestamp
-                }, room=room)
+                })
 
 def handle_movie_command(username, url, timestamp, room):
     """处理@电影命令，支持解析电影地址并播放"""
-    # 添加调试日志
-    print(f"处理@电影命令: 用户={username}, URL完整长度={len(url)}, URL内容: '{url}'")
+    events_log.debug("分享电影", extra=fields(user=username, room=room, url=url))
     
     if not url:
         response = "请提供电影链接，格式: @电影 url"
         final_url = ""
     else:
-        # 确保URL中没有反引号
-        url = url.replace('`', '')
-        print(f"清理后的URL完整内容: '{url}'")
-        
-        # 验证URL格式 - 更宽松的验证，适应各种链接格式
-        import re
-        url_pattern = r'^(https?://|www\.)\S+$'
-        is_valid_url = re.match(url_pattern, url)
-        print(f"URL验证结果: {is_valid_url is not None}")
+        # 验证URL格式 - 更宽松的验证，适应各种链接格式（参数中的反引号已在解析时移除）
+        is_valid_url = is_url(url)
         
         # 使用指定的解析地址模板处理URL
-        import urllib.parse
         # 确保完整编码URL，包括查询参数
         parsed_url = urllib.parse.quote(url, safe='')
         # 严格使用要求的解析地址
         parsed_movie_url = f"https://jx.m3u8.tv/jiexi/?url={parsed_url}"
-        print(f"解析后的电影URL完整内容: '{parsed_movie_url}'")
         
         # 根据URL验证结果设置不同的响应消息
         if is_valid_url:
@@ -309,69 +503,250 @@ def handle_movie_command(username, url, timestamp, room):
         # 设置最终的电影URL
         final_url = parsed_movie_url
     
-    emit('new_message', {
+    broadcast_message(room, {
         'username': '系统',
         'message': response,
         'timestamp': timestamp,
         'is_system': True,
         'is_movie': True,
         'movie_url': final_url if final_url else ''
-    }, room=room)
+    })
 
-def handle_ai_command(username, question, timestamp):
-    """处理@川小农命令，使用智能AI回复"""
-    print(f"处理AI命令: 用户={username}, 问题='{question}'")
+def handle_ai_command(username, question, timestamp, room):
+    """处理@川小农命令，将AI请求交给后台队列，处理函数立即返回"""
+    events_log.debug("AI提问", extra=fields(user=username, room=room, length=len(question)))
     
     if not question:
-        response = "请输入您想咨询的问题，格式: @川小农 问题"
-    else:
+        broadcast_message(room, {
+            'username': BOT_USERNAME,
+            'message': "请输入您想咨询的问题，格式: @川小农 问题",
+            'timestamp': timestamp,
+            'is_ai': True
+        })
+        return
+    
+    retry_after = ai_limiter.try_acquire(username)
+    if retry_after:
+        notify_rate_limited('ai', retry_after)
+        return
+    
+    # AI上游熔断期间不占用队列和工作者，立即给出降级回复
+    if not bot_ai.upstream_available():
+        events_log.debug("AI熔断中，直接降级回复", extra=fields(user=username, room=room))
+        broadcast_message(room, {
+            'username': BOT_USERNAME,
+            'message': bot_ai.fallback_reply(question, username),
+            'timestamp': timestamp,
+            'is_ai': True
+        })
+        return
+    
+    if not ai_concurrency.try_acquire():
+        notify_rate_limited('ai_global')
+        return
+    
+    message_id = uuid.uuid4().hex
+    if not ai_queue.submit(run_ai_reply, username, question, message_id, room):
+        ai_concurrency.release()
+        logger.warning("AI队列已满，拒绝请求", extra=fields(user=username, queued=ai_queue.depth()))
+        broadcast_message(room, {
+            'username': BOT_USERNAME,
+            'message': f"{username}，现在提问的人太多啦，请稍后再试~",
+            'timestamp': timestamp,
+            'is_ai': True
+        })
+        return
+    
+    # 先发送"思考中"占位消息，回复就绪后按message_id替换
+    room_emitter.emit(room, 'ai_thinking', {
+        'message_id': message_id,
+        'username': BOT_USERNAME,
+        'asker': username,
+        'timestamp': timestamp,
+        'queue_depth': ai_queue.depth()
+    })
+
+def run_ai_reply(username, question, message_id, room):
+    """在后台工作者中调用AI并将回复发送到聊天室，结束后释放AI并发名额"""
+    try:
+        if config.AI_STREAMING:
+            stream_ai_reply(username, question, message_id, room)
+            return
+        
         # 使用智能AI模块生成回复
         response = bot_ai.get_response(question, username)
+        
+        events_log.debug("AI回复", extra=fields(user=username, length=len(response)))
+        
+        broadcast_message(room, {
+            'username': BOT_USERNAME,
+            'message': response,
+            'timestamp': get_current_timestamp(),
+            'is_ai': True,
+            'message_id': message_id
+        })
+    finally:
+        ai_concurrency.release()
+
+def stream_ai_reply(username, question, message_id, room):
+    """流式推送AI回复：每段文本发送ai_delta，结束后发送包含完整内容的ai_done"""
+    parts = []
+    for delta in bot_ai.stream_response(question, username):
+        parts.append(delta)
+        room_emitter.emit(room, 'ai_delta', {
+            'message_id': message_id,
+            'delta': delta
+        })
     
-    print(f"AI回复: '{response}'")
+    response = "".join(parts)
+    events_log.debug("AI回复(流式)", extra=fields(user=username, length=len(response)))
     
-    emit('new_message', {
-        'username': '川小农',
+    # 完整回复同样写入最近消息缓冲区，错过流式片段的用户重连后也能看到
+    broadcast_message(room, {
+        'message_id': message_id,
+        'username': BOT_USERNAME,
         'message': response,
-        'timestamp': timestamp,
+        'timestamp': get_current_timestamp(),
+        'is_ai': True
+    }, event='ai_done')
+
+def broadcast_message(room, data, event='new_message'):
+    """向聊天室广播一条消息：分配序号并写入最近消息缓冲区和聊天记录，所有聊天室消息都经过这里"""
+    message_buffer.append(room, data)
+    if chat_log is not None:
+        chat_log.append(room, data)
+    room_emitter.emit(room, event, data)
+
+def send_bot_message(message, room=None, to=None):
+    """以机器人身份发送消息：指定room时广播到聊天室，指定to时只发给该会话"""
+    data = {
+        'username': BOT_USERNAME,
+        'message': message,
+        'timestamp': get_current_timestamp(),
         'is_ai': True
-    }, room=room)
+    }
+    if room:
+        broadcast_message(room, data)
+    else:
+        socketio.emit('new_message', data, to=to)
+
+RATE_LIMIT_MESSAGES = {
+    'message': "发言太频繁了，请稍后再发",
+    'room': "聊天室消息太多了，请稍后再发",
+    'ai': "提问太频繁了，请稍后再问川小农",
+    'ai_global': "现在提问的人太多啦，请稍后再问川小农"
+}
+
+def notify_rate_limited(scope, retry_after=None):
+    """通知当前客户端请求被频率限制拒绝，retry_after为建议等待的秒数"""
+    events_log.info("频率限制", extra=fields(sid=request.sid, scope=scope))
+    emit('rate_limited', {
+        'scope': scope,
+        'retry_after': round(retry_after, 1) if retry_after else None,
+        'message': RATE_LIMIT_MESSAGES[scope]
+    }, to=request.sid)
+
+def send_backlog(room, last_seq):
+    """将序号大于last_seq的缓冲消息合并为一个message_backlog事件发送给当前客户端"""
+    try:
+        last_seq = max(int(last_seq or 0), 0)
+    except (TypeError, ValueError):
+        last_seq = 0
+    messages, latest_seq, truncated = message_buffer.since(room, last_seq)
+    if not messages and latest_seq == last_seq:
+        return
+    emit('message_backlog', {
+        'room': room,
+        'messages': messages,
+        'latest_seq': latest_seq,
+        'truncated': truncated,  # 部分消息已被挤出缓冲区，无法补发
+        'reset': last_seq > latest_seq  # 服务端序号已重新开始，客户端需丢弃旧序号
+    }, to=request.sid)
+
+def notify_user_left(username, room, version):
+    """用户已从presence中释放：清理其AI历史和空聊天室，通知其他用户（只发送变化的用户和版本号）"""
+    bot_ai.forget(username)
+    forget_empty_room(room)
+    room_emitter.emit(room, 'user_left', {
+        'username': username,
+        'timestamp': get_current_timestamp(),
+        'version': version
+    })
+
+_presence_maintenance_lock = threading.Lock()
+_presence_maintenance_started = False
+
+def start_presence_maintenance():
+    """多进程部署时启动在线用户的心跳和清理任务（重复调用无副作用），首次运行时还释放没有所属进程的会话"""
+    global _presence_maintenance_started
+    if _presence_maintenance_started or not config.STATE_REDIS_URL:
+        return
+    with _presence_maintenance_lock:
+        if _presence_maintenance_started:
+            return
+        _presence_maintenance_started = True
+    maintain_presence(orphans=True)
+
+def maintain_presence(orphans=False):
+    """续期本进程的心跳，释放已停止的服务进程遗留的在线用户，之后定期重复（仅多进程部署时启动）"""
+    try:
+        presence.heartbeat()
+        for username, room, version in presence.reap(orphans=orphans):
+            notify_user_left(username, room, version)
+            logger.info("释放已停止进程遗留的用户", extra=fields(user=username, room=room))
+    finally:
+        delayed_tasks.call_later(config.PRESENCE_HEARTBEAT_INTERVAL, maintain_presence)
+
+def forget_empty_room(room):
+    """聊天室没有成员后清除其消息指标"""
+    if not presence.room_size(room):
+        room_metrics.forget(room)
+
+def normalize_room(name):
+    """规范化聊天室名称，为空时使用默认聊天室，名称过长时返回None"""
+    name = (name or '').strip() or config.DEFAULT_ROOM
+    if len(name) > config.ROOM_NAME_MAX_LENGTH:
+        return None
+    return name
+
+def parse_time(value):
+    """解析查询参数中的时间：Unix时间戳或ISO格式（如 2024-05-01 或 2024-05-01T08:00），为空时返回None"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
 
 def get_current_timestamp():
     """获取当前时间戳，格式为 HH:MM:SS"""
     return time.strftime('%H:%M:%S')
 
-def get_online_users():
-    """获取在线用户列表，包含机器人用户和电影用户"""
-    # 获取所有真实用户
-    real_users = list(users.values())
-    # 确保机器人用户始终在列表中
-    if BOT_USERNAME not in real_users:
-        real_users = [BOT_USERNAME] + real_users
-    # 确保电影用户始终在列表中
-    if MOVIE_USERNAME not in real_users:
-        real_users = [MOVIE_USERNAME] + real_users
-    return real_users
-
 # 在应用启动时初始化机器人用户
 def initialize_bot():
-    """初始化机器人用户和电影用户"""
-    global users
-    # 添加机器人用户到用户列表
-    users[BOT_SESSION_ID] = BOT_USERNAME
-    # 添加电影用户到用户列表
-    users[MOVIE_SESSION_ID] = MOVIE_USERNAME
-    print(f"机器人用户 '{BOT_USERNAME}' 已初始化")
-    print(f"电影用户 '{MOVIE_USERNAME}' 已初始化")
+    """初始化机器人用户和电影用户（已在presence中注册为始终在线）"""
+    logger.info(f"机器人用户 '{BOT_USERNAME}' 已初始化")
+    logger.info(f"电影用户 '{MOVIE_USERNAME}' 已初始化")
 
 if __name__ == '__main__':
-    print("Jamp智能聊天室启动中...")
-    print("服务器地址:")
+    logger.info("Jamp智能聊天室启动中...")
+    logger.info("服务器地址:")
     for server in config.SERVERS:
-        print(f"- {server['name']}: {server['url']}")
+        logger.info(f"- {server['name']}: {server['url']}")
     
     # 初始化机器人用户
     initialize_bot()
+    if chat_log is not None:
+        chat_log.open()  # 启动时打开聊天记录数据库，仅导入app时不创建文件
+    # 启动时清理崩溃或已停止的进程遗留的在线用户，之后定期续期心跳（仅多进程部署）
+    start_presence_maintenance()
     
-    # 启动Flask应用，使用端口5000
-    socketio.run(app, host='0.0.0.0', port=5000, debug=config.DEBUG)
\ No newline at end of file
+    # 启动Flask应用，默认使用端口5000
+    try:
+        socketio.run(app, host=config.HOST, port=config.PORT, debug=config.DEBUG, allow_unsafe_werkzeug=True)
+    finally:
+        ai_queue.stop()
+        delayed_tasks.stop()
+        room_emitter.stop()
+        if chat_log is not None:
+            chat_log.close()
\ No newline at end of file
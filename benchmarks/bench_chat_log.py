@@ -0,0 +1,103 @@
+# 聊天记录写入与查询基准
+# 向临时SQLite数据库写入N条模拟消息（默认100万条），统计批量写入速率，
+# 然后测量按聊天室/用户名/被@用户/关键词分页查询的延迟
+# 用法: python benchmarks/bench_chat_log.py [--messages 1000000] [--queries 200] [--db bench_chat_log.db]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_log import ChatLog  # noqa: E402
+
+ROOMS = ['general'] + [f'room{i}' for i in range(49)]
+USERS = ['川小农'] + [f'user{i}' for i in range(999)]
+WORDS = ['今天', '天气', '电影', '川农', '食堂', '图书馆', '考试', '作业', '宿舍', '篮球',
+         'python', 'flask', 'socket', 'redis', 'hello', 'world', '小麦', '水稻', '实验', '论文']
+CHUNK = 50000  # 每写入这么多条等待一次落盘，避免队列无限增长
+
+
+def make_message(rng, seq):
+    username = rng.choice(USERS)
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+    message = {'username': username, 'message': text, 'seq': seq, 'is_ai': username == '川小农'}
+    if rng.random() < 0.05:
+        message['mentioned_users'] = [rng.choice(USERS)]
+    return message
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def time_query(log, queries, rng, **fixed):
+    """执行queries次查询（第二页使用上一页的游标），返回每次耗时(ms)和平均结果数"""
+    samples, counts = [], []
+    for _ in range(queries):
+        kwargs = {key: value(rng) if callable(value) else value for key, value in fixed.items()}
+        started = time.perf_counter()
+        page = log.search(limit=50, **kwargs)
+        if page['next_cursor']:
+            page = log.search(limit=50, cursor=page['next_cursor'], **kwargs)
+        samples.append((time.perf_counter() - started) * 1000)
+        counts.append(len(page['messages']))
+    return samples, statistics.mean(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录写入速率与查询延迟基准')
+    parser.add_argument('--messages', type=int, default=1000000, help='写入的消息条数')
+    parser.add_argument('--queries', type=int, default=200, help='每类查询的执行次数')
+    parser.add_argument('--db', help='数据库路径，默认使用临时文件并在结束后删除')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_chat_log.db')
+    log = ChatLog(path, batch_size=2000, max_queue=CHUNK)
+    rng = random.Random(42)
+
+    started = time.perf_counter()
+    append_seconds = 0.0
+    for offset in range(0, args.messages, CHUNK):
+        messages = [(rng.choice(ROOMS), make_message(rng, offset + i)) for i in range(min(CHUNK, args.messages - offset))]
+        append_started = time.perf_counter()
+        for room, message in messages:
+            log.append(room, message)
+        append_seconds += time.perf_counter() - append_started
+        log.flush()
+    elapsed = time.perf_counter() - started
+    size_mb = sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix)) / 1024 / 1024
+    print(f"写入 {log.written} 条消息: {elapsed:.1f}s，{log.written / elapsed:,.0f} 条/秒，"
+          f"append平均 {append_seconds / args.messages * 1e6:.1f} us/条，丢弃 {log.dropped}，数据库 {size_mb:.0f} MB")
+    print(f"全文索引分词: {log.stats()['tokenizer']}")
+
+    now = time.time()
+    cases = [
+        ('聊天室最近消息', dict(room=lambda r: r.choice(ROOMS))),
+        ('聊天室+时间范围', dict(room=lambda r: r.choice(ROOMS), since=now - elapsed / 2, until=now - elapsed / 4)),
+        ('用户发言', dict(username=lambda r: r.choice(USERS))),
+        ('被@的消息', dict(mention=lambda r: r.choice(USERS))),
+        ('关键词', dict(query=lambda r: r.choice(WORDS))),
+        ('川小农关于关键词的回答', dict(username='川小农', query=lambda r: r.choice(WORDS), since=now - elapsed / 2)),
+        ('聊天室+关键词', dict(room=lambda r: r.choice(ROOMS), query=lambda r: r.choice(WORDS))),
+    ]
+    print(f"{'查询':<20}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'结果数':>8}")
+    for name, fixed in cases:
+        samples, count = time_query(log, args.queries, rng, **fixed)
+        print(f"{name:<20}{percentile(samples, 50):>10.2f}{percentile(samples, 95):>10.2f}"
+              f"{percentile(samples, 99):>10.2f}{count:>8.0f}")
+
+    log.close()
+    if not args.db:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
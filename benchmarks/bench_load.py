@@ -0,0 +1,410 @@
+# 端到端压测
+# 启动本地AI替身服务（fake_llm.py）和一个聊天室服务进程，连接数百个Socket.IO客户端分布到多个聊天室，
+# 按设定速率发言、@其他用户、@川小农提问，统计广播延迟（发送到同聊天室其他客户端收到）的p50/p95/p99、
+# AI回复的首段/完整延迟、吞吐量和服务进程内存，用于离线比较改动前后的性能
+# 用法: python benchmarks/bench_load.py [--clients 200] [--rooms 10] [--duration 30] [--message-rate 0.5]
+#       WIRE_FORMAT=compact python benchmarks/bench_load.py   # 服务进程继承当前环境变量
+#       python benchmarks/bench_load.py --server-url http://127.0.0.1:5000 --server-pid 1234   # 压测已运行的服务
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import socketio
+from engineio import payload
+
+from fake_llm import FakeLLMServer
+
+# 轮询传输时一次响应可能包含大量流式片段，python-engineio客户端默认超过16个包就断开连接（浏览器没有此限制）
+payload.Payload.max_decode_packets = 10000
+# 未安装websocket-client时每个客户端都会输出一条错误日志，只在开始时提示一次
+logging.getLogger('engineio.client').setLevel(logging.CRITICAL)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_USERNAME = '川小农'
+TOKEN_RE = re.compile(r'#L(\d+)-(\d+)')
+# wire_format.py 的短键名（WIRE_FORMAT=compact时）
+LONG_KEYS = {'u': 'username', 'm': 'message', 'id': 'message_id', 'a': 'asker', 'd': 'delta'}
+WORDS = ['今天', '食堂', '的', '饭菜', '不错', '明天', '考试', '加油', '哈哈哈', '有人', '打球', '吗', 'python', '作业']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"服务进程未能在 {timeout}s 内监听端口 {port}")
+
+
+def start_server(port, ai_url, chat_log_path):
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', DEBUG='0', AI_API_URL=ai_url,
+               CHAT_LOG_PATH=chat_log_path)
+    return subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def rss_mb(pid):
+    """进程常驻内存（MB），读取/proc，非Linux系统返回None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(samples):
+    if not samples:
+        return 'n/a'
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    return f"p50 {pick(0.5):.1f} ms, p95 {pick(0.95):.1f} ms, p99 {pick(0.99):.1f} ms, max {ordered[-1] * 1000:.1f} ms"
+
+
+class Stats:
+    """所有客户端共享的计数和延迟样本"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_at = {}  # {(client, n): 发送时刻}
+        self.broadcast = []  # 广播延迟样本（秒），每个接收者一个
+        self.ai_first = []  # 提问到收到ai_thinking后第一段ai_delta
+        self.ai_done = []  # 提问到收到完整回复
+        self.counts = {'sent': 0, 'mentions': 0, 'ai_asked': 0, 'received': 0, 'frames': 0,
+                       'rate_limited': 0, 'ai_errors': 0, 'join_errors': 0, 'disconnects': 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+
+class LoadClient:
+    """一个模拟用户：加入聊天室后按泊松过程发言，记录收到的广播"""
+
+    def __init__(self, index, room, url, stats, args):
+        self.index = index
+        self.username = f'load{index}'
+        self.room = room
+        self.url = url
+        self.stats = stats
+        self.args = args
+        self.random = random.Random(index)
+        self.joined = threading.Event()
+        self.pending_ai = {}  # {问题编号: 提问时刻}
+        self.ai_started = {}  # {message_id: 提问时刻}
+        self.ai_first_seen = set()
+        self.sequence = 0
+        self.peers = []
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('*', self.on_event)
+        self.client.on('disconnect', lambda: stats.count('disconnects'))
+
+    def connect(self):
+        self.client.connect(self.url, wait_timeout=10)
+        self.client.emit('join', {'username': self.username, 'room': self.room})
+
+    def on_event(self, event, data=None):
+        now = time.perf_counter()
+        if event == 'message_batch':
+            self.stats.count('frames')
+            for name, item in decode(data):
+                self.handle(name, item, now)
+            return
+        if event in ('new_message', 'ai_thinking', 'ai_delta', 'ai_done', 'user_joined', 'user_left'):
+            self.stats.count('frames')
+            data = expand(decode_payload(data))
+        self.handle(event, data, now)
+
+    def handle(self, event, data, now):
+        if event == 'welcome_message':
+            self.joined.set()
+        elif event == 'join_error':
+            self.stats.count('join_errors')
+            self.joined.set()
+        elif event == 'rate_limited':
+            self.stats.count('rate_limited')
+        elif event == 'new_message':
+            match = TOKEN_RE.search(data.get('message', ''))
+            if match is None or data.get('username') == BOT_USERNAME:
+                return
+            key = (int(match.group(1)), int(match.group(2)))
+            with self.stats.lock:
+                sent = self.stats.sent_at.get(key)
+                self.stats.counts['received'] += 1
+                if sent is not None and key[0] != self.index:
+                    self.stats.broadcast.append(now - sent)
+        elif event == 'ai_thinking' and data.get('asker') == self.username:
+            # 每个用户同时只有一个提问，按到达顺序对应
+            if self.pending_ai:
+                number = min(self.pending_ai)
+                self.ai_started[data['message_id']] = self.pending_ai.pop(number)
+        elif event == 'ai_delta':
+            started = self.ai_started.get(data.get('message_id'))
+            if started is not None and data['message_id'] not in self.ai_first_seen:
+                self.ai_first_seen.add(data['message_id'])
+                with self.stats.lock:
+                    self.stats.ai_first.append(now - started)
+        elif event == 'ai_done':
+            started = self.ai_started.pop(data.get('message_id'), None)
+            if started is None:
+                return
+            with self.stats.lock:
+                self.stats.ai_done.append(now - started)
+                if data.get('message', '').startswith(('很抱歉', '服务器返回错误')):
+                    self.stats.counts['ai_errors'] += 1
+
+    def run(self, deadline):
+        """按 message_rate 发言，直到deadline"""
+        rate = self.args.message_rate
+        while True:
+            wait = self.random.expovariate(rate) if rate > 0 else deadline
+            if time.perf_counter() + wait >= deadline:
+                return
+            time.sleep(wait)
+            if not self.client.connected:
+                return
+            self.send()
+
+    def send(self):
+        self.sequence += 1
+        token = f'#L{self.index}-{self.sequence}'
+        words = ' '.join(self.random.choices(WORDS, k=self.random.randint(2, 8)))
+        roll = self.random.random()
+        if roll < self.args.ai_ratio and not self.pending_ai:
+            # 问题带编号，避免命中回复缓存
+            text = f'@{BOT_USERNAME} {words} {token}'
+            self.pending_ai[self.sequence] = time.perf_counter()
+            self.stats.count('ai_asked')
+        elif roll < self.args.ai_ratio + self.args.mention_ratio and self.peers:
+            text = f'@{self.random.choice(self.peers)} {words} {token}'
+            self.stats.count('mentions')
+        else:
+            text = f'{words} {token}'
+        with self.stats.lock:
+            self.stats.sent_at[(self.index, self.sequence)] = time.perf_counter()
+            self.stats.counts['sent'] += 1
+        self.client.emit('send_message', {'message': text})
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+def decode_payload(data):
+    """紧凑格式和合并帧的负载是UTF-8 JSON字节"""
+    if isinstance(data, (bytes, bytearray)):
+        return json.loads(bytes(data).decode('utf-8'))
+    return data
+
+
+def decode(data):
+    return [(name, expand(item)) for name, item in decode_payload(data)]
+
+
+def expand(data):
+    if not isinstance(data, dict):
+        return data
+    return {LONG_KEYS.get(key, key): value for key, value in data.items()}
+
+
+def cpu_seconds(pid):
+    """进程已使用的CPU时间（秒），读取/proc，非Linux系统返回None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def run_worker(indexes, url, args, barrier, results):
+    """压测子进程：连接分配到的客户端，与主进程同步后发言，结束后汇报样本和计数
+
+    同一聊天室的客户端都在同一个子进程内，发送和接收时刻用同一个时钟比较
+    """
+    stats = Stats()
+    clients = [LoadClient(i, f'load{i % args.rooms}', url, stats, args) for i in indexes]
+    members = {}
+    for client in clients:
+        members.setdefault(client.room, []).append(client.username)
+    for client in clients:
+        client.peers = [name for name in members[client.room] if name != client.username]
+    connect_rate = args.connect_rate / args.processes
+    started = time.perf_counter()
+    for n, client in enumerate(clients):
+        try:
+            client.connect()
+        except Exception:
+            stats.count('join_errors')
+        delay = started + (n + 1) / connect_rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    for client in clients:
+        client.joined.wait(10)
+    barrier.wait()  # 所有客户端已加入
+    barrier.wait()  # 主进程记录内存后开始发言
+
+    cpu_started = time.process_time()
+    deadline = time.perf_counter() + args.duration
+    workers = [threading.Thread(target=client.run, args=(deadline,), daemon=True) for client in clients]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # 等待在途的广播和AI回复
+    drain_deadline = time.perf_counter() + 5 + args.fake_latency * 4
+    while time.perf_counter() < drain_deadline and any(client.ai_started or client.pending_ai
+                                                        for client in clients):
+        time.sleep(0.1)
+    time.sleep(1)
+    counts = dict(stats.counts)
+    counts['cpu'] = time.process_time() - cpu_started
+    barrier.wait()  # 主进程在客户端断开前结束统计
+    for client in clients:
+        client.close()
+    results.put({'counts': counts, 'broadcast': stats.broadcast,
+                 'ai_first': stats.ai_first, 'ai_done': stats.ai_done})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天室端到端压测：广播延迟、AI回复延迟、吞吐量和内存')
+    parser.add_argument('--clients', type=int, default=200, help='客户端数量')
+    parser.add_argument('--rooms', type=int, default=10, help='聊天室数量，客户端平均分布')
+    parser.add_argument('--duration', type=float, default=30, help='发言阶段持续秒数')
+    parser.add_argument('--message-rate', type=float, default=0.5,
+                        help='每个客户端每秒发言数（注意config中的频率限制）')
+    parser.add_argument('--mention-ratio', type=float, default=0.1, help='@其他用户的消息比例')
+    parser.add_argument('--ai-ratio', type=float, default=0.02, help='@川小农提问的消息比例')
+    parser.add_argument('--connect-rate', type=float, default=50, help='每秒新建连接数')
+    parser.add_argument('--processes', type=int, default=max(1, min(8, (os.cpu_count() or 1) - 1)),
+                        help='运行客户端的子进程数，按聊天室划分（默认CPU核数-1）')
+    parser.add_argument('--server-url', help='压测已运行的服务，不启动服务进程和替身服务')
+    parser.add_argument('--server-pid', type=int, help='配合--server-url，统计该进程的内存和CPU')
+    parser.add_argument('--ai-url', help='服务进程使用的AI上游地址，默认启动本地替身服务')
+    parser.add_argument('--fake-latency', type=float, default=0.5, help='替身服务首字延迟（秒）')
+    parser.add_argument('--fake-token-interval', type=float, default=0.02, help='替身服务流式输出间隔（秒）')
+    parser.add_argument('--fake-error-rate', type=float, default=0.0, help='替身服务错误率')
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, args.rooms))
+    try:
+        import websocket  # noqa: F401
+    except ImportError:
+        print("未安装websocket-client，客户端只使用长轮询传输（pip install websocket-client 可使用WebSocket）")
+
+    fake = None
+    server = None
+    pid = args.server_pid
+    url = args.server_url
+    if url is None:
+        ai_url = args.ai_url
+        if ai_url is None:
+            fake = FakeLLMServer(latency=args.fake_latency, token_interval=args.fake_token_interval,
+                                 error_rate=args.fake_error_rate).start()
+            ai_url = fake.url
+        port = free_port()
+        server = start_server(port, ai_url, os.path.join(tempfile.mkdtemp(), 'chat_log.db'))
+        pid = server.pid
+        url = f'http://127.0.0.1:{port}'
+        wait_for_port(port)
+
+    memory = {'start': rss_mb(pid) if pid else None, 'peak': 0}
+    sampling = threading.Event()
+
+    def sample_memory():
+        while not sampling.wait(0.5):
+            value = rss_mb(pid)
+            if value:
+                memory['peak'] = max(memory['peak'], value)
+
+    if pid:
+        threading.Thread(target=sample_memory, daemon=True).start()
+
+    barrier = multiprocessing.Barrier(args.processes + 1)
+    results = multiprocessing.Queue()
+    processes = []
+    for p in range(args.processes):
+        indexes = [i for i in range(args.clients) if (i % args.rooms) % args.processes == p]
+        processes.append(multiprocessing.Process(target=run_worker, args=(indexes, url, args, barrier, results),
+                                                 daemon=True))
+    reports = []
+    try:
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        barrier.wait(timeout=args.clients / args.connect_rate + 60)
+        memory['joined'] = rss_mb(pid) if pid else None
+        print(f"{args.clients} 个客户端已加入 {args.rooms} 个聊天室（{args.processes} 个压测进程），"
+              f"用时 {time.perf_counter() - started:.1f}s")
+
+        server_cpu = cpu_seconds(pid) if pid else None
+        started = time.perf_counter()
+        barrier.wait()
+        barrier.wait(timeout=args.duration + 60)
+        elapsed = time.perf_counter() - started
+        if server_cpu is not None:
+            server_cpu = cpu_seconds(pid) - server_cpu
+        reports = [results.get(timeout=30) for _ in processes]
+    finally:
+        sampling.set()
+        for process in processes:
+            process.join(10)
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+    counts = {}
+    samples = {'broadcast': [], 'ai_first': [], 'ai_done': []}
+    for report in reports:
+        for key, value in report['counts'].items():
+            counts[key] = counts.get(key, 0) + value
+        for key in samples:
+            samples[key].extend(report[key])
+    # @川小农的提问不作为普通消息广播；发言阶段包含等待在途消息的时间，按发言时长计算速率
+    expected = (counts['sent'] - counts['ai_asked']) * (args.clients / args.rooms - 1)
+    print(f"发言阶段 {args.duration:.0f}s: 发送 {counts['sent']} 条（@用户 {counts['mentions']}，"
+          f"@川小农 {counts['ai_asked']}），被限流 {counts['rate_limited']} 次，"
+          f"意外断线 {counts['disconnects']}，连接/加入失败 {counts['join_errors']}")
+    print(f"吞吐量: 发送 {counts['sent'] / args.duration:.1f} 条/s，投递 {len(samples['broadcast']) / args.duration:.1f} 条/s"
+          f"（收到 {len(samples['broadcast'])} / 预期约 {expected:.0f}），收到帧 {counts['frames']}")
+    print(f"广播延迟: {percentiles(samples['broadcast'])}")
+    print(f"AI首段延迟: {percentiles(samples['ai_first'])}")
+    print(f"AI完整回复: {percentiles(samples['ai_done'])}（{len(samples['ai_done'])}/{counts['ai_asked']} 个提问完成，"
+          f"错误提示 {counts['ai_errors']}）")
+    if fake is not None:
+        print(f"替身服务: {fake.stats()}")
+        fake.stop()
+    if server_cpu is not None:
+        # 压测进程与服务进程在同一台机器上争用CPU，压测进程占用过高时延迟主要来自客户端本身
+        print(f"CPU占用: 服务进程 {server_cpu / elapsed:.0%}，压测进程合计 {counts['cpu'] / elapsed:.0%}"
+              f"（{os.cpu_count()} 核）")
+    if pid and memory['start']:
+        print(f"服务进程内存: 启动 {memory['start']:.1f} MB，全部加入后 {memory['joined'] or 0:.1f} MB，"
+              f"峰值 {memory['peak']:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
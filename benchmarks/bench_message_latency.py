@@ -0,0 +1,100 @@
+# 消息处理延迟基准
+# 在进程内用Socket.IO测试客户端加入聊天室并发送@川小农的消息，测量事件处理函数的耗时：
+# 发送者自己的消息广播、欢迎消息应立即到达，机器人的欢迎语和@回复应在BOT_REPLY_DELAY之后由后台发送
+# 用法: python benchmarks/bench_message_latency.py [--rounds 50] [--budget-ms 50]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('CHAT_LOG_PATH', '')  # 基准测试不写入聊天记录
+
+import config  # noqa: E402
+from app import app, socketio, BOT_USERNAME  # noqa: E402
+
+
+def wait_for(client, received, predicate, timeout):
+    """收集客户端收到的事件，直到出现满足predicate的事件，返回等待秒数（超时返回None）"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        received.extend(client.get_received())
+        if any(predicate(event) for event in received):
+            return time.perf_counter() - started
+        socketio.sleep(0.01)
+    return None
+
+
+def is_bot_message(event):
+    return event['name'] == 'new_message' and event['args'][0]['username'] == BOT_USERNAME
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量加入聊天室和@川小农时事件处理函数的延迟')
+    parser.add_argument('--rounds', type=int, default=50, help='测量轮数')
+    parser.add_argument('--budget-ms', type=float, default=50, help='处理函数耗时p95上限（毫秒）')
+    args = parser.parse_args()
+
+    join_ms, send_ms, bot_delays = [], [], []
+    failures = []
+    for i in range(args.rounds):
+        client = socketio.test_client(app)
+        received = []
+
+        # 加入聊天室：处理函数返回时欢迎消息已到达，机器人欢迎语尚未发送
+        started = time.perf_counter()
+        client.emit('join', {'username': f'latency{i}', 'room': 'latency'})
+        join_ms.append((time.perf_counter() - started) * 1000)
+        received.extend(client.get_received())
+        if not any(event['name'] == 'welcome_message' for event in received):
+            failures.append(f"第{i}轮: 加入后未立即收到欢迎消息")
+        received.clear()
+
+        # 发送@川小农的消息：处理函数返回时发送者自己的消息已广播
+        text = f'你好 @{BOT_USERNAME} {i}'
+        started = time.perf_counter()
+        client.emit('send_message', {'message': text})
+        send_ms.append((time.perf_counter() - started) * 1000)
+        received.extend(client.get_received())
+        if not any(event['name'] == 'new_message' and event['args'][0]['message'] == text for event in received):
+            failures.append(f"第{i}轮: 发送者的消息未立即广播")
+        if any(is_bot_message(event) for event in received):
+            failures.append(f"第{i}轮: 机器人回复早于发送者的消息")
+        received.clear()
+
+        # 机器人的回复应在延迟之后由后台任务送达
+        if i < 3:
+            delay = wait_for(client, received, is_bot_message, timeout=config.BOT_REPLY_DELAY + 2)
+            if delay is None:
+                failures.append(f"第{i}轮: 未收到机器人的延迟回复")
+            else:
+                bot_delays.append(delay)
+        client.disconnect()
+
+    def describe(samples):
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"p50 {statistics.median(ordered):.2f} ms, p95 {p95:.2f} ms", p95
+
+    join_text, join_p95 = describe(join_ms)
+    send_text, send_p95 = describe(send_ms)
+    print(f"加入聊天室处理耗时: {join_text}")
+    print(f"发送@{BOT_USERNAME}消息处理耗时: {send_text}")
+    if bot_delays:
+        print(f"机器人回复在消息之后 {statistics.mean(bot_delays):.2f} s 送达（配置延迟 {config.BOT_REPLY_DELAY} s）")
+    if join_p95 > args.budget_ms or send_p95 > args.budget_ms:
+        failures.append(f"处理耗时超过 {args.budget_ms:.0f} ms")
+
+    if failures:
+        for failure in failures:
+            print(f"失败: {failure}")
+        os._exit(1)
+    print("通过")
+    # 后台任务是非守护线程，直接退出进程
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# 消息解析微基准
+# 按真实聊天的消息构成（普通消息、@用户、@川小农提问、@电影链接、带链接的消息）生成样本，
+# 比较原先多次正则扫描的解析方式与 message_parser.parse_message 单次扫描的每条消息CPU耗时，
+# 并检查典型消息的处理方式（@川小农提问、@电影、广播为普通消息）
+# 用法: python benchmarks/bench_message_parser.py [--messages 20000] [--repeat 5]
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from message_parser import parse_message, is_url  # noqa: E402
+
+USERS = ['小明', '小红', 'alice', 'bob', '川小农']
+WORDS = ['今天', '食堂', '的', '饭菜', '不错', '明天', '考试', '加油', '哈哈哈', '有人', '打球', '吗',
+         'python', '作业', '写完了', '没有', '图书馆', '见']
+URLS = ['https://v.qq.com/x/cover/abc123.html', 'https://www.bilibili.com/video/BV1xx411c7mD?p=2',
+        'www.iqiyi.com/v_19rr7qhf3k.html']
+
+# (权重, 生成函数)
+MIX = [
+    (70, lambda r: ' '.join(r.choices(WORDS, k=r.randint(2, 12)))),
+    (12, lambda r: f"@{r.choice(USERS[:4])} {' '.join(r.choices(WORDS, k=r.randint(2, 8)))}"),
+    (3, lambda r: f"{' '.join(r.choices(WORDS, k=4))} @{r.choice(USERS[:4])}，{r.choice(WORDS)}"),
+    (6, lambda r: f"@川小农 {' '.join(r.choices(WORDS, k=r.randint(3, 10)))}？"),
+    (2, lambda r: f"@川小农{''.join(r.choices(WORDS, k=r.randint(3, 10)))}？"),
+    (4, lambda r: f"@电影 `{r.choice(URLS)}`"),
+    (3, lambda r: f"{' '.join(r.choices(WORDS, k=3))} {r.choice(URLS)}"),
+]
+
+
+# (消息, 应得到的处理方式)；消息中的用户都不在线
+# 处理方式: ('ai', 问题)、('movie', 链接)、('message', None) 广播为普通消息、(None, None) 丢弃
+CASES = [
+    ('@川小农 你好', ('ai', '你好')),
+    ('@川小农你好', ('ai', '你好')),
+    ('@川小农，今天食堂吃什么', ('ai', '今天食堂吃什么')),
+    ('@路人 @川小农 帮我写首诗', ('ai', '帮我写首诗')),
+    ('@路人 看 http://x.com/@川小农 和 @川小农 hi', ('ai', 'hi')),
+    ('see http://x.com/@川小农 and @川小农 hi', ('message', None)),
+    ('@电影 https://v.qq.com/x/cover/abc123.html', ('movie', 'https://v.qq.com/x/cover/abc123.html')),
+    ('今天 @川小农 在吗', ('message', None)),
+    ('@ hello', ('message', None)),
+    ('@，你好', ('message', None)),
+    ('@ 川小农 hi', ('ai', 'hi')),
+]
+
+
+def legacy_parse(message):
+    """原先 handle_message / handle_special_command / handle_movie_command 中的解析步骤，返回处理方式"""
+    import re
+    if '@' in message:
+        re.findall(r'@(\S+)', message)
+    if not message.startswith('@'):
+        return 'message', None
+    match = re.match(r'@(.+?)(\s+.*)?$', message)
+    if not match:
+        if '@川小农' in message:
+            return 'ai', message.split('@川小农', 1)[1].strip()
+        return None, None
+    command = match.group(1).strip()
+    params = (match.group(2) or '').strip().replace('`', '')
+    if command == '电影':
+        import urllib.parse  # noqa: F401
+        re.match(r'^(https?://|www\.)\S+$', params.replace('`', ''))
+        return 'movie', params
+    elif command == '川小农':
+        return 'ai', params
+    elif command not in USERS[:4] and '@川小农' in message:
+        return 'ai', message.split('@川小农', 1)[1].lstrip()
+    return 'message', None
+
+
+def current_parse(message):
+    """现在的解析步骤：一次扫描，处理函数只读取解析结果，返回处理方式"""
+    parsed = parse_message(message, reserved=('川小农',))
+    if parsed.command is None:
+        return 'message', None
+    if parsed.command == '电影':
+        is_url(parsed.params)
+        return 'movie', parsed.params
+    elif parsed.command == '川小农':
+        return 'ai', parsed.params
+    elif parsed.command not in USERS[:4] and parsed.addresses('川小农'):
+        return 'ai', parsed.text_after('川小农')
+    return 'message', None
+
+
+def measure(func, messages, repeat):
+    """返回最快一轮的每条消息耗时（微秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - started)
+    return best / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息解析每条消息的CPU耗时')
+    parser.add_argument('--messages', type=int, default=20000, help='样本消息条数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复轮数，取最快一轮')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    weights = [weight for weight, _ in MIX]
+    makers = [maker for _, maker in MIX]
+    messages = [rng.choices(makers, weights)[0](rng) for _ in range(args.messages)]
+
+    print("典型消息的处理方式（原解析方式 / 单次扫描 / 期望）:")
+    failures = 0
+    for message, expected in CASES:
+        legacy_result, current_result = legacy_parse(message), current_parse(message)
+        ok = current_result == expected
+        failures += not ok
+        print(f"  {'ok ' if ok else '错误'} {message!r}: {legacy_result} / {current_result} / {expected}")
+
+    legacy = measure(legacy_parse, messages, args.repeat)
+    current = measure(current_parse, messages, args.repeat)
+    print(f"样本: {args.messages} 条消息（普通70%，@用户15%，@川小农8%，@电影4%，带链接3%）")
+    print(f"原解析方式: {legacy:.2f} us/条")
+    print(f"单次扫描解析: {current:.2f} us/条（{legacy / current:.1f}x）")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
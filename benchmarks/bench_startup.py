@@ -0,0 +1,73 @@
+# 聊天室服务启动耗时基准
+# 使用 python -X importtime 统计 import app 的导入耗时，并检查不应加载的重量级依赖
+# 用法: python benchmarks/bench_startup.py [--budget-ms 1500] [--top 15]
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 聊天室服务不应加载的模块（Gradio界面及其依赖栈）
+FORBIDDEN_MODULES = ('gradio', 'fastapi', 'pydantic', 'uvicorn', 'pandas', 'matplotlib')
+
+
+def measure_imports(module):
+    """在新进程中导入module，返回[(模块名, 自身耗时us, 累计耗时us)]"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True,
+        env=dict(os.environ, CHAT_LOG_PATH='')  # 不在仓库目录下创建聊天记录数据库
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"导入 {module} 失败")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        # 格式: "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        rows.append((parts[2][1:].rstrip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='统计聊天室服务的导入耗时')
+    parser.add_argument('--module', default='app', help='要导入的模块')
+    parser.add_argument('--budget-ms', type=float, default=1500, help='导入总耗时上限（毫秒）')
+    parser.add_argument('--top', type=int, default=15, help='显示累计耗时最多的N个直接依赖')
+    args = parser.parse_args()
+
+    rows = measure_imports(args.module)
+    total_ms = sum(self_us for _, self_us, _ in rows) / 1000
+
+    # importtime每层嵌套缩进两个空格，这里只列出被测模块直接导入的模块
+    top_level = sorted(
+        (r for r in rows if r[0].startswith('  ') and not r[0].startswith('   ')),
+        key=lambda r: r[2], reverse=True
+    )
+    print(f"import {args.module}: 共 {len(rows)} 个模块, 总耗时 {total_ms:.1f} ms")
+    for name, _, cumulative in top_level[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+
+    loaded = {name.strip().split('.')[0] for name, _, _ in rows}
+    forbidden = sorted(loaded.intersection(FORBIDDEN_MODULES))
+
+    failed = False
+    if forbidden:
+        print(f"错误: 启动时加载了不应导入的模块: {', '.join(forbidden)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"错误: 导入耗时 {total_ms:.1f} ms 超出预算 {args.budget_ms:.0f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# 页面与静态资源基准
+# 模拟浏览器依次打开登录页和聊天室页面，统计首次访问和再次访问（带缓存重新验证）时每次页面加载的请求数和传输字节数，
+# 以及登录页、样式表、聊天室页面每秒可处理的请求数（单线程，Flask测试客户端，不含网络开销）；
+# 外部CDN上的Socket.IO客户端和图标字体不计入
+# 用法: python benchmarks/bench_static.py [--duration 2]
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('CHAT_LOG_PATH', '')
+os.environ['DEBUG'] = '0'
+
+import config  # noqa: E402
+import app as chat_app  # noqa: E402
+import static_assets  # noqa: E402
+
+CHAT_URL = '/chat?username=bench&room=public'
+ASSET_RE = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+
+
+class Browser:
+    """带HTTP缓存的浏览器：按Cache-Control缓存响应，no-cache的内容用If-None-Match重新验证；use_cache为False时不缓存"""
+
+    def __init__(self, client, accept_encoding, use_cache=True):
+        self.client = client
+        self.accept_encoding = accept_encoding
+        self.use_cache = use_cache
+        self.cache = {}  # {url: (etag, immutable, body)}
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, url):
+        cached = self.cache.get(url)
+        if cached is not None and cached[1]:
+            return cached[2]
+        headers = {'Accept-Encoding': self.accept_encoding} if self.accept_encoding else {}
+        if cached is not None and cached[0]:
+            headers['If-None-Match'] = f'"{cached[0]}"'
+        response = self.client.get(url, headers=headers)
+        self.requests += 1
+        self.bytes += len(response.data)
+        if response.status_code == 304:
+            return cached[2]
+        body = decode(response)
+        cache_control = response.headers.get('Cache-Control', '')
+        etag = response.headers.get('ETag', '').strip('"')
+        if self.use_cache and (etag or 'max-age' in cache_control):
+            self.cache[url] = (etag, 'immutable' in cache_control, body)
+        return body
+
+    def load(self, url):
+        """加载页面及其引用的本地静态资源，返回本次加载的(请求数, 字节数)"""
+        requests, size = self.requests, self.bytes
+        html = self.get(url)
+        for asset in ASSET_RE.findall(html):
+            self.get(asset)
+        return self.requests - requests, self.bytes - size
+
+
+def decode(response):
+    encoding = response.headers.get('Content-Encoding')
+    data = response.data
+    if encoding == 'gzip':
+        data = gzip.decompress(data)
+    elif encoding == 'br':
+        data = static_assets._load_brotli().decompress(data)
+    return data.decode('utf-8')
+
+
+def page_loads(client, accept_encoding, cached):
+    """登录页+聊天室页面的首次访问和再次访问，cached为False时模拟不使用HTTP缓存"""
+    browser = Browser(client, accept_encoding, use_cache=cached)
+    first = [browser.load('/'), browser.load(CHAT_URL)]
+    again = [browser.load('/'), browser.load(CHAT_URL)]
+    return first, again
+
+
+def throughput(client, url, duration, headers=None):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for _ in range(50):
+            response = client.get(url, headers=headers or {})
+            assert response.status_code in (200, 304), (url, response.status_code)
+        count += 50
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='页面与静态资源基准')
+    parser.add_argument('--duration', type=float, default=2, help='每项吞吐量测试的时长（秒）')
+    args = parser.parse_args()
+
+    client = chat_app.app.test_client()
+    scenarios = [('不压缩、不使用缓存', None, False), ('gzip', 'gzip, deflate', True)]
+    if static_assets._load_brotli():
+        scenarios.append(('brotli', 'gzip, deflate, br', True))
+
+    print("每次页面加载的请求数/响应体字节数（先打开登录页，再进入聊天室页面）:")
+    for name, accept_encoding, cached in scenarios:
+        first, again = page_loads(client, accept_encoding, cached)
+        for label, loads in (('首次访问', first), ('再次访问', again)):
+            (login_requests, login_bytes), (chat_requests, chat_bytes) = loads
+            print(f"  {name:<10} {label}: 登录页 {login_requests} 个请求 {login_bytes:>6} B，"
+                  f"聊天室 {chat_requests} 个请求 {chat_bytes:>6} B")
+
+    gzip_headers = {'Accept-Encoding': 'gzip'}
+    login = client.get('/', headers=gzip_headers)
+    css_url = ASSET_RE.findall(decode(login))[0]
+    css = client.get(css_url, headers=gzip_headers)
+    print("\n每秒请求数（单线程）:")
+    config.STATIC_RELOAD = True
+    print(f"  登录页（每次渲染）        {throughput(client, '/', args.duration):>8.0f}")
+    config.STATIC_RELOAD = False
+    client.get('/')
+    print(f"  登录页（缓存渲染结果）    {throughput(client, '/', args.duration):>8.0f}")
+    print(f"  登录页（gzip）            {throughput(client, '/', args.duration, gzip_headers):>8.0f}")
+    print(f"  登录页（304）             "
+          f"{throughput(client, '/', args.duration, dict(gzip_headers, **{'If-None-Match': login.headers['ETag']})):>8.0f}")
+    print(f"  样式表（gzip）            {throughput(client, css_url, args.duration, gzip_headers):>8.0f}")
+    print(f"  样式表（304）             "
+          f"{throughput(client, '/static/css/style.css', args.duration, dict(gzip_headers, **{'If-None-Match': css.headers['ETag']})):>8.0f}")
+    print(f"  聊天室页面（gzip）        {throughput(client, CHAT_URL, args.duration, gzip_headers):>8.0f}")
+
+    chat_app.ai_queue.stop()
+    chat_app.delayed_tasks.stop()
+    chat_app.room_emitter.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# 传输格式基准
+# 模拟一个有R个在线用户的聊天室广播1000条消息，按Socket.IO实际的包编码方式统计
+# 默认JSON格式与紧凑格式（wire_format）、以及开启广播合并时的传输字节数和服务端编码CPU耗时；
+# CPU耗时分别按python-socketio默认的每个接收者各编码一次数据包，和broadcast_manager的每次广播只编码一次统计
+# 用法: python benchmarks/bench_wire_format.py [--recipients 50] [--messages 1000] [--batch 20]
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from socketio import packet  # noqa: E402
+
+from broadcast_manager import _EncodedPacket  # noqa: E402
+
+import wire_format  # noqa: E402
+
+USERS = ['小明', '小红', 'alice', 'bob', '川小农']
+WORDS = ['今天', '食堂', '的', '饭菜', '不错', '明天', '考试', '加油', '哈哈哈', '有人', '打球', '吗', 'python', '作业']
+
+
+def make_events(count, rng):
+    """按真实聊天的构成生成聊天室广播事件 [(event, data, 产生时刻的毫秒时间戳), ...]"""
+    events = []
+    created_ms = int(time.time() * 1000)
+    for seq in range(1, count + 1):
+        kind = rng.random()
+        data = {'username': rng.choice(USERS[:4]), 'timestamp': time.strftime('%H:%M:%S'), 'seq': seq}
+        if kind < 0.75:
+            data.update(message=' '.join(rng.choices(WORDS, k=rng.randint(2, 10))), mentioned_users=[])
+            events.append(('new_message', data, created_ms + seq))
+        elif kind < 0.85:
+            target = rng.choice(USERS[:4])
+            data.update(message=f'@{target} ' + ' '.join(rng.choices(WORDS, k=4)), mentioned_users=[target])
+            events.append(('new_message', data, created_ms + seq))
+        elif kind < 0.95:
+            data.update(username='川小农', message='，'.join(rng.choices(WORDS, k=rng.randint(10, 40))),
+                        is_ai=True, message_id='%032x' % rng.getrandbits(128))
+            events.append(('ai_done', data, created_ms + seq))
+        elif kind < 0.98:
+            data.update(username='系统', message='[alice 分享了一个电影链接]', is_system=True, is_movie=True,
+                        movie_url='https://jx.m3u8.tv/jiexi/?url=https%3A%2F%2Fv.qq.com%2Fx%2Fcover%2Fabc.html')
+            events.append(('new_message', data, created_ms + seq))
+        else:
+            events.append((rng.choice(['user_joined', 'user_left']),
+                           {'username': rng.choice(USERS[:4]), 'timestamp': data['timestamp'], 'version': seq},
+                           created_ms + seq))
+    return events
+
+
+def frame_bytes(encoded):
+    """Socket.IO包编码结果在websocket上的字节数：文本帧 + 每个二进制附件一帧"""
+    if isinstance(encoded, list):
+        return len(encoded[0].encode('utf-8')) + sum(len(attachment) for attachment in encoded[1:])
+    return len(encoded.encode('utf-8'))
+
+
+def send(event, payload, recipients, once):
+    """模拟向每个接收者发送一次：once为False时对每个接收者分别编码数据包（python-socketio默认），
+    为True时只编码一次、每个接收者取同一份编码结果（broadcast_manager）
+    """
+    total = 0
+    if once:
+        encoded = _EncodedPacket(packet.Packet(packet.EVENT, data=[event, payload], namespace='/'))
+        for _ in range(recipients):
+            total += frame_bytes(encoded.encode())
+        return total
+    for _ in range(recipients):
+        total += frame_bytes(packet.Packet(packet.EVENT, data=[event, payload], namespace='/').encode())
+    return total
+
+
+def run(mode, events, recipients, batch_size, once):
+    started = time.perf_counter()
+    total = 0
+    frames = 0
+    chunks = [events[i:i + batch_size] for i in range(0, len(events), batch_size)] if batch_size > 1 else None
+    if mode == 'json':
+        for event, data, _ in events:
+            total += send(event, data, recipients, once)
+            frames += 1
+    elif mode == 'compact':
+        for event, data, created_ms in events:
+            total += send(event, wire_format.encode(data, created_ms), recipients, once)
+            frames += 1
+    elif mode == 'json+batch':
+        for chunk in chunks:
+            payload = json.dumps([[event, data] for event, data, _ in chunk],
+                                 ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            total += send('message_batch', payload, recipients, once)
+            frames += 1
+    elif mode == 'compact+batch':
+        for chunk in chunks:
+            total += send('message_batch', wire_format.encode_batch(chunk), recipients, once)
+            frames += 1
+    elapsed = time.perf_counter() - started
+    return total, frames * recipients, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较聊天室广播的传输字节数和编码CPU耗时')
+    parser.add_argument('--recipients', type=int, default=50, help='聊天室在线人数')
+    parser.add_argument('--messages', type=int, default=1000, help='广播的事件数')
+    parser.add_argument('--batch', type=int, default=20, help='开启合并时每帧的事件数')
+    args = parser.parse_args()
+
+    events = make_events(args.messages, random.Random(3))
+    print(f"{args.messages} 个广播事件，{args.recipients} 个接收者，合并时每帧 {args.batch} 个事件")
+    print("每千条CPU: 每个接收者各编码一次数据包 / 每次广播只编码一次（broadcast_manager）")
+    print(f"{'格式':<16}{'总字节':>12}{'每条每人(B)':>14}{'帧数':>10}{'每千条CPU(ms)':>24}")
+    baseline = None
+    for mode in ('json', 'compact', 'json+batch', 'compact+batch'):
+        total, frames, per_recipient = run(mode, events, args.recipients, args.batch, once=False)
+        _, _, once = run(mode, events, args.recipients, args.batch, once=True)
+        baseline = baseline or total
+        per_message = total / args.messages / args.recipients
+        cpu = f"{per_recipient / args.messages * 1e6:.1f} / {once / args.messages * 1e6:.1f}"
+        print(f"{mode:<16}{total:>12,}{per_message:>14.1f}{frames:>10,}{cpu:>24}  ({total / baseline:.0%})")
+
+
+if __name__ == '__main__':
+    main()
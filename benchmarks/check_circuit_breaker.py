@@ -0,0 +1,120 @@
+# AI上游熔断检查
+# 使用本地替身服务模拟SiliconFlow持续出错和响应缓慢，检查熔断、降级回复、半开探测恢复和时间预算：
+# 1. 上游持续返回503时，失败率达到阈值后熔断；
+# 2. 熔断期间的问题不请求上游，立即得到缓存的回答（即使已过期）或繁忙提示；
+# 3. 熔断时间过后放行探测请求，上游恢复后熔断器关闭；
+# 4. 上游响应比时间预算慢时，在预算内返回失败提示；
+# 5. 熔断前放行的慢请求在半开状态下才结束时，不改变熔断器状态，也不多放行探测请求
+# 用法: python benchmarks/check_circuit_breaker.py [--stream] [--deadline 1]
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+import config  # noqa: E402
+import simple_ai  # noqa: E402
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN  # noqa: E402
+from fake_llm import FakeLLMServer  # noqa: E402
+
+
+def ask(bot, question, stream):
+    """提问并返回(回复, 耗时毫秒)"""
+    started = time.perf_counter()
+    if stream:
+        reply = ''.join(bot.stream_response(question, 'checker'))
+    else:
+        reply = bot.get_response(question, 'checker')
+    return reply, (time.perf_counter() - started) * 1000
+
+
+def check_stale_results(failures):
+    """熔断前放行的请求在半开状态下结束：结果不影响熔断器，探测名额不变"""
+    breaker = CircuitBreaker(window=4, min_calls=2, failure_rate=0.5, open_seconds=0.05, half_open_probes=1)
+    slow = [breaker.allow(), breaker.allow()]
+    for permit in (breaker.allow(), breaker.allow()):
+        breaker.record_failure(permit)
+    time.sleep(0.1)
+    probe = breaker.allow()
+    breaker.record_success(slow[0])
+    breaker.record_failure(slow[1])
+    if breaker.state != HALF_OPEN or breaker.allow() is not None:
+        failures.append(f"熔断前放行的慢请求改变了半开状态: {breaker.stats()}")
+    breaker.record_success(probe)
+    if breaker.state != CLOSED:
+        failures.append(f"探测请求成功后熔断器未关闭: {breaker.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI上游熔断检查')
+    parser.add_argument('--stream', action='store_true', help='使用流式接口提问')
+    parser.add_argument('--open-seconds', type=float, default=1.0, help='熔断持续时间（秒）')
+    parser.add_argument('--deadline', type=float, default=1.0, help='上游请求的时间预算（秒）')
+    args = parser.parse_args()
+
+    server = FakeLLMServer(latency=0.02, jitter=0, tokens=3, token_interval=0.01, error_status=503).start()
+    simple_ai.api_url = server.url
+    config.AI_RETRY_BACKOFF = 0.05
+    config.AI_DEADLINE = args.deadline
+    simple_ai.breaker = breaker = CircuitBreaker(window=10, min_calls=4, failure_rate=0.5,
+                                                 open_seconds=args.open_seconds, half_open_probes=1)
+    bot = simple_ai.bot_ai
+    bot.cache.ttl = 0.2
+    failures = []
+    try:
+        # 上游正常时缓存一个回答，随后让它过期
+        cached, _ = ask(bot, '川农在哪里？', args.stream)
+        time.sleep(0.3)
+
+        # 上游持续出错，直到熔断
+        server.error_rate = 1.0
+        failed_ms = []
+        for i in range(10):
+            if breaker.state == OPEN:
+                break
+            failed_ms.append(ask(bot, f'第{i}个问题', args.stream)[1])
+        if breaker.state != OPEN:
+            failures.append(f"连续失败后未熔断: {breaker.stats()}")
+
+        # 熔断期间不请求上游，立即降级回复
+        upstream_before = server.stats()['requests']
+        stale, stale_ms = ask(bot, '川农在哪里', args.stream)
+        busy, busy_ms = ask(bot, '一个新问题', args.stream)
+        if server.stats()['requests'] != upstream_before:
+            failures.append("熔断期间仍在请求上游")
+        if not stale.startswith(cached):
+            failures.append(f"熔断期间未使用缓存的回答: {stale!r}")
+        if busy != simple_ai.BUSY_REPLY:
+            failures.append(f"熔断期间未返回繁忙提示: {busy!r}")
+
+        # 熔断时间过后放行探测请求，上游恢复后关闭
+        server.error_rate = 0.0
+        time.sleep(args.open_seconds + 0.1)
+        probe, _ = ask(bot, '恢复了吗', args.stream)
+        if breaker.state != CLOSED or not probe.startswith('收到你的问题'):
+            failures.append(f"上游恢复后熔断器未关闭: {breaker.stats()} {probe!r}")
+
+        # 上游比时间预算慢时在预算内放弃
+        server.latency = args.deadline * 3
+        slow, slow_ms = ask(bot, '慢问题', args.stream)
+        if slow_ms > args.deadline * 1000 * 1.5:
+            failures.append(f"超出时间预算: {slow_ms:.0f} ms > {args.deadline * 1000:.0f} ms")
+    finally:
+        server.stop()
+    check_stale_results(failures)
+
+    print(f"熔断前的失败请求 {len(failed_ms)} 次，平均耗时 {sum(failed_ms) / max(len(failed_ms), 1):.0f} ms")
+    print(f"熔断期间降级回复耗时: 缓存的回答 {stale_ms:.1f} ms，繁忙提示 {busy_ms:.1f} ms")
+    print(f"上游慢于时间预算时耗时 {slow_ms:.0f} ms: {slow}")
+    print(f"熔断器: {breaker.stats()}")
+    if failures:
+        for failure in failures:
+            print(f"失败: {failure}")
+        sys.exit(1)
+    print("通过")
+
+
+if __name__ == '__main__':
+    main()
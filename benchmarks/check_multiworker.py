@@ -0,0 +1,142 @@
+# 多进程部署检查
+# 在本机启动N个聊天室服务进程（共享同一个Redis消息队列），每个进程连接一个客户端，
+# 检查跨进程的消息广播、在线列表共享和用户名唯一性
+# 用法: python benchmarks/check_multiworker.py --redis-url redis://localhost:6379/0
+#       python benchmarks/check_multiworker.py --fake   # 使用fakeredis在本地模拟Redis（需 pip install fakeredis lupa）
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake_redis():
+    """启动fakeredis的TCP服务作为本地Redis替身，返回redis://地址"""
+    from fakeredis import TcpFakeServer
+    port = free_port()
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'redis://127.0.0.1:{port}/0'
+
+
+def start_worker(port, redis_url, prefix, chat_log_path):
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', DEBUG='0',
+               SOCKETIO_MESSAGE_QUEUE=redis_url, STATE_KEY_PREFIX=prefix, CHAT_LOG_PATH=chat_log_path)
+    return subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"服务进程未能在 {timeout}s 内监听端口 {port}")
+
+
+class Recorder:
+    """连接到某个服务进程的测试客户端，记录收到的事件"""
+
+    def __init__(self, port):
+        self.events = []
+        self.client = socketio.Client()
+        self.client.on('*', lambda event, data: self.events.append((event, data)))
+        self.client.connect(f'http://127.0.0.1:{port}', transports=['polling'])
+
+    def received(self, event, predicate=lambda data: True):
+        return [data for name, data in self.events if name == event and predicate(data)]
+
+    def wait_for(self, event, predicate=lambda data: True, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            found = self.received(event, predicate)
+            if found:
+                return found[0]
+            time.sleep(0.05)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查多进程部署下的跨进程消息投递')
+    parser.add_argument('--workers', type=int, default=3, help='服务进程数量')
+    parser.add_argument('--redis-url', default=os.environ.get('SOCKETIO_MESSAGE_QUEUE'), help='Redis地址')
+    parser.add_argument('--fake', action='store_true', help='使用fakeredis模拟Redis')
+    args = parser.parse_args()
+
+    redis_url = start_fake_redis() if args.fake else args.redis_url
+    if not redis_url:
+        raise SystemExit("请通过 --redis-url 指定Redis地址，或使用 --fake")
+
+    prefix = f'jamp-check-{uuid.uuid4().hex[:8]}:'
+    ports = [free_port() for _ in range(args.workers)]
+    # 所有进程写入同一个临时聊天记录数据库，同时检查多进程同时建表
+    chat_log_path = os.path.join(tempfile.mkdtemp(), 'chat_log.db')
+    workers = [start_worker(port, redis_url, prefix, chat_log_path) for port in ports]
+    clients = []
+    failures = []
+    try:
+        for port in ports:
+            wait_for_port(port)
+        clients = [Recorder(port) for port in ports]
+
+        # 每个进程上各加入一个用户
+        for i, recorder in enumerate(clients):
+            recorder.client.emit('join', {'username': f'user{i}'})
+            if recorder.wait_for('welcome_message') is None:
+                failures.append(f"user{i} 未收到欢迎消息")
+
+        # 最后加入的用户应在快照中看到所有进程上的用户
+        snapshot = clients[-1].received('welcome_message')
+        expected = {f'user{i}' for i in range(args.workers)}
+        if snapshot and not expected.issubset(snapshot[0]['presence']['users']):
+            failures.append(f"在线列表未跨进程共享: {snapshot[0]['presence']['users']}")
+
+        # 用户名在所有进程间唯一
+        duplicate = Recorder(ports[-1])
+        clients.append(duplicate)
+        duplicate.client.emit('join', {'username': 'user0'})
+        if duplicate.wait_for('join_error') is None:
+            failures.append("其他进程上已占用的用户名仍可加入")
+
+        # 第一个进程上的用户发言，所有进程上的用户都应收到
+        text = f'hello-{uuid.uuid4().hex[:6]}'
+        started = time.monotonic()
+        clients[0].client.emit('send_message', {'message': text})
+        for i, recorder in enumerate(clients[:args.workers]):
+            if recorder.wait_for('new_message', lambda data: data.get('message') == text) is None:
+                failures.append(f"进程{i}上的user{i}未收到跨进程消息")
+        elapsed_ms = (time.monotonic() - started) * 1000
+    finally:
+        for recorder in clients:
+            recorder.client.disconnect()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait(timeout=10)
+
+    if failures:
+        for failure in failures:
+            print(f"失败: {failure}")
+        sys.exit(1)
+    print(f"通过: {args.workers} 个服务进程间广播正常，全部送达耗时 {elapsed_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# 本地AI上游替身服务
+# 模拟SiliconFlow的 /v1/chat/completions 接口（OpenAI兼容），支持普通和流式（SSE）响应，
+# 可配置首字延迟、逐段输出间隔和错误率，用于离线压测和基准测试，不消耗真实API额度
+# 用法: python benchmarks/fake_llm.py [--port 8001] [--latency 0.5] [--token-interval 0.02] [--error-rate 0.05]
+#       AI_API_URL=http://127.0.0.1:8001/v1/chat/completions python app.py
+# GET /stats 返回请求数、错误数等计数
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = '/v1/chat/completions'
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # 客户端关闭空闲的keep-alive连接属于正常情况，不打印异常
+
+
+class FakeLLMServer:
+    """在后台线程中运行的替身服务
+
+    latency: 首字延迟（秒），jitter: 延迟的随机波动比例；tokens: 每个回复的分段数，
+    token_interval: 流式输出时每段之间的间隔（秒）；error_rate: 返回error_status错误的概率
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, jitter=0.2, tokens=20,
+                 token_interval=0.02, error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'streaming': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+        self.httpd = _HTTPServer((host, port), _make_handler(self))
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}{COMPLETIONS_PATH}'
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.counters[key] += value
+            if key == 'in_flight':
+                self.counters['max_in_flight'] = max(self.counters['max_in_flight'], self.counters['in_flight'])
+
+    def _delay(self):
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+            failed = self._random.random() < self.error_rate
+        return max(self.latency * factor, 0), failed
+
+
+def make_reply(question, tokens):
+    """根据问题生成固定格式的回复分段"""
+    head = f"收到你的问题：{question[:30]}。"
+    return [head] + [f"这是第{i}段回答，" for i in range(1, tokens)]
+
+
+def last_user_message(body):
+    for message in reversed(body.get('messages') or []):
+        if message.get('role') == 'user':
+            return str(message.get('content', ''))
+    return ''
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 支持keep-alive，与客户端连接池配合
+
+        def do_GET(self):
+            if self.path != '/stats':
+                self.send_json(404, {'error': {'message': 'not found'}})
+                return
+            self.send_json(200, server.stats())
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError:
+                self.send_json(400, {'error': {'message': 'invalid json'}})
+                return
+            if self.path != COMPLETIONS_PATH:
+                self.send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            server._count('requests')
+            server._count('in_flight')
+            try:
+                delay, failed = server._delay()
+                time.sleep(delay)
+                if failed:
+                    server._count('errors')
+                    self.send_json(server.error_status, {'error': {'message': 'fake upstream error'}})
+                    return
+                parts = make_reply(last_user_message(body), server.tokens)
+                if body.get('stream'):
+                    server._count('streaming')
+                    self.send_stream(body, parts)
+                else:
+                    time.sleep(server.token_interval * (len(parts) - 1))
+                    self.send_json(200, {
+                        'id': f'chatcmpl-{uuid.uuid4().hex}',
+                        'object': 'chat.completion',
+                        'model': body.get('model'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': ''.join(parts)}}]
+                    })
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 客户端已放弃请求
+            finally:
+                server._count('in_flight', -1)
+
+        def send_json(self, status, data):
+            payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_stream(self, body, parts):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+            for i, part in enumerate(parts):
+                if i:
+                    time.sleep(server.token_interval)
+                chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': body.get('model'),
+                         'choices': [{'index': 0, 'delta': {'content': part}, 'finish_reason': None}]}
+                self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b'0\r\n\r\n')
+
+        def write_chunk(self, text):
+            data = text.encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地AI上游替身服务（OpenAI兼容的chat/completions接口）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='首字延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.2, help='延迟随机波动比例')
+    parser.add_argument('--tokens', type=int, default=20, help='每个回复的分段数')
+    parser.add_argument('--token-interval', type=float, default=0.02, help='流式输出每段间隔（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误的概率（0~1）')
+    parser.add_argument('--error-status', type=int, default=500, help='错误时返回的HTTP状态码，如429、503')
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, latency=args.latency, jitter=args.jitter, tokens=args.tokens,
+                           token_interval=args.token_interval, error_rate=args.error_rate,
+                           error_status=args.error_status)
+    print(f"替身服务已启动: {server.url}")
+    print(f"AI_API_URL={server.url} python app.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# 广播数据包只编码一次
+# python-socketio 5.x 向聊天室广播时，对每个接收者分别创建并编码一次Socket.IO数据包（JSON序列化整个负载）；
+# 这里的客户端管理器对一次广播只创建并编码一个数据包，再把同一份编码结果发给每个接收者。
+# 配置了消息队列时，其他进程转发来的广播同样只编码一次
+import socketio
+from socketio import packet
+
+
+class _EncodedPacket:
+    """已编码的数据包，发给每个接收者时直接返回同一份编码结果"""
+
+    def __init__(self, pkt):
+        self._encoded = pkt.encode()
+
+    def encode(self):
+        return self._encoded
+
+
+class EncodeOnceManager(socketio.BaseManager):
+    """广播时只编码一次数据包的客户端管理器；带回调（ACK）的发送每个接收者的ID不同，仍逐个编码"""
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        if callback is not None:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid,
+                                callback=callback, **kwargs)
+        if namespace not in self.rooms:
+            return
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        encoded = None
+        for sid, eio_sid in self.get_participants(namespace, room):
+            if sid in skip_sid:
+                continue
+            if encoded is None:
+                encoded = _EncodedPacket(self._make_packet(event, data, namespace))
+            self.server._send_packet(eio_sid, encoded)
+
+    def _make_packet(self, event, data, namespace):
+        # 与Server._emit_internal相同：元组展开为多个参数，其他数据作为一个参数
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        return self.server.packet_class(packet.EVENT, namespace=namespace, data=[event] + data)
+
+
+def create_client_manager(message_queue=None, channel='flask-socketio'):
+    """创建客户端管理器：没有消息队列时为EncodeOnceManager，否则为同时继承对应消息队列管理器的子类
+
+    消息队列管理器（如RedisManager）先将广播发布到队列，各进程收到后调用BaseManager.emit发送给本进程的客户端，
+    EncodeOnceManager在继承顺序中位于BaseManager之前，因此本地发送只编码一次
+    """
+    if not message_queue:
+        return EncodeOnceManager()
+    # 与Flask-SocketIO按消息队列地址选择管理器的方式相同
+    if message_queue.startswith(('redis://', 'rediss://')):
+        queue_class = socketio.RedisManager
+    elif message_queue.startswith('kafka://'):
+        queue_class = socketio.KafkaManager
+    elif message_queue.startswith('zmq'):
+        queue_class = socketio.ZmqManager
+    else:
+        queue_class = socketio.KombuManager
+    manager_class = type('EncodeOnce' + queue_class.__name__, (queue_class, EncodeOnceManager), {})
+    return manager_class(message_queue, channel=channel)
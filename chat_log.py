@@ -0,0 +1,260 @@
+# 聊天记录持久化
+# 聊天室消息只追加写入SQLite（WAL模式），由后台线程批量提交，不占用send_message的处理时间；
+# 按聊天室/时间、用户名、被@的用户建立索引，并用FTS5全文索引支持按关键词分页搜索
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "id INTEGER PRIMARY KEY, room TEXT NOT NULL, seq INTEGER, ts REAL NOT NULL, "
+    "username TEXT NOT NULL, message TEXT NOT NULL, is_ai INTEGER NOT NULL DEFAULT 0)",
+    # id按写入顺序递增，即按时间排序；以下索引隐含id，同一聊天室/用户的消息在索引中按时间排列
+    "CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (ts)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_room ON messages (room)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_username ON messages (username)",
+    "CREATE TABLE IF NOT EXISTS mentions ("
+    "username TEXT NOT NULL, message_id INTEGER NOT NULL, PRIMARY KEY (username, message_id)) WITHOUT ROWID",
+    # 写入messages时同步写入全文索引
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message); END",
+]
+
+
+def _fts_tokenizer(conn):
+    """优先使用trigram分词（SQLite 3.34+），支持中文任意子串搜索；不支持时退回unicode61"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.tokenizer_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.tokenizer_probe")
+        return 'trigram'
+    except sqlite3.OperationalError:
+        return 'unicode61'
+
+
+class ChatLog:
+    """追加写入的聊天记录，append只放入内存队列，由后台线程每batch_size条或每flush_interval秒提交一次
+
+    创建时不打开数据库，调用open()或第一次写入、搜索时才创建数据库文件和表
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=0.5, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue(maxsize=max_queue)
+        self._write_conn = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self.tokenizer = None
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self.written = 0
+        self.dropped = 0
+
+    def open(self):
+        """打开数据库并建表（重复调用无副作用）"""
+        if self._read_conn is not None:
+            return
+        with self._open_lock:
+            if self._read_conn is None:
+                self._write_conn = self._connect()
+                self._create_schema()
+                self._read_conn = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL模式下NORMAL即可保证数据库不损坏
+        return conn
+
+    def _create_schema(self):
+        conn = self._write_conn
+        # 多个服务进程可能同时启动，先取得写锁再检查和建表
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+            if not exists:
+                self.tokenizer = _fts_tokenizer(conn)
+                conn.execute(
+                    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                    f"message, content='messages', content_rowid='id', tokenize='{self.tokenizer}')"
+                )
+            else:
+                sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()[0]
+                self.tokenizer = 'trigram' if 'trigram' in sql else 'unicode61'
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append(self, room, message):
+        """记录一条聊天室消息（new_message的数据），不等待写入；队列已满时丢弃并计数"""
+        mentions = list(message.get('mentioned_users') or ())
+        if message.get('mention_target'):
+            mentions.append(message['mention_target'])
+        row = (room, message.get('seq'), time.time(), message.get('username', ''),
+               message.get('message', ''), 1 if message.get('is_ai') else 0, mentions)
+        self._start()
+        try:
+            self._pending.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """等待队列中已有的消息全部写入"""
+        if self._writer is not None:
+            self._pending.join()
+
+    def close(self):
+        """写完剩余消息后停止后台线程（退出服务前调用）"""
+        self.flush()
+        self._stopped = True
+        if self._writer is not None:
+            self._writer.join()
+
+    def _start(self):
+        if self._writer is not None:
+            return
+        self.open()
+        with self._start_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='chat-log-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while not self._stopped:
+            try:
+                batch = [self._pending.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # 取出队列中已积累的消息一起提交，减少事务和fsync次数
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except sqlite3.Error:
+                logger.exception("写入聊天记录失败，丢弃 %d 条消息", len(batch))
+                self.dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _write_batch(self, batch):
+        conn = self._write_conn
+        # BEGIN IMMEDIATE先取得写锁，此后其他进程无法写入，可以直接分配连续的id
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM messages").fetchone()[0]
+            rows, mention_rows = [], []
+            for message_id, (room, seq, ts, username, message, is_ai, mentions) in enumerate(batch, next_id):
+                rows.append((message_id, room, seq, ts, username, message, is_ai))
+                mention_rows.extend((name, message_id) for name in set(mentions))
+            conn.executemany(
+                "INSERT INTO messages (id, room, seq, ts, username, message, is_ai) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany("INSERT INTO mentions (username, message_id) VALUES (?, ?)", mention_rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.written += len(batch)
+
+    def search(self, query=None, room=None, username=None, mention=None,
+               since=None, until=None, limit=50, cursor=None):
+        """按条件搜索聊天记录，结果按时间（id）倒序，每页limit条
+
+        cursor为上一页返回的next_cursor，返回 {'messages': [...], 'next_cursor': 下一页游标或None}
+        """
+        self.open()
+        source, order = "messages m", "m.id"
+        conditions, params = [], []
+        if query:
+            if (self.tokenizer == 'trigram' and len(query) < 3) or username or mention:
+                # trigram索引无法匹配少于3个字符的关键词；指定了用户时该用户的消息通常远少于关键词的匹配数，
+                # 这两种情况都由其余条件的索引驱动，在范围内做子串匹配
+                conditions.append("m.message LIKE ? ESCAPE '\\'")
+                params.append('%' + _escape_like(query) + '%')
+            else:
+                # 由全文索引按rowid倒序驱动查询，取够一页即停止，不需要取出全部匹配再排序
+                source, order = "messages_fts f JOIN messages m ON m.id = f.rowid", "f.rowid"
+                conditions.append("messages_fts MATCH ?")
+                params.append(_fts_phrase(query))
+        if room:
+            conditions.append("m.room = ?")
+            params.append(room)
+        if username:
+            conditions.append("m.username = ?")
+            params.append(username)
+        if mention:
+            conditions.append("m.id IN (SELECT message_id FROM mentions WHERE username = ? ORDER BY message_id DESC)")
+            params.append(mention)
+        # 时间范围先通过ts索引换算为id范围，其余索引都可以直接按id区间扫描
+        if since is not None:
+            conditions.append("m.id >= COALESCE((SELECT id FROM messages WHERE ts >= ? ORDER BY ts LIMIT 1), 1 << 62)")
+            params.append(since)
+        if until is not None:
+            conditions.append("m.id < COALESCE((SELECT id FROM messages WHERE ts >= ? ORDER BY ts LIMIT 1), 1 << 62)")
+            params.append(until)
+        if cursor:
+            # 游标为上一页最后一条消息的id
+            conditions.append("m.id < ?")
+            params.append(int(cursor))
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        sql = (f"SELECT m.id, m.room, m.seq, m.ts, m.username, m.message, m.is_ai FROM {source} {where} "
+               f"ORDER BY {order} DESC LIMIT ?")
+        params.append(limit + 1)
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        messages = [{
+            'id': row[0],
+            'room': row[1],
+            'seq': row[2],
+            'ts': row[3],
+            'username': row[4],
+            'message': row[5],
+            'is_ai': bool(row[6])
+        } for row in rows[:limit]]
+        next_cursor = messages[-1]['id'] if len(rows) > limit else None
+        return {'messages': messages, 'next_cursor': next_cursor}
+
+    def stats(self):
+        """写入状态，供接口和日志使用"""
+        return {
+            'pending': self._pending.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'tokenizer': self.tokenizer
+        }
+
+
+def _fts_phrase(query):
+    """将用户输入作为一个FTS5短语，避免其中的引号、运算符被当作查询语法"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def create_chat_log(path=None, base_dir=None, **kwargs):
+    """根据配置创建聊天记录，未配置路径时返回None（不记录）；相对路径相对于base_dir，而不是启动时的工作目录"""
+    if not path:
+        return None
+    if base_dir:
+        path = os.path.join(base_dir, path)
+    return ChatLog(path, **kwargs)
@@ -0,0 +1,131 @@
+# AI上游熔断器
+# 统计最近N次上游请求的失败率，超过阈值时熔断：熔断期间的请求立即失败，由调用方给出降级回复，
+# 不再占用后台工作者等待超时；冷却时间过后进入半开状态放行少量探测请求，成功则恢复，失败则重新熔断
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+
+class CircuitBreaker:
+    """按失败率熔断
+
+    window: 统计最近多少次请求；min_calls: 窗口内请求数达到多少才判断失败率；
+    failure_rate: 失败率达到该值时熔断；open_seconds: 熔断持续时间；half_open_probes: 半开状态下同时放行的探测请求数
+    """
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, open_seconds=30, half_open_probes=1):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._results = deque(maxlen=window)  # True为成功
+        self._state = CLOSED
+        self._opened_at = 0
+        self._generation = 0  # 每次状态变化加1，用于识别在之前的状态中放行的请求
+        self._probes = 0  # 半开状态下进行中的探测请求数
+        self._lock = threading.Lock()
+        self.rejected = 0  # 熔断期间被拒绝的请求数
+        self.opened = 0  # 熔断次数
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state_locked()
+
+    def is_open(self):
+        """是否处于熔断中（不占用半开状态的探测名额）"""
+        return self.state == OPEN
+
+    def allow(self):
+        """请求上游前调用：允许时返回许可(状态代数, 是否为探测请求)，熔断中时返回None；
+        调用方之后必须带着许可调用record_success/record_failure/record_cancel之一
+        """
+        with self._lock:
+            state = self._state_locked()
+            if state == CLOSED:
+                return (self._generation, False)
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return (self._generation, True)
+            self.rejected += 1
+            return None
+
+    def record_success(self, permit):
+        with self._lock:
+            if self._is_probe_locked(permit):
+                self._release_probe_locked()
+                self._close_locked()
+            elif self._is_current_locked(permit, CLOSED):
+                self._results.append(True)
+
+    def record_failure(self, permit):
+        with self._lock:
+            if self._is_probe_locked(permit):
+                self._release_probe_locked()
+                self._open_locked('探测请求失败')
+            elif self._is_current_locked(permit, CLOSED):
+                self._results.append(False)
+                calls = len(self._results)
+                failures = calls - sum(self._results)
+                if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                    self._open_locked(f'最近{calls}次请求失败{failures}次')
+
+    def record_cancel(self, permit):
+        """请求在得出结果前被放弃，只归还探测名额"""
+        with self._lock:
+            if self._is_probe_locked(permit):
+                self._release_probe_locked()
+
+    def stats(self):
+        with self._lock:
+            state = self._state_locked()
+            calls = len(self._results)
+            return {
+                'state': state,
+                'calls': calls,
+                'failure_rate': round((calls - sum(self._results)) / calls, 3) if calls else 0,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in': round(max(self._opened_at + self.open_seconds - time.monotonic(), 0), 1)
+                if state == OPEN else 0
+            }
+
+    def _is_current_locked(self, permit, state):
+        """许可是否在当前状态中放行：之前的状态中放行的慢请求，其结果不影响当前状态"""
+        return permit[0] == self._generation and self._state_locked() == state
+
+    def _is_probe_locked(self, permit):
+        return permit[1] and self._is_current_locked(permit, HALF_OPEN)
+
+    def _release_probe_locked(self):
+        if self._probes > 0:
+            self._probes -= 1
+
+    def _state_locked(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._generation += 1
+            self._probes = 0
+            logger.info("AI上游熔断器进入半开状态，放行探测请求")
+        return self._state
+
+    def _open_locked(self, reason):
+        self._state = OPEN
+        self._generation += 1
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        self._results.clear()
+        logger.warning(f"AI上游熔断 {self.open_seconds}s: {reason}")
+
+    def _close_locked(self):
+        self._state = CLOSED
+        self._generation += 1
+        self._results.clear()
+        logger.info("AI上游熔断器恢复")
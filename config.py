@@ -1,4 +1,5 @@
 # Jamp智能聊天室配置文件
+import os
 
 # 服务器配置列表，用户可以在登录时选择
 SERVERS = [
@@ -9,9 +10,101 @@ SERVERS = [
 
 # 应用配置
 SECRET_KEY = 'dev_key_for_jamp_chatroom'
-DEBUG = True
+DEBUG = os.environ.get('DEBUG', '1') == '1'
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 5000))
+
+# 静态资源与页面缓存
+STATIC_COMPRESSION = os.environ.get('STATIC_COMPRESSION', '1') == '1'  # 是否提供gzip压缩（安装brotli后同时提供br）的静态资源和页面
+STATIC_MAX_AGE = 365 * 24 * 3600  # 带内容哈希的静态资源地址的浏览器缓存时间（秒），文件变化后地址随之改变
+STATIC_RELOAD = DEBUG  # 是否在静态文件和登录页模板修改后自动更新（开发时使用）；关闭时登录页只渲染一次
+
+# 日志与监控
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')  # DEBUG时输出每条消息的处理日志
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text'为文本加key=value字段，'json'为每行一个JSON对象
+LOG_EVENT_SAMPLE_RATE = float(os.environ.get('LOG_EVENT_SAMPLE_RATE', 1.0))  # 逐条消息日志的采样比例，0表示关闭
+LOG_ACCESS = os.environ.get('LOG_ACCESS', '0') == '1'  # 是否输出每个HTTP请求（含Socket.IO轮询）的访问日志
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'  # 是否开放 /debug/profile 性能分析接口
+
+# 多进程/多机部署配置（需要 pip install redis）
+# 多个服务进程通过消息队列转发Socket.IO广播，如 'redis://localhost:6379/0'；为None时单进程运行
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# 在线用户和AI对话历史的共享存储，默认与消息队列使用同一个Redis
+STATE_REDIS_URL = os.environ.get('STATE_REDIS_URL', SOCKETIO_MESSAGE_QUEUE)
+STATE_KEY_PREFIX = os.environ.get('STATE_KEY_PREFIX', 'jamp:')  # 共享存储中键名前缀
+PRESENCE_HEARTBEAT_INTERVAL = 10  # 服务进程在共享存储中续期心跳、清理已停止进程遗留用户的间隔（秒）
+PRESENCE_WORKER_TTL = 30  # 心跳有效期（秒），进程崩溃后超过该时间未续期，其在线用户会被其他进程释放
 
 # 聊天室相关配置
 MAX_MESSAGE_LENGTH = 500  # 消息最大长度
 USERNAME_MIN_LENGTH = 1
-USERNAME_MAX_LENGTH = 20
\ No newline at end of file
+USERNAME_MAX_LENGTH = 20
+DEFAULT_ROOM = "general"  # 未指定聊天室时加入的默认聊天室
+ROOM_NAME_MAX_LENGTH = 20  # 聊天室名称最大长度
+BOT_REPLY_DELAY = 1  # 机器人欢迎语和@回复的发送延迟（秒），由后台延迟队列发送，不阻塞消息处理
+
+# 频率限制（令牌桶：每秒补充RATE个令牌，最多积累BURST个；RATE为0时不限制），每个服务进程各自计数
+MESSAGE_RATE_PER_USER = 1  # 每个用户每秒可发送的消息数
+MESSAGE_BURST_PER_USER = 5  # 每个用户允许连续发送的消息数
+MESSAGE_RATE_PER_ROOM = 20  # 每个聊天室每秒可广播的消息数
+MESSAGE_BURST_PER_ROOM = 50
+
+# 聊天室广播合并：开启后同一聊天室在窗口内的事件合并为一个message_batch帧发送
+OUTBOUND_BATCHING = False  # 是否开启合并（人多、消息多的聊天室可开启）
+OUTBOUND_BATCH_WINDOW = 0.03  # 合并窗口（秒），事件最多延迟这么久发送
+OUTBOUND_BATCH_MAX_EVENTS = 50  # 单批最多事件数，达到后立即发送
+OUTBOUND_BATCH_EXCLUDED_ROOMS = []  # 不合并、始终立即发送的聊天室
+# 聊天室广播的传输格式：'json' 为默认格式；'compact' 使用短键名和毫秒时间戳，负载只编码一次并以二进制发送
+WIRE_FORMAT = os.environ.get('WIRE_FORMAT', 'json')
+MESSAGE_BUFFER_SIZE = 100  # 每个聊天室保留的最近消息条数，加入或重连时补发
+MESSAGE_BUFFER_MAX_ROOMS = 1000  # 最多保留最近消息的聊天室数，超出时丢弃最久没有新消息的聊天室
+
+# 数据文件目录，相对路径的聊天记录数据库保存在这里；默认为项目目录，与启动时的工作目录无关
+DATA_DIR = os.environ.get('DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
+
+# 聊天记录配置（SQLite WAL模式，多个服务进程可写入同一个文件）
+CHAT_LOG_PATH = os.environ.get('CHAT_LOG_PATH', 'chat_log.db')  # 为空时不保存聊天记录；相对路径相对于DATA_DIR
+CHAT_LOG_BATCH_SIZE = 500  # 后台线程每次提交的最大消息条数
+CHAT_LOG_FLUSH_INTERVAL = 0.5  # 没有新消息时最长等待多久提交一次（秒）
+CHAT_LOG_QUEUE_MAX = 10000  # 等待写入的消息上限，超过后丢弃并计数（不阻塞发送消息）
+CHAT_LOG_PAGE_SIZE = 50  # 搜索接口每页默认条数
+CHAT_LOG_PAGE_MAX = 200  # 搜索接口每页最大条数
+
+# AI助手相关配置
+# 上游接口地址、密钥和模型，可通过环境变量修改（如指向 benchmarks/fake_llm.py 启动的本地替身服务）
+AI_API_URL = os.environ.get('AI_API_URL', 'https://api.siliconflow.cn/v1/chat/completions')
+AI_API_KEY = os.environ.get('AI_API_KEY', 'sk-mamcrltysfujecncmrmlbfumdxvudmqedxzvkqcvhyiqsoqh')
+AI_MODEL = os.environ.get('AI_MODEL', 'Qwen/Qwen2.5-7B-Instruct')
+AI_WORKER_COUNT = 4  # 同时处理AI请求的后台工作者数量（最大并发数）
+AI_QUEUE_MAX_SIZE = 50  # 排队等待的AI请求上限，超过后直接提示繁忙
+AI_RATE_PER_USER = 0.1  # 每个用户每秒可提问的次数（0.1即平均每10秒一次）
+AI_BURST_PER_USER = 3  # 每个用户允许连续提问的次数
+AI_MAX_IN_FLIGHT = 20  # 同时排队或处理中的AI问题总数上限，0表示只受AI_QUEUE_MAX_SIZE限制
+AI_STREAMING = True  # 是否以流式方式逐段推送AI回复（ai_delta / ai_done 事件）
+AI_HTTP_POOL_SIZE = 4  # 到AI上游的长连接池大小，建议不小于AI_WORKER_COUNT
+AI_CONNECT_TIMEOUT = 5  # 建立连接超时（秒）
+AI_READ_TIMEOUT = 30  # 读取响应超时（秒）
+AI_MAX_RETRIES = 2  # 遇到429/5xx或连接错误时的最大重试次数
+AI_RETRY_BACKOFF = 0.5  # 重试退避系数，第n次重试前等待 backoff * 2^(n-1) 秒
+AI_DEADLINE = float(os.environ.get('AI_DEADLINE', 15))  # 每个问题等待上游的总时间预算（秒，含重试），超出后不再重试
+AI_BREAKER_ENABLED = os.environ.get('AI_BREAKER_ENABLED', '1') == '1'  # 是否启用AI上游熔断器
+AI_BREAKER_WINDOW = 20  # 熔断器统计最近多少次上游请求
+AI_BREAKER_MIN_CALLS = 5  # 统计窗口内至少有多少次请求才判断失败率
+AI_BREAKER_FAILURE_RATE = 0.5  # 失败率达到该值时熔断，熔断期间的问题立即得到降级回复（缓存的回答或繁忙提示）
+AI_BREAKER_OPEN_SECONDS = 30  # 熔断持续时间（秒），之后放行探测请求，成功则恢复
+AI_BREAKER_HALF_OPEN_PROBES = 1  # 半开状态下同时放行的探测请求数
+AI_CACHE_ENABLED = True  # 是否缓存AI回复并合并并发的相同问题
+AI_CACHE_TTL = 600  # 缓存有效期（秒）
+AI_CACHE_MAX_ENTRIES = 1000  # 最多缓存的回复条数
+AI_CACHE_MAX_BYTES = 2 * 1024 * 1024  # 缓存占用内存上限（字节）
+AI_CACHE_HISTORY_TURNS = 1  # 缓存键包含的最近对话轮数，0表示只按问题本身缓存
+AI_PROMPT_TOKEN_BUDGET = 2000  # 每次请求的输入token预算（系统提示+历史+问题），超出时丢弃较早的对话
+AI_PROMPT_SUMMARIZE = False  # 是否将被丢弃的较早对话压缩为一段摘要
+AI_PROMPT_SUMMARY_MAX_CHARS = 200  # 摘要的最大字符数
+
+# 川小农对话历史配置
+HISTORY_MAX_TURNS = 10  # 每个用户保留的最近对话轮数，实际发送多少轮由AI_PROMPT_TOKEN_BUDGET决定
+HISTORY_MAX_USERS = 1000  # 内存中最多保留历史的用户数
+HISTORY_MAX_BYTES = 4 * 1024 * 1024  # 内存中历史占用上限（字节）
+HISTORY_DB_PATH = None  # SQLite数据库路径，如 'ai_history.db'；为None时仅保存在内存中
+HISTORY_REDIS_TTL = 7 * 24 * 3600  # 使用共享存储（Redis）时对话历史的保留时间（秒），每次对话后重新计时
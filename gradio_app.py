@@ -0,0 +1,30 @@
+# 川小农AI小助手的Gradio独立界面
+# Gradio依赖较重，只在此入口中导入，聊天室服务(app.py)不会加载它
+# 运行前需单独安装: pip install gradio
+import gradio as gr
+import config
+from log_config import configure_logging
+configure_logging(level=config.LOG_LEVEL, fmt=config.LOG_FORMAT)
+from simple_ai import bot_ai, chat_with_siliconflow, logger
+
+
+def chat(message, history):
+    """Gradio聊天回调，复用BotAI的连接池会话"""
+    return chat_with_siliconflow(message, history, session=bot_ai.session)
+
+
+# 创建Gradio聊天界面
+if __name__ == "__main__":
+    logger.info("启动川小农AI小助手...")
+    
+    # 设置界面标题和描述
+    interface = gr.ChatInterface(
+        fn=chat,
+        title="川小农AI小助手",
+        description="四川农业大学AI小助手，为您提供学习、生活和校园相关的帮助。",
+        theme=gr.themes.Soft()
+    )
+    
+    # 启动界面，根据系统要求设置share=True
+    logger.info("正在启动Gradio界面...")
+    interface.launch(share=True)
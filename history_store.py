@@ -0,0 +1,173 @@
+# 川小农对话历史存储
+# 内存层按用户数和字节数做LRU淘汰；可选SQLite持久层，服务重启后历史不丢失；
+# 多进程部署时可改用Redis持久层，在各服务进程间共享
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def _turns_size(turns):
+    """估算一组对话占用的字节数"""
+    return sum(len(q.encode('utf-8')) + len(a.encode('utf-8')) for q, a in turns)
+
+
+class MemoryHistoryStore:
+    """内存中的对话历史，超过用户数或字节上限时淘汰最久未使用的用户"""
+
+    def __init__(self, max_users=1000, max_bytes=4 * 1024 * 1024, max_turns=5):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self._histories = OrderedDict()  # {username: [(question, answer), ...]}
+        self._sizes = {}  # {username: 字节数}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 追加对话的读取-修改-写入（含写入持久层）在此锁内完成，同一用户并发追加时不会丢失对话；
+        # 与_lock分开，写入持久层时不阻塞get
+        self._append_lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, username):
+        """获取用户的对话历史（副本），没有时返回空列表"""
+        with self._lock:
+            turns = self._histories.get(username)
+            if turns is not None:
+                self._histories.move_to_end(username)
+                return list(turns)
+        turns = self._load(username)
+        if turns:
+            with self._lock:
+                if username not in self._histories:
+                    self._put_locked(username, turns)
+        return list(turns)
+
+    def append(self, username, question, answer):
+        """追加一轮对话，只保留最近max_turns轮"""
+        with self._append_lock:
+            with self._lock:
+                turns = self._histories.get(username)
+            if turns is None:
+                turns = self._load(username)
+            turns = (list(turns) + [(question, answer)])[-self.max_turns:]
+            self._save(username, turns)
+            with self._lock:
+                self._put_locked(username, turns)
+
+    def evict(self, username):
+        """将用户从内存中移除（用户离开时调用），持久层中的历史保留"""
+        with self._lock:
+            self._remove_locked(username)
+
+    def size(self):
+        """当前占用情况，持久化存储还包括持久层中的用户数（需要查询数据库，开销较大）"""
+        return self.memory_size()
+
+    def memory_size(self):
+        """内存层的占用情况，不访问持久层（供/metrics每次抓取时读取）"""
+        with self._lock:
+            return {
+                'users': len(self._histories),
+                'bytes': self._bytes,
+                'evictions': self.evictions
+            }
+
+    def _load(self, username):
+        """从持久层读取历史，内存存储没有持久层"""
+        return []
+
+    def _save(self, username, turns):
+        """写入持久层，内存存储没有持久层"""
+
+    def _put_locked(self, username, turns):
+        self._remove_locked(username)
+        size = _turns_size(turns)
+        self._histories[username] = turns
+        self._sizes[username] = size
+        self._bytes += size
+        while len(self._histories) > self.max_users or (self._bytes > self.max_bytes and len(self._histories) > 1):
+            oldest = next(iter(self._histories))
+            self._remove_locked(oldest)
+            self.evictions += 1
+
+    def _remove_locked(self, username):
+        if self._histories.pop(username, None) is not None:
+            self._bytes -= self._sizes.pop(username)
+
+
+class SQLiteHistoryStore(MemoryHistoryStore):
+    """在内存LRU层之下增加SQLite持久层"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_history ("
+                "username TEXT PRIMARY KEY, turns TEXT NOT NULL)"
+            )
+
+    def size(self):
+        stats = super().size()
+        with self._db_lock:
+            stats['persisted_users'] = self._conn.execute("SELECT COUNT(*) FROM ai_history").fetchone()[0]
+        return stats
+
+    def _load(self, username):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT turns FROM ai_history WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return []
+        return [tuple(turn) for turn in json.loads(row[0])]
+
+    def _save(self, username, turns):
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_history (username, turns) VALUES (?, ?)",
+                (username, json.dumps(turns, ensure_ascii=False))
+            )
+
+
+class RedisHistoryStore(MemoryHistoryStore):
+    """在内存LRU层之下增加Redis持久层，多个服务进程共享同一份历史
+
+    ttl: 历史在Redis中的保留时间（秒），每次写入后重新计时，长期不对话的用户历史自动过期；为None时不过期
+    """
+
+    def __init__(self, client, prefix='jamp:', ttl=None, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix + 'ai_history:'
+        self.ttl = ttl
+
+    def size(self):
+        stats = super().size()
+        stats['persisted_users'] = sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=500))
+        return stats
+
+    def _load(self, username):
+        value = self.client.get(self.prefix + username)
+        if value is None:
+            return []
+        return [tuple(turn) for turn in json.loads(value)]
+
+    def _save(self, username, turns):
+        self.client.set(self.prefix + username, json.dumps(turns, ensure_ascii=False), ex=self.ttl)
+
+
+def create_history_store(db_path=None, redis_url=None, prefix='jamp:', redis_ttl=None, **kwargs):
+    """根据配置创建历史存储：指定Redis地址时使用Redis（历史保留redis_ttl秒），指定数据库路径时使用SQLite持久化"""
+    if redis_url:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("多进程部署需要安装redis: pip install redis")
+        client = redis.Redis.from_url(redis_url, decode_responses=True)
+        return RedisHistoryStore(client, prefix=prefix, ttl=redis_ttl, **kwargs)
+    if db_path:
+        return SQLiteHistoryStore(db_path, **kwargs)
+    return MemoryHistoryStore(**kwargs)
@@ -0,0 +1,90 @@
+# 日志配置
+# 分级的结构化日志：每条日志可附带字段（文本格式输出为 key=value，JSON格式每行一个对象），
+# 逐条消息的高频日志写入 jamp.events，可按比例采样或关闭；
+# 日志记录放入队列后由后台线程写出，事件处理函数中不直接进行stdout I/O
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+EVENT_LOGGER = 'jamp.events'  # 逐条消息/事件的高频日志
+
+_listener = None
+
+
+def fields(**values):
+    """附加到日志记录的结构化字段，用法: logger.info('用户加入', extra=fields(user=name, room=room))"""
+    return {'fields': values}
+
+
+class StructuredFormatter(logging.Formatter):
+    """文本格式在消息后追加 key=value 字段；JSON格式输出 ts、level、logger、msg 和各字段"""
+
+    def __init__(self, json_format=False):
+        super().__init__('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+        self.json_format = json_format
+
+    def format(self, record):
+        if not self.json_format:
+            return super().format(record)
+        data = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        extra = getattr(record, 'fields', None)
+        if extra:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in extra.items())
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """按比例保留日志记录，WARNING及以上级别始终保留；rate为0时只保留WARNING及以上"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+
+def configure_logging(level='INFO', fmt='text', event_sample_rate=1.0, access_log=False):
+    """配置根日志（重复调用时只更新级别和采样比例）
+
+    level: 日志级别，DEBUG时输出逐条消息的处理日志；fmt: 'text' 或 'json'；
+    event_sample_rate: jamp.events 日志的采样比例；access_log: 是否输出每个HTTP请求的访问日志
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    # werkzeug的访问日志每个Socket.IO轮询请求都会输出一行
+    logging.getLogger('werkzeug').setLevel(logging.INFO if access_log else logging.WARNING)
+
+    events = logging.getLogger(EVENT_LOGGER)
+    for existing in [f for f in events.filters if isinstance(f, SamplingFilter)]:
+        events.removeFilter(existing)
+    if event_sample_rate < 1:
+        events.addFilter(SamplingFilter(event_sample_rate))
+
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_format=fmt == 'json'))
+    records = queue.SimpleQueue()
+    root.handlers[:] = [logging.handlers.QueueHandler(records)]
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,102 @@
+# 最近消息缓冲区
+# 每个聊天室保留固定数量的最近消息，并为每条消息分配递增序号，
+# 客户端重连时带上最后收到的序号，只补发缺失的消息
+import json
+import threading
+from collections import OrderedDict, deque
+
+
+class _RoomBuffer:
+    def __init__(self, capacity):
+        self.messages = deque(maxlen=capacity)  # 超出容量时自动丢弃最旧的消息
+        self.seq = 0
+
+
+class RoomMessageBuffer:
+    """进程内的环形消息缓冲区，capacity为每个聊天室保留的消息条数，
+    最多保留max_rooms个聊天室，超出时丢弃最久没有新消息的聊天室
+    """
+
+    def __init__(self, capacity=100, max_rooms=1000):
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()  # {room: _RoomBuffer}，按最近写入排序
+        self._lock = threading.Lock()
+
+    def append(self, room, message):
+        """为消息分配序号（写入message['seq']）并加入缓冲区，返回序号"""
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is None:
+                buffer = self._rooms[room] = _RoomBuffer(self.capacity)
+                if len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            else:
+                self._rooms.move_to_end(room)
+            buffer.seq += 1
+            message['seq'] = buffer.seq
+            buffer.messages.append(message)
+            return buffer.seq
+
+    def since(self, room, last_seq):
+        """返回(序号大于last_seq的消息列表, 最新序号, 是否有消息已被丢弃无法补发)"""
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is None:
+                return [], 0, last_seq > 0
+            if last_seq > buffer.seq:
+                # 缓冲区已被重建（服务重启或聊天室被淘汰），客户端的序号失效，补发全部
+                last_seq = 0
+            messages = [m for m in buffer.messages if m['seq'] > last_seq]
+            return messages, buffer.seq, _truncated(messages, last_seq, buffer.seq)
+
+
+class RedisMessageBuffer:
+    """保存在Redis中的消息缓冲区，多个服务进程共享同一序号和消息列表"""
+
+    def __init__(self, client, capacity=100, prefix='jamp:'):
+        self.client = client
+        self.capacity = capacity
+        self.prefix = prefix + 'messages:'
+
+    def append(self, room, message):
+        seq = int(self.client.incr(self.prefix + room + ':seq'))
+        message['seq'] = seq
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(self.prefix + room, json.dumps(message, ensure_ascii=False))
+        pipe.ltrim(self.prefix + room, -self.capacity, -1)
+        pipe.execute()
+        return seq
+
+    def since(self, room, last_seq):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(self.prefix + room, 0, -1)
+        pipe.get(self.prefix + room + ':seq')
+        raw, latest = pipe.execute()
+        latest = int(latest or 0)
+        if last_seq > latest:
+            last_seq = 0
+        # 多个进程并发写入时列表顺序可能与序号略有出入，按序号排序
+        messages = sorted((json.loads(m) for m in raw), key=lambda m: m['seq'])
+        messages = [m for m in messages if m['seq'] > last_seq]
+        return messages, latest, _truncated(messages, last_seq, latest)
+
+
+def _truncated(messages, last_seq, latest):
+    """last_seq之后的消息是否有一部分已经被挤出缓冲区"""
+    if latest <= last_seq:
+        return False
+    first = messages[0]['seq'] if messages else latest + 1
+    return first > last_seq + 1
+
+
+def create_message_buffer(capacity=100, max_rooms=1000, redis_url=None, prefix='jamp:'):
+    """根据配置创建消息缓冲区：指定Redis地址时在多个进程间共享"""
+    if not redis_url:
+        return RoomMessageBuffer(capacity, max_rooms)
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("多进程部署需要安装redis: pip install redis")
+    client = redis.Redis.from_url(redis_url, decode_responses=True)
+    return RedisMessageBuffer(client, capacity=capacity, prefix=prefix)
@@ -0,0 +1,91 @@
+# 聊天消息解析
+# 用一个预编译的正则对消息扫描一遍，同时得到命令、参数、@的用户及其位置和链接，各处理函数直接使用解析结果
+import re
+
+# @用户名在空白或常用标点处结束，"@川小农，你好" 中的用户名是"川小农"
+_NAME_END = r'\s，。！？、：；,!?:;'
+_SEPARATORS = ' \t\r\n，。！？、：；,!?:;'
+
+# 链接在前：链接中的@不会被当作@用户
+_TOKEN_RE = re.compile(r'(?P<url>(?:https?://|www\.)[^\s`]+)|@(?P<mention>[^' + _NAME_END + r']+)')
+_URL_RE = re.compile(r'(?:https?://|www\.)\S+')
+# 命令消息开头的命令名，跳过@之后的空白和标点（"@ 川小农 你好" 的命令名是"川小农"）
+_COMMAND_RE = re.compile(r'@[' + _NAME_END + r']*([^' + _NAME_END + r']*)')
+
+
+class ParsedMessage:
+    """消息的解析结果
+
+    command: 以@开头的消息为命令名（@后的第一个词，消息只有@和标点时为空字符串），否则为None
+    params: 命令名之后的内容（去掉分隔符和反引号）
+    mentions: 消息中@的用户名（按出现顺序去重）
+    urls: 消息中的链接
+    """
+
+    __slots__ = ('text', 'command', 'params', 'mentions', 'urls', '_ends', '_prefixed')
+
+    def __init__(self, text, command=None, params=None, mentions=(), urls=(), ends=None, prefixed=None):
+        self.text = text
+        self.command = command
+        self.params = params
+        self.mentions = mentions
+        self.urls = urls
+        self._ends = ends or {}  # {用户名: 第一次@该用户名的结束位置}
+        self._prefixed = prefixed or {}  # {保留名: 以该保留名开头的@中保留名的结束位置}
+
+    @property
+    def is_command(self):
+        return self.command is not None
+
+    def mentions_user(self, username):
+        """消息中是否@了username"""
+        return username in self._ends
+
+    def addresses(self, username):
+        """是否@了username，包括名字后没有分隔符直接接内容的写法（仅限解析时传入的保留名，如"@川小农你好"）"""
+        return username in self._ends or username in self._prefixed
+
+    def text_after(self, username):
+        """第一次@username之后的内容（去掉开头的分隔符），没有@该用户时返回None"""
+        end = self._ends.get(username)
+        prefixed = self._prefixed.get(username)
+        if end is None or (prefixed is not None and prefixed < end):
+            end = prefixed
+        if end is None:
+            return None
+        return self.text[end:].lstrip(_SEPARATORS).strip()
+
+
+def parse_message(text, reserved=()):
+    """扫描一遍消息，返回ParsedMessage
+
+    reserved: 机器人等保留名，@后紧接保留名再接其他文字时（"@川小农你好"）也记为@了该保留名
+    """
+    if '@' not in text and '//' not in text and 'www.' not in text:
+        # 大部分消息既没有@也没有链接，不需要正则扫描
+        return ParsedMessage(text)
+    urls = []
+    ends = {}  # 按出现顺序去重，同时记录第一次出现的位置
+    prefixed = {}
+    for match in _TOKEN_RE.finditer(text):
+        mention = match.group('mention')
+        if mention is None:
+            urls.append(match.group('url'))
+        elif mention not in ends:
+            ends[mention] = match.end()
+            for name in reserved:
+                if mention != name and mention.startswith(name) and name not in prefixed:
+                    prefixed[name] = match.start() + 1 + len(name)
+
+    command = params = None
+    if text[0] == '@':
+        match = _COMMAND_RE.match(text)
+        command = match.group(1)
+        params = text[match.end():].lstrip(_SEPARATORS).strip().replace('`', '')
+
+    return ParsedMessage(text, command, params, list(ends), urls, ends, prefixed)
+
+
+def is_url(text):
+    """text整体是否是一个链接（http(s)://或www.开头）"""
+    return _URL_RE.fullmatch(text) is not None
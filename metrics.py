@@ -0,0 +1,262 @@
+# 运行指标
+# 进程内的计数器、仪表和直方图，由 /metrics 接口按Prometheus文本格式输出（每个服务进程各自统计）；
+# instrument_event 包装Socket.IO事件处理函数记录耗时，EventProfiler 可在运行时对指定事件开启cProfile分析
+import bisect
+import cProfile
+import functools
+import io
+import math
+import pstats
+import threading
+import time
+
+# 事件处理耗时的桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# AI上游请求耗时的桶（秒）
+AI_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        super().__init__(name, help, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._labels(key)} {_number(value)}' for key, value in values]
+
+
+class Histogram(_Metric):
+    """按桶统计的分布，另有总和与次数"""
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # {labels: [各桶计数..., +Inf桶计数, 总和]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else _number(bound)
+                lines.append(f'{self.name}_bucket{self._labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """抓取时才读取的指标（队列长度、在线人数等已有的计数），func返回数值或 {标签值元组: 数值}"""
+
+    def __init__(self, name, help, func, type='gauge', label_names=()):
+        super().__init__(name, help, label_names)
+        self.type = type
+        self.func = func
+
+    def _samples(self):
+        value = self.func()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f'{self.name}{self._labels(key)} {_number(number)}'
+                for key, number in sorted(value.items()) if number is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """注册指标，同名指标已存在时替换（模块重新加载、测试中重复创建应用时）"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Prometheus文本格式，单个回调出错时跳过该指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} 读取失败: {_escape(str(e))}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, label_names=()):
+    return REGISTRY.register(Counter(name, help, label_names))
+
+
+def histogram(name, help, label_names=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, label_names, buckets))
+
+
+def gauge_callback(name, help, func, label_names=()):
+    return REGISTRY.register(CallbackMetric(name, help, func, 'gauge', label_names))
+
+
+def counter_callback(name, help, func, label_names=()):
+    return REGISTRY.register(CallbackMetric(name, help, func, 'counter', label_names))
+
+
+def render():
+    return REGISTRY.render()
+
+
+EVENT_LATENCY = histogram('jamp_socketio_event_seconds', 'Socket.IO事件处理函数耗时', ('event',))
+EVENT_ERRORS = counter('jamp_socketio_event_errors_total', 'Socket.IO事件处理函数抛出异常的次数', ('event',))
+
+
+class EventProfiler:
+    """运行时按事件开启的cProfile分析：对指定事件接下来的count次调用进行分析，结果累积到该事件的统计中"""
+
+    def __init__(self):
+        self._remaining = {}  # {event: 剩余分析次数}
+        self._stats = {}  # {event: pstats.Stats}
+        self._calls = {}  # {event: 已分析次数}
+        self._lock = threading.Lock()
+
+    def enable(self, event, count=100):
+        with self._lock:
+            self._remaining[event] = count
+
+    def disable(self, event=None):
+        """停止分析并清除结果，event为空时清除所有事件"""
+        with self._lock:
+            for store in (self._remaining, self._stats, self._calls):
+                if event is None:
+                    store.clear()
+                else:
+                    store.pop(event, None)
+
+    def take(self, event):
+        """本次调用是否需要分析（不需要时只读取一次字典，开销可忽略）"""
+        if not self._remaining:
+            return False
+        with self._lock:
+            remaining = self._remaining.get(event, 0)
+            if remaining <= 0:
+                return False
+            if remaining == 1:
+                del self._remaining[event]
+            else:
+                self._remaining[event] = remaining - 1
+            return True
+
+    def run(self, event, func, *args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12起同一时刻只能有一个cProfile分析器，其他线程正在分析时跳过本次
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                if event in self._stats:
+                    self._stats[event].add(profile)
+                else:
+                    self._stats[event] = pstats.Stats(profile)
+                self._calls[event] = self._calls.get(event, 0) + 1
+
+    def status(self):
+        with self._lock:
+            return {'pending': dict(self._remaining), 'profiled': dict(self._calls)}
+
+    def report(self, event, limit=30, sort='cumulative'):
+        """按sort排序的前limit个函数（pstats文本），没有结果时返回None"""
+        with self._lock:
+            stats = self._stats.get(event)
+            if stats is None:
+                return None
+            output = io.StringIO()
+            stats.stream = output
+            stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+profiler = EventProfiler()
+
+
+def instrument_event(event, handler):
+    """包装Socket.IO事件处理函数：记录耗时和异常次数，开启分析时在cProfile下运行"""
+    @functools.wraps(handler)
+    def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            if profiler.take(event):
+                return profiler.run(event, handler, *args)
+            return handler(*args)
+        except Exception:
+            EVENT_ERRORS.inc(event=event)
+            raise
+        finally:
+            EVENT_LATENCY.observe(time.perf_counter() - started, event=event)
+    return wrapper
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
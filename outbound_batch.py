@@ -0,0 +1,131 @@
+# 聊天室广播合并
+# 繁忙的聊天室中每条消息都单独发送一帧，开启合并后在一个短时间窗口内（或积累到N个事件时）
+# 将同一聊天室的事件合并为一个message_batch帧，整批只序列化一次（二进制负载）
+import json
+import logging
+import threading
+import time
+
+import wire_format
+
+logger = logging.getLogger(__name__)
+
+
+class RoomEmitter:
+    """向聊天室发送事件的统一出口，按配置直接发送或合并后发送
+
+    window: 合并窗口（秒），为0时不合并；max_events: 单批最多事件数，达到后立即发送；
+    excluded_rooms: 不合并、始终立即发送的聊天室（对延迟敏感的聊天室）；
+    compact: 是否使用wire_format的紧凑格式（短键名、毫秒时间戳、二进制负载）；
+    threading模式下后台任务在有待发送事件时才被唤醒，eventlet/gevent模式下每个窗口轮询一次
+    """
+
+    def __init__(self, socketio, window=0.03, max_events=50, excluded_rooms=(), compact=False):
+        self.socketio = socketio
+        self._blocking = getattr(socketio, 'async_mode', None) == 'threading'
+        self.compact = compact
+        self.window = window
+        self.max_events = max_events
+        self.excluded_rooms = set(excluded_rooms)
+        self._pending = {}  # {room: [[event, data, 产生时刻的毫秒时间戳], ...]}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # 取出批次和发送在同一把锁内完成，保证同一聊天室的事件按顺序到达
+        self._has_pending = threading.Event()  # 有待发送的批次时唤醒后台任务
+        self._started = False
+        self._stopped = False
+        self.frames = 0  # 实际发送的帧数
+        self.events = 0  # 发送的事件数
+
+    def start(self):
+        """启动定时发送的后台任务（重复调用无副作用）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        """发送剩余事件并通知后台任务退出"""
+        self._stopped = True
+        self._has_pending.set()
+        self.flush()
+
+    def batching(self, room):
+        """该聊天室是否合并发送"""
+        return self.window > 0 and room not in self.excluded_rooms
+
+    def emit(self, room, event, data):
+        """向聊天室发送事件：不合并时立即发送，否则放入该聊天室的待发送批次"""
+        # 记录事件产生的时刻，紧凑格式的时间戳不受合并窗口的延迟影响
+        entry = [event, data, int(time.time() * 1000)]
+        if not self.batching(room):
+            self._send(room, [entry])
+            return
+        self.start()
+        with self._lock:
+            batch = self._pending.setdefault(room, [])
+            batch.append(entry)
+            if len(batch) == 1:
+                self._has_pending.set()
+            if len(batch) < self.max_events:
+                return
+        with self._send_lock:
+            with self._lock:
+                batch = self._pending.pop(room, None)
+            if batch:
+                self._send(room, batch)
+
+    def flush(self):
+        """立即发送所有聊天室的待发送批次"""
+        with self._send_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for room, batch in pending.items():
+                self._send(room, batch)
+
+    def stats(self):
+        """发送帧数和事件数，events / frames 即平均每帧合并的事件数"""
+        return {
+            'window_ms': self.window * 1000,
+            'max_events': self.max_events,
+            'frames': self.frames,
+            'events': self.events
+        }
+
+    def _send(self, room, batch):
+        self.frames += 1
+        self.events += len(batch)
+        if self.compact:
+            # 负载只编码一次，Socket.IO将同一份字节作为二进制附件发给每个客户端
+            if len(batch) == 1:
+                event, data, created_ms = batch[0]
+                self.socketio.emit(event, wire_format.encode(data, created_ms), to=room)
+            else:
+                self.socketio.emit('message_batch', wire_format.encode_batch(batch), to=room)
+            return
+        if len(batch) == 1:
+            event, data, _ = batch[0]
+            self.socketio.emit(event, data, to=room)
+            return
+        # 整批预先序列化为UTF-8 JSON字节，作为二进制附件发送（数据包由broadcast_manager只编码一次）
+        payload = json.dumps([[event, data] for event, data, _ in batch],
+                             ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.socketio.emit('message_batch', payload, to=room)
+
+    def _run(self):
+        while not self._stopped:
+            if self._blocking:
+                # 没有待发送的事件时一直等待，第一个事件到达后再等一个合并窗口
+                self._has_pending.wait()
+                if self._stopped:
+                    break
+                self.socketio.sleep(self.window)
+                # 先清除再发送：发送期间到达的事件会重新唤醒
+                self._has_pending.clear()
+            else:
+                # eventlet/gevent模式下使用socketio.sleep定时发送，让出给其他协程
+                self.socketio.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"发送合并消息失败: {str(e)}")
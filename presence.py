@@ -0,0 +1,312 @@
+# 在线用户索引
+# 维护 session_id <-> 用户名 的双向索引以及每个聊天室的成员索引，查询和占用用户名都是O(1)，
+# 并保证"检查用户名是否可用 + 占用"是一个原子操作。用户名在所有聊天室中唯一。
+# 每个聊天室的成员变化都会递增该聊天室的版本号，客户端据此增量更新在线列表，发现缺失版本时再请求完整快照
+import threading
+import time
+import uuid
+
+
+class _Room:
+    """单个聊天室的成员和版本号"""
+
+    def __init__(self):
+        self.members = {}  # {session_id: username}，按加入顺序
+        self.version = 0
+        self.names = None  # 成员用户名元组的缓存，成员变化时重建
+
+
+class PresenceRegistry:
+    """在线用户注册表，reserved为始终在线（出现在每个聊天室中）的系统用户 {session_id: 用户名}"""
+
+    def __init__(self, reserved=None):
+        self._by_sid = {}  # {session_id: username}
+        self._by_name = {}  # {username: session_id}
+        self._room_of = {}  # {session_id: room}
+        self._rooms = {}  # {room: _Room}
+        self._reserved = dict(reserved or {})
+        self._reserved_names = set(self._reserved.values())
+        self._lock = threading.Lock()
+
+    def claim(self, sid, username, room):
+        """为sid占用用户名并加入聊天室，成功时返回该聊天室变化后的版本号，
+        用户名已被占用（或该会话已以其他身份加入）时返回0
+        """
+        with self._lock:
+            if username in self._reserved_names:
+                return 0
+            owner = self._by_name.get(username)
+            if owner is not None or sid in self._by_sid:
+                if owner == sid and self._room_of[sid] == room:
+                    return self._rooms[room].version
+                return 0
+            self._by_sid[sid] = username
+            self._by_name[username] = sid
+            self._room_of[sid] = room
+            state = self._rooms.get(room)
+            if state is None:
+                state = self._rooms[room] = _Room()
+            state.members[sid] = username
+            state.names = None
+            state.version += 1
+            return state.version
+
+    def release(self, sid):
+        """释放sid占用的用户名，返回(用户名, 聊天室, 版本号)；未加入或是系统用户时用户名为None"""
+        with self._lock:
+            username = self._by_sid.pop(sid, None)
+            if username is None:
+                return None, None, 0
+            del self._by_name[username]
+            room = self._room_of.pop(sid)
+            state = self._rooms[room]
+            del state.members[sid]
+            state.names = None
+            state.version += 1
+            version = state.version
+            if not state.members:
+                # 空聊天室不再保留，下次有人加入时重新创建
+                del self._rooms[room]
+            return username, room, version
+
+    def username_of(self, sid):
+        """sid对应的用户名，未加入时返回None"""
+        return self._by_sid.get(sid)
+
+    def room_of(self, sid):
+        """sid所在的聊天室，未加入时返回None"""
+        return self._room_of.get(sid)
+
+    def is_online(self, username):
+        """用户名是否在线（包括系统用户）"""
+        return username in self._by_name or username in self._reserved_names
+
+    def in_room(self, username, room):
+        """用户是否在指定聊天室中（系统用户在每个聊天室中）"""
+        if username in self._reserved_names:
+            return True
+        sid = self._by_name.get(username)
+        return sid is not None and self._room_of.get(sid) == room
+
+    def is_reserved(self, sid):
+        """是否是系统用户的会话"""
+        return sid in self._reserved
+
+    def usernames(self, room):
+        """聊天室的在线用户名（系统用户在前，其余按加入顺序），返回缓存的元组，无需每次重建"""
+        with self._lock:
+            return self._usernames_locked(room)
+
+    def snapshot(self, room):
+        """聊天室的完整快照 {'version': 版本号, 'users': [用户名...]}，版本号与列表保持一致"""
+        with self._lock:
+            state = self._rooms.get(room)
+            return {
+                'version': state.version if state else 0,
+                'users': list(self._usernames_locked(room))
+            }
+
+    def rooms(self):
+        """当前有成员的聊天室 {room: 成员数（不含系统用户）}"""
+        with self._lock:
+            return {room: len(state.members) for room, state in self._rooms.items()}
+
+    def room_size(self, room):
+        """聊天室的成员数（不含系统用户）"""
+        state = self._rooms.get(room)
+        return len(state.members) if state else 0
+
+    def heartbeat(self):
+        """续期本进程的心跳，单进程时无需操作"""
+
+    def reap(self, orphans=False):
+        """释放已停止的服务进程遗留的会话，返回[(用户名, 聊天室, 版本号)]；单进程时没有遗留会话"""
+        return []
+
+    def _usernames_locked(self, room):
+        state = self._rooms.get(room)
+        if state is None:
+            return tuple(self._reserved.values())
+        if state.names is None:
+            state.names = tuple(self._reserved.values()) + tuple(state.members.values())
+        return state.names
+
+    def __len__(self):
+        return len(self._by_sid) + len(self._reserved)
+
+
+class RedisPresenceRegistry(PresenceRegistry):
+    """保存在Redis中的在线用户注册表，供多个服务进程共享
+
+    系统用户只保存在本进程中（每个进程都会注册），普通用户名通过HSETNX原子占用，
+    释放时使用WATCH/MULTI事务；各聊天室的版本号由Redis统一递增，因此各进程发出的增量通知版本连续。
+    每个会话记录所属的服务进程，进程定期续期心跳（heartbeat）；进程崩溃或重启后心跳过期，
+    其他进程调用reap时释放它遗留的会话，用户名可以重新使用。
+    """
+
+    def __init__(self, client, reserved=None, prefix='jamp:', worker_ttl=30):
+        super().__init__(reserved)
+        self.client = client
+        self.worker_id = uuid.uuid4().hex
+        self.worker_ttl = worker_ttl
+        self._prefix = prefix + 'presence:'
+        self._names_key = self._prefix + 'names'  # {username: session_id}
+        self._sids_key = self._prefix + 'sids'  # {session_id: username}
+        self._sid_rooms_key = self._prefix + 'sid_rooms'  # {session_id: room}
+        self._sid_workers_key = self._prefix + 'sid_workers'  # {session_id: worker_id}
+        self._workers_key = self._prefix + 'workers'  # 有序集合 {worker_id: 心跳过期时间}
+        self._rooms_key = self._prefix + 'rooms'  # {room: 成员数}
+        self._local = {}  # 连接在本进程上的会话 {session_id: (username, room)}
+
+    def _worker_sids_key(self, worker_id):
+        """服务进程上的会话集合"""
+        return self._prefix + 'worker:' + worker_id + ':sids'
+
+    def _order_key(self, room):
+        """聊天室成员，按加入时间排序"""
+        return self._prefix + 'room:' + room + ':order'
+
+    def _version_key(self, room):
+        return self._prefix + 'room:' + room + ':version'
+
+    def claim(self, sid, username, room):
+        if username in self._reserved_names:
+            return 0
+        # HSETNX保证同一用户名在所有进程中只能被占用一次
+        if not self.client.hsetnx(self._names_key, username, sid):
+            if self.client.hget(self._names_key, username) == sid and self.room_of(sid) == room:
+                return int(self.client.get(self._version_key(room)) or 0)
+            return 0
+        if self.client.hexists(self._sids_key, sid):
+            # 该会话已以其他用户名加入
+            self.client.hdel(self._names_key, username)
+            return 0
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._sids_key, sid, username)
+        pipe.hset(self._sid_rooms_key, sid, room)
+        pipe.hset(self._sid_workers_key, sid, self.worker_id)
+        pipe.sadd(self._worker_sids_key(self.worker_id), sid)
+        pipe.zadd(self._workers_key, {self.worker_id: time.time() + self.worker_ttl})
+        pipe.zadd(self._order_key(room), {username: time.time()})
+        pipe.hincrby(self._rooms_key, room, 1)
+        pipe.incr(self._version_key(room))
+        version = pipe.execute()[-1]
+        self._local[sid] = (username, room)
+        return int(version)
+
+    def release(self, sid):
+        from redis.exceptions import WatchError
+        self._local.pop(sid, None)
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # 监视会话索引，与其他进程的并发修改冲突时重试
+                    pipe.watch(self._sids_key, self._sid_rooms_key)
+                    username = pipe.hget(self._sids_key, sid)
+                    room = pipe.hget(self._sid_rooms_key, sid)
+                    worker_id = pipe.hget(self._sid_workers_key, sid)
+                    if username is None or room is None:
+                        pipe.unwatch()
+                        return None, None, 0
+                    # 同时监视聊天室成员：最后一个成员离开时删除该聊天室的键，期间有人加入则重试
+                    pipe.watch(self._order_key(room))
+                    last = pipe.zcard(self._order_key(room)) <= 1
+                    version = int(pipe.get(self._version_key(room)) or 0) + 1
+                    pipe.multi()
+                    pipe.hdel(self._sids_key, sid)
+                    pipe.hdel(self._sid_rooms_key, sid)
+                    pipe.hdel(self._sid_workers_key, sid)
+                    if worker_id is not None:
+                        pipe.srem(self._worker_sids_key(worker_id), sid)
+                    pipe.hdel(self._names_key, username)
+                    if last:
+                        # 空聊天室不再保留，下次有人加入时重新创建（版本号从1开始，与单进程时相同）
+                        pipe.delete(self._order_key(room), self._version_key(room))
+                        pipe.hdel(self._rooms_key, room)
+                        pipe.execute()
+                        return username, room, version
+                    pipe.zrem(self._order_key(room), username)
+                    pipe.hincrby(self._rooms_key, room, -1)
+                    pipe.incr(self._version_key(room))
+                    return username, room, int(pipe.execute()[-1])
+                except WatchError:
+                    continue
+
+    def heartbeat(self):
+        self.client.zadd(self._workers_key, {self.worker_id: time.time() + self.worker_ttl})
+
+    def reap(self, orphans=False):
+        """释放心跳已过期的服务进程遗留的会话；orphans为True时（服务启动时）
+        还释放没有所属进程记录的会话（如旧版本遗留的）
+        """
+        released = []
+        for worker_id in self.client.zrangebyscore(self._workers_key, 0, time.time()):
+            if worker_id == self.worker_id:
+                continue
+            for sid in self.client.smembers(self._worker_sids_key(worker_id)):
+                released.append(self.release(sid))
+            pipe = self.client.pipeline(transaction=True)
+            pipe.delete(self._worker_sids_key(worker_id))
+            pipe.zrem(self._workers_key, worker_id)
+            pipe.execute()
+        if orphans:
+            # 会话和所属进程在同一个事务中写入，一起读取即可判断
+            pipe = self.client.pipeline(transaction=True)
+            pipe.hkeys(self._sids_key)
+            pipe.hgetall(self._sid_workers_key)
+            sids, owners = pipe.execute()
+            for sid in sids:
+                if sid not in owners:
+                    released.append(self.release(sid))
+        return [entry for entry in released if entry[0] is not None]
+
+    def username_of(self, sid):
+        local = self._local.get(sid)
+        if local is not None:
+            return local[0]
+        return self.client.hget(self._sids_key, sid)
+
+    def room_of(self, sid):
+        local = self._local.get(sid)
+        if local is not None:
+            return local[1]
+        return self.client.hget(self._sid_rooms_key, sid)
+
+    def is_online(self, username):
+        return username in self._reserved_names or bool(self.client.hexists(self._names_key, username))
+
+    def in_room(self, username, room):
+        if username in self._reserved_names:
+            return True
+        return self.client.zscore(self._order_key(room), username) is not None
+
+    def usernames(self, room):
+        return tuple(self.snapshot(room)['users'])
+
+    def snapshot(self, room):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(self._version_key(room))
+        pipe.zrange(self._order_key(room), 0, -1)
+        version, names = pipe.execute()
+        return {'version': int(version or 0), 'users': list(self._reserved.values()) + names}
+
+    def rooms(self):
+        return {room: int(count) for room, count in self.client.hgetall(self._rooms_key).items() if int(count) > 0}
+
+    def room_size(self, room):
+        return int(self.client.hget(self._rooms_key, room) or 0)
+
+    def __len__(self):
+        return len(self._reserved) + int(self.client.hlen(self._sids_key))
+
+
+def create_presence_registry(reserved=None, redis_url=None, prefix='jamp:', worker_ttl=30):
+    """根据配置创建在线用户注册表：指定Redis地址时在多个进程间共享，worker_ttl为服务进程心跳的有效期（秒）"""
+    if not redis_url:
+        return PresenceRegistry(reserved)
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("多进程部署需要安装redis: pip install redis")
+    client = redis.Redis.from_url(redis_url, decode_responses=True)
+    return RedisPresenceRegistry(client, reserved=reserved, prefix=prefix, worker_ttl=worker_ttl)
@@ -0,0 +1,81 @@
+# 川小农提示词组装
+# 按token预算裁剪历史对话，而不是固定保留最近N轮，避免一条超长回答拖慢上游
+import math
+import re
+
+# 中日韩字符及全角标点，按每字约1个token估算
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """离线估算文本的token数：中文约1字1个token，其他字符约4个字符1个token"""
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 4)
+
+
+def message_tokens(message):
+    """估算单条消息的token数"""
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summarize_turns(turns, max_chars):
+    """将较早的对话压缩为一段摘要（只保留用户问过的问题，不需要调用模型）"""
+    questions = []
+    used = 0
+    # 优先保留离当前最近的问题
+    for question, _ in reversed(turns):
+        question = question.strip().replace("\n", " ")
+        if used + len(question) > max_chars:
+            break
+        questions.append(question)
+        used += len(question)
+    if not questions:
+        return ""
+    return "此前对话摘要，用户曾问过：" + "；".join(reversed(questions))
+
+
+class PromptBuilder:
+    """在token预算内组装 system + 历史 + 当前问题 的消息列表"""
+
+    def __init__(self, system_prompt, token_budget=2000, summarize=False, summary_max_chars=200):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_max_chars = summary_max_chars
+
+    def build(self, question, history):
+        """返回(消息列表, 估算token数, 保留的历史轮数)"""
+        system = {"role": "system", "content": self.system_prompt}
+        current = {"role": "user", "content": question}
+        used = message_tokens(system) + message_tokens(current)
+
+        # 从最近一轮往前加入历史，超出预算即停止
+        kept = []
+        for user_msg, assistant_msg in reversed(history):
+            turn = [
+                {"role": "user", "content": user_msg},
+                {"role": "assistant", "content": assistant_msg}
+            ]
+            cost = sum(message_tokens(m) for m in turn)
+            if used + cost > self.token_budget:
+                break
+            kept[:0] = turn
+            used += cost
+
+        messages = [system]
+        dropped = history[:len(history) - len(kept) // 2]
+        if self.summarize and dropped:
+            summary = summarize_turns(dropped, self.summary_max_chars)
+            if summary:
+                summary_message = {"role": "system", "content": summary}
+                cost = message_tokens(summary_message)
+                if used + cost <= self.token_budget:
+                    messages.append(summary_message)
+                    used += cost
+
+        messages.extend(kept)
+        messages.append(current)
+        return messages, used, len(kept) // 2
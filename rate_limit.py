@@ -0,0 +1,89 @@
+# 频率限制
+# 令牌桶限制每个用户/每个聊天室的发言频率和AI提问频率，并发上限限制同时等待回复的AI问题数，
+# 被限制时由调用方通知客户端，计数器用于评估限制是否合适
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """按键（用户名、聊天室名）分别计数的令牌桶：每秒补充rate个令牌，最多积累burst个
+
+    rate为0时不做限制。最多跟踪max_keys个键，超出时丢弃最久未使用的键（长时间未使用的桶本来就已补满）
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # {key: [令牌数, 上次更新时间]}
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def try_acquire(self, key, cost=1):
+        """尝试取出cost个令牌，成功返回0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            self.allowed += 1
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0
+            self.limited += 1
+            return (cost - bucket[0]) / self.rate
+
+    def stats(self):
+        """计数器，供接口使用"""
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'tracked_keys': len(self._buckets)
+        }
+
+
+class ConcurrencyLimiter:
+    """同时进行中的任务数上限，limit为0时不做限制"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def try_acquire(self):
+        """占用一个名额，已满时返回False"""
+        with self._lock:
+            if self.limit and self._in_flight >= self.limit:
+                self.limited += 1
+                return False
+            self._in_flight += 1
+            self.allowed += 1
+            return True
+
+    def release(self):
+        """任务结束后释放名额"""
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self._in_flight,
+            'allowed': self.allowed,
+            'limited': self.limited
+        }
@@ -0,0 +1,57 @@
+# 聊天室指标
+# 按聊天室统计消息总数和最近一段时间的消息速率（按秒分桶，内存占用与窗口长度成正比）
+import threading
+import time
+from collections import deque
+
+
+class _RoomCounter:
+    def __init__(self):
+        self.total = 0
+        self.buckets = deque()  # [[秒, 消息数], ...]
+
+
+class RoomMetrics:
+    """每个聊天室的消息计数，window为计算消息速率的时间窗口（秒）"""
+
+    def __init__(self, window=60):
+        self.window = window
+        self._rooms = {}  # {room: _RoomCounter}
+        self._lock = threading.Lock()
+
+    def record_message(self, room):
+        """记录聊天室中的一条消息"""
+        now = int(time.time())
+        with self._lock:
+            counter = self._rooms.get(room)
+            if counter is None:
+                counter = self._rooms[room] = _RoomCounter()
+            counter.total += 1
+            if counter.buckets and counter.buckets[-1][0] == now:
+                counter.buckets[-1][1] += 1
+            else:
+                counter.buckets.append([now, 1])
+            self._trim(counter, now)
+
+    def stats(self, room):
+        """聊天室的消息总数和每分钟消息数"""
+        now = int(time.time())
+        with self._lock:
+            counter = self._rooms.get(room)
+            if counter is None:
+                return {'messages_total': 0, 'messages_per_minute': 0.0}
+            self._trim(counter, now)
+            recent = sum(count for _, count in counter.buckets)
+            return {
+                'messages_total': counter.total,
+                'messages_per_minute': round(recent * 60 / self.window, 2)
+            }
+
+    def forget(self, room):
+        """聊天室关闭后移除其计数"""
+        with self._lock:
+            self._rooms.pop(room, None)
+
+    def _trim(self, counter, now):
+        while counter.buckets and counter.buckets[0][0] <= now - self.window:
+            counter.buckets.popleft()
@@ -0,0 +1,73 @@
+# 延迟发送队列
+# 机器人的欢迎语、@回复等需要稍后发送的消息交给后台任务按时间执行，事件处理函数不再sleep等待
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DelayedTaskQueue:
+    """按到期时间排序的延迟任务队列，由一个后台任务执行到期任务
+
+    threading模式下后台任务等待到下一个任务到期（有新任务或停止时被唤醒）；
+    eventlet/gevent模式下以tick为精度轮询
+    """
+
+    def __init__(self, socketio, tick=0.05):
+        self.socketio = socketio
+        self.tick = tick
+        self._blocking = getattr(socketio, 'async_mode', None) == 'threading'
+        self._tasks = []  # 小顶堆 [(到期时间, 序号, func, args, kwargs)]
+        self._counter = itertools.count()  # 到期时间相同时按提交顺序执行
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        """启动后台任务（重复调用无副作用）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        """通知后台任务退出（threading模式下是非守护线程，退出服务前需要调用）"""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+
+    def call_later(self, delay, func, *args, **kwargs):
+        """delay秒后在后台执行func(*args, **kwargs)，立即返回"""
+        self.start()
+        with self._lock:
+            heapq.heappush(self._tasks, (time.monotonic() + delay, next(self._counter), func, args, kwargs))
+            self._wakeup.notify()
+
+    def pending(self):
+        """尚未执行的任务数量"""
+        return len(self._tasks)
+
+    def _run(self):
+        while not self._stopped:
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                while self._tasks and self._tasks[0][0] <= now:
+                    due.append(heapq.heappop(self._tasks))
+                if not due and self._blocking and not self._stopped:
+                    # 等待到最早的任务到期，没有任务时一直等待，call_later和stop会唤醒
+                    self._wakeup.wait(self._tasks[0][0] - now if self._tasks else None)
+                    continue
+            for _, _, func, args, kwargs in due:
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"延迟任务执行失败: {str(e)}")
+            if not self._blocking:
+                # eventlet/gevent模式下使用socketio.sleep轮询，让出给其他协程
+                self.socketio.sleep(self.tick)
@@ -1,16 +1,52 @@
-import gradio as gr
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError, ResponseError
+from urllib3.util.retry import Retry
 import json
 import logging
+import threading
+import time
+import config
+import metrics
+from ai_cache import ResponseCache, make_cache_key
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from history_store import create_history_store
+from prompt_builder import PromptBuilder
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# API配置
-api_key="sk-mamcrltysfujecncmrmlbfumdxvudmqedxzvkqcvhyiqsoqh"
-module_name="Qwen/Qwen2.5-7B-Instruct"
-api_url="https://api.siliconflow.cn/v1/chat/completions"
+# 上游请求耗时：mode为complete/stream，outcome为ok/error/cancelled（流式回复中途被放弃）
+UPSTREAM_LATENCY = metrics.histogram('jamp_ai_upstream_seconds', 'AI上游请求总耗时', ('mode', 'outcome'),
+                                     buckets=metrics.AI_BUCKETS)
+UPSTREAM_FIRST_CHUNK = metrics.histogram('jamp_ai_upstream_first_chunk_seconds', 'AI上游流式响应的首段耗时',
+                                         buckets=metrics.AI_BUCKETS)
+
+# 熔断期间的降级回复：kind为cached（使用缓存的回答）/busy（繁忙提示）
+FALLBACKS = metrics.counter('jamp_ai_fallback_total', 'AI上游熔断期间给出的降级回复次数', ('kind',))
+
+# AI上游熔断器，连续失败时让问题立即得到降级回复，不再等待超时
+breaker = CircuitBreaker(
+    window=config.AI_BREAKER_WINDOW,
+    min_calls=config.AI_BREAKER_MIN_CALLS,
+    failure_rate=config.AI_BREAKER_FAILURE_RATE,
+    open_seconds=config.AI_BREAKER_OPEN_SECONDS,
+    half_open_probes=config.AI_BREAKER_HALF_OPEN_PROBES
+) if config.AI_BREAKER_ENABLED else None
+
+_BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+metrics.gauge_callback('jamp_ai_breaker_state', 'AI上游熔断器状态（0关闭，1半开，2熔断）',
+                       lambda: _BREAKER_STATE_VALUES[breaker.state] if breaker is not None else None)
+metrics.counter_callback('jamp_ai_breaker_opened_total', 'AI上游熔断次数',
+                         lambda: breaker.opened if breaker is not None else None)
+metrics.counter_callback('jamp_ai_breaker_rejected_total', '熔断期间未发往上游的请求数',
+                         lambda: breaker.rejected if breaker is not None else None)
+
+BUSY_REPLY = "AI助手现在有点忙，请稍后再问我吧～"
+
+# API配置（见config.py，可通过环境变量AI_API_URL等修改）
+api_key=config.AI_API_KEY
+module_name=config.AI_MODEL
+api_url=config.AI_API_URL
 
 # 系统提示信息
 system_prompt = """
@@ -39,7 +75,63 @@ system_prompt = """
 - 当用户输入以上功能以外的内容时，运用AI智能回复
 - 当用户询问其他学校时，将友好的话题带回川农
 """
+
+# 当前线程中进行的上游请求的截止时间（time.monotonic），由post_completion设置
+_deadline = threading.local()
+
+class DeadlineRetry(Retry):
+    """退避等待后会超出本次请求的时间预算（AI_DEADLINE）时不再重试"""
+    
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+        deadline = getattr(_deadline, 'at', None)
+        if deadline is not None:
+            wait = retry.get_backoff_time()
+            if response is not None and retry.respect_retry_after_header:
+                wait = max(wait, retry.get_retry_after(response) or 0)
+            if time.monotonic() + wait >= deadline:
+                if isinstance(error, ReadTimeoutError):
+                    raise error  # 保持为读取超时，由requests转换为Timeout
+                # 与重试次数耗尽的处理相同：错误交给requests转换，状态码重试则返回最后的响应
+                raise MaxRetryError(_pool, url, error or ResponseError("超出AI请求时间预算"))
+        return retry
+    
+def create_session():
+    """创建长连接复用的HTTP会话，带连接池和429/5xx退避重试（不超出时间预算）"""
+    retry = DeadlineRetry(
+        total=config.AI_MAX_RETRIES,
+        backoff_factor=config.AI_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),  # 默认不重试POST，这里显式开启
+        respect_retry_after_header=True,
+        raise_on_status=False  # 重试耗尽后返回最后的响应，交给raise_for_status处理
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,  # 只访问一个上游主机
+        pool_maxsize=config.AI_HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+def request_timeout(remaining=None):
+    """单次请求的(连接超时, 读取超时)，remaining为剩余的时间预算（秒）"""
+    if remaining is None:
+        return (config.AI_CONNECT_TIMEOUT, config.AI_READ_TIMEOUT)
+    remaining = max(remaining, 0.1)
+    return (min(config.AI_CONNECT_TIMEOUT, remaining), min(config.AI_READ_TIMEOUT, remaining))
     
+# 提示词组装器，按token预算裁剪历史对话
+prompt_builder = PromptBuilder(
+    system_prompt,
+    token_budget=config.AI_PROMPT_TOKEN_BUDGET,
+    summarize=config.AI_PROMPT_SUMMARIZE,
+    summary_max_chars=config.AI_PROMPT_SUMMARY_MAX_CHARS
+)
+
 # AI助手类，供Flask应用集成
 class BotAI:
     def __init__(self):
@@ -47,117 +139,358 @@ class BotAI:
         self.module_name = module_name
         self.api_url = api_url
         self.system_prompt = system_prompt
-        self.user_histories = {}
+        # 对话历史存储（内存LRU，可选SQLite持久化）
+        self.history_store = create_history_store(
+            config.HISTORY_DB_PATH,
+            redis_url=config.STATE_REDIS_URL,
+            prefix=config.STATE_KEY_PREFIX,
+            redis_ttl=config.HISTORY_REDIS_TTL,
+            max_users=config.HISTORY_MAX_USERS,
+            max_bytes=config.HISTORY_MAX_BYTES,
+            max_turns=config.HISTORY_MAX_TURNS
+        )
+        # 长期持有的连接池会话，避免每次提问都重新进行TCP+TLS握手
+        self.session = create_session()
+        # 相同问题的回复缓存，同时合并并发的相同请求
+        self.cache = ResponseCache(
+            ttl=config.AI_CACHE_TTL,
+            max_entries=config.AI_CACHE_MAX_ENTRIES,
+            max_bytes=config.AI_CACHE_MAX_BYTES
+        ) if config.AI_CACHE_ENABLED else None
+    
+    def pool_stats(self):
+        """连接池统计：请求总数、新建连接数（握手次数）、复用连接的请求数"""
+        requests_count = 0
+        connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_count += pool.num_requests
+                connections += pool.num_connections
+        return {
+            "requests": requests_count,
+            "connections_opened": connections,
+            "pool_hits": max(requests_count - connections, 0)
+        }
+    
+    def get_history(self, username):
+        """获取用户历史"""
+        return self.history_store.get(username)
+    
+    def remember(self, username, question, response):
+        """更新历史记录，存储会限制历史长度"""
+        self.history_store.append(username, question, response)
+    
+    def forget(self, username):
+        """用户离开后将其历史移出内存"""
+        self.history_store.evict(username)
+    
+    def cache_key(self, question, history):
+        """回复缓存的键"""
+        return make_cache_key(question, history, config.AI_CACHE_HISTORY_TURNS)
     
     def get_response(self, question, username):
-        """获取AI回复，与Flask应用集成"""
-        # 初始化或获取用户历史
-        if username not in self.user_histories:
-            self.user_histories[username] = []
+        """获取AI回复，与Flask应用集成；相同问题优先使用缓存并合并并发请求"""
+        history = self.get_history(username)
         
-        history = self.user_histories[username]
+        try:
+            if self.cache is None:
+                response = request_completion(question, history, session=self.session)
+            else:
+                response = self.cache.do(
+                    self.cache_key(question, history),
+                    lambda: request_completion(question, history, session=self.session)
+                )
+        except CircuitOpenError:
+            return self.fallback_reply(question, username)
+        except AIServiceError as e:
+            # 失败的提示不写入缓存和历史记录
+            return e.reply
+        except Exception as e:
+            logger.error(f"未预期的错误: {str(e)}")
+            return f"很抱歉，处理您的请求时发生错误: {str(e)}"
         
-        # 调用聊天函数
-        response = chat_with_siliconflow(question, history)
+        self.remember(username, question, response)
+        return response
+    
+    def stream_response(self, question, username):
+        """以流式方式获取AI回复，逐段产出文本，结束后写入历史记录和缓存
         
-        # 更新历史记录
-        history.append((question, response))
-        # 限制历史长度
-        max_history_length = 5
-        if len(history) > max_history_length:
-            self.user_histories[username] = history[-max_history_length:]
+        缓存命中或有相同问题正在请求时，等待其结果并一次性产出完整回复。
+        """
+        history = self.get_history(username)
         
-        return response
+        key = None
+        call = None
+        if self.cache is not None:
+            key = self.cache_key(question, history)
+            state, result = self.cache.begin(key)
+            if state == 'hit':
+                self.remember(username, question, result)
+                yield result
+                return
+            if state == 'wait':
+                try:
+                    response = result.wait()
+                except CircuitOpenError:
+                    yield self.fallback_reply(question, username)
+                    return
+                except AIServiceError as e:
+                    yield e.reply
+                    return
+                except Exception as e:
+                    yield f"很抱歉，处理您的请求时发生错误: {str(e)}"
+                    return
+                self.remember(username, question, response)
+                yield response
+                return
+            call = result
+        
+        parts = []
+        error = None
+        completed = False
+        try:
+            for delta in stream_completion(question, history, session=self.session):
+                parts.append(delta)
+                yield delta
+            completed = True
+        except CircuitOpenError as e:
+            error = e
+            yield self.fallback_reply(question, username)
+        except AIServiceError as e:
+            error = e
+            yield e.reply
+        except Exception as e:
+            logger.error(f"未预期的错误: {str(e)}")
+            error = AIServiceError(f"很抱歉，处理您的请求时发生错误: {str(e)}")
+            yield error.reply
+        finally:
+            if call is not None:
+                # 中途被放弃的流不写入缓存
+                if completed and parts:
+                    self.cache.finish(key, call, value="".join(parts))
+                else:
+                    self.cache.finish(key, call, error=error or AIServiceError("AI服务没有返回内容，请稍后重试。"))
+        
+        if completed:
+            self.remember(username, question, "".join(parts))
+    
+    def upstream_available(self):
+        """AI上游是否可用（未处于熔断中）"""
+        return breaker is None or not breaker.is_open()
+    
+    def fallback_reply(self, question, username):
+        """熔断期间的降级回复：缓存中有相同问题的回答（即使已过期）时使用它，否则返回繁忙提示"""
+        if self.cache is not None:
+            history = self.get_history(username)
+            # 先按带上下文的键查找，再按只包含问题本身的键查找
+            for key in (self.cache_key(question, history), make_cache_key(question, history, 0)):
+                answer = self.cache.get_stale(key)
+                if answer is not None:
+                    FALLBACKS.inc(kind="cached")
+                    return f"{answer}\n\n（AI服务暂时繁忙，以上是之前的回答）"
+        FALLBACKS.inc(kind="busy")
+        return BUSY_REPLY
+    
+    def breaker_stats(self):
+        """熔断器统计，未启用熔断器时返回None"""
+        return breaker.stats() if breaker is not None else None
+    
+    def cache_stats(self):
+        """回复缓存统计，未启用缓存时返回None"""
+        return self.cache.stats() if self.cache is not None else None
 
 # 创建全局bot_ai实例，供Flask应用导入
 bot_ai = BotAI()
 
-# 创建聊天函数，使用requests直接调用SiliconFlow API
-def chat_with_siliconflow(message, history):
-    """与SiliconFlow API交互的聊天函数"""
+def build_messages(message, history):
+    """构建发送给SiliconFlow API的消息列表，历史对话按token预算裁剪"""
+    messages, prompt_tokens, kept_turns = prompt_builder.build(message, history)
+    logger.debug(f"提示词大小: 约{prompt_tokens} tokens, 保留历史 {kept_turns}/{len(history)} 轮")
+    return messages
+
+def build_headers():
+    """构建请求头"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+class AIServiceError(Exception):
+    """AI上游调用失败，reply为展示给用户的提示文本"""
+    
+    def __init__(self, reply):
+        super().__init__(reply)
+        self.reply = reply
+
+class CircuitOpenError(AIServiceError):
+    """熔断期间未请求上游"""
+    
+    def __init__(self):
+        super().__init__(BUSY_REPLY)
+
+def acquire_upstream():
+    """请求上游前检查熔断器，返回熔断器的许可（未启用熔断器时为None），熔断中时抛出CircuitOpenError"""
+    if breaker is None:
+        return None
+    permit = breaker.allow()
+    if permit is None:
+        raise CircuitOpenError()
+    return permit
+
+def release_upstream(permit, outcome):
+    """上游请求结束后带着许可向熔断器报告结果：ok/error/cancelled"""
+    if breaker is None or permit is None:
+        return
+    if outcome == "ok":
+        breaker.record_success(permit)
+    elif outcome == "error":
+        breaker.record_failure(permit)
+    else:
+        breaker.record_cancel(permit)
+
+def post_completion(data, session=None, stream=False):
+    """发送补全请求，网络或HTTP错误转换为AIServiceError
+    
+    包括重试在内最多等待AI_DEADLINE秒得到响应；流式响应的每段之间也不超过该时间。
+    """
+    remaining = config.AI_DEADLINE if config.AI_DEADLINE > 0 else None
+    if remaining is not None:
+        _deadline.at = time.monotonic() + remaining
     try:
-        logger.info(f"收到用户消息: {message[:50]}...")
-        logger.info(f"历史消息数量: {len(history)}")
-        
-        # 构建请求头
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        # 构建消息历史
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        # 添加历史对话（限制历史长度，避免token过长）
-        max_history_length = 5  # 最多保留最近5轮对话
-        for user_msg, assistant_msg in history[-max_history_length:]:
-            messages.append({"role": "user", "content": user_msg})
-            messages.append({"role": "assistant", "content": assistant_msg})
-        
-        # 添加当前问题
-        messages.append({"role": "user", "content": message})
-        
-        # 准备请求数据
-        data = {
-            "model": module_name,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1000  # 减少最大token数量
-        }
-        
-        logger.info("准备发送请求到SiliconFlow API")
-        # 发送请求，设置超时
-        try:
-            response = requests.post(api_url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()  # 检查HTTP错误
-        except requests.exceptions.Timeout:
-            logger.error("API请求超时")
-            return "很抱歉，与AI服务的连接超时了，请稍后重试。"
-        except requests.exceptions.ConnectionError:
-            logger.error("API连接错误")
-            return "很抱歉，无法连接到AI服务，请检查网络连接后重试。"
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"HTTP错误: {http_err}")
-            return f"服务器返回错误: {str(http_err)}"
+        http = session if session is not None else requests
+        response = http.post(api_url, headers=build_headers(), json=data, timeout=request_timeout(remaining),
+                             stream=stream)
+        response.raise_for_status()  # 检查HTTP错误
+    except requests.exceptions.Timeout:
+        logger.error("API请求超时")
+        raise AIServiceError("很抱歉，与AI服务的连接超时了，请稍后重试。")
+    except requests.exceptions.ConnectionError:
+        logger.error("API连接错误")
+        raise AIServiceError("很抱歉，无法连接到AI服务，请检查网络连接后重试。")
+    except requests.exceptions.HTTPError as http_err:
+        logger.error(f"HTTP错误: {http_err}")
+        raise AIServiceError(f"服务器返回错误: {str(http_err)}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"API请求失败: {str(e)}")
+        raise AIServiceError("很抱歉，AI服务暂时不可用，请稍后重试。")
+    finally:
+        _deadline.at = None
+    return response
+
+def request_completion(message, history, session=None):
+    """请求一次完整回复，失败时抛出AIServiceError"""
+    logger.debug(f"收到用户消息: {message[:50]}..., 历史消息数量: {len(history)}")
+    
+    # 准备请求数据
+    data = {
+        "model": module_name,
+        "messages": build_messages(message, history),
+        "temperature": 0.7,
+        "max_tokens": 1000  # 减少最大token数量
+    }
+    
+    permit = acquire_upstream()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        response = post_completion(data, session=session)
         
         # 处理响应
         try:
             response_data = response.json()
-            logger.info(f"API返回状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                if response_data.get("choices") and len(response_data["choices"]) > 0:
-                    result = response_data["choices"][0]["message"]["content"]
-                    logger.info("API调用成功")
-                    return result
-                else:
-                    logger.error(f"API返回格式不正确: {response_data}")
-                    return "AI服务返回的数据格式不正确，请稍后重试。"
-            else:
-                logger.error(f"API调用失败，状态码: {response.status_code}, 错误信息: {response.text}")
-                return f"服务调用失败: {response.status_code}"
         except json.JSONDecodeError:
             logger.error(f"响应解析错误: {response.text}")
-            return "无法解析AI服务的响应，请稍后重试。"
+            raise AIServiceError("无法解析AI服务的响应，请稍后重试。")
+        
+        if response.status_code != 200:
+            logger.error(f"API调用失败，状态码: {response.status_code}, 错误信息: {response.text}")
+            raise AIServiceError(f"服务调用失败: {response.status_code}")
+        if not response_data.get("choices"):
+            logger.error(f"API返回格式不正确: {response_data}")
+            raise AIServiceError("AI服务返回的数据格式不正确，请稍后重试。")
+        
+        outcome = "ok"
+        logger.debug("API调用成功")
+        return response_data["choices"][0]["message"]["content"]
+    finally:
+        release_upstream(permit, outcome)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, mode="complete", outcome=outcome)
+
+def stream_completion(message, history, session=None):
+    """以流式方式请求回复，逐段产出文本，失败时抛出AIServiceError"""
+    logger.debug(f"收到用户消息(流式): {message[:50]}...")
     
+    data = {
+        "model": module_name,
+        "messages": build_messages(message, history),
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "stream": True
+    }
+    permit = acquire_upstream()
+    started = time.perf_counter()
+    outcome = "error"
+    first_chunk = True
+    try:
+        response = post_completion(data, session=session, stream=True)
+        
+        # 按SSE格式逐行解析: "data: {...}"，以"data: [DONE]"结束
+        response.encoding = "utf-8"  # text/event-stream未声明编码时requests会按ISO-8859-1解码
+        with response:
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(payload)
+                    except json.JSONDecodeError:
+                        logger.error(f"流式响应解析错误: {payload}")
+                        continue
+                    choices = chunk.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        if first_chunk:
+                            first_chunk = False
+                            UPSTREAM_FIRST_CHUNK.observe(time.perf_counter() - started)
+                        yield delta
+            except requests.exceptions.RequestException as e:
+                logger.error(f"流式响应中断: {str(e)}")
+                raise AIServiceError("很抱歉，AI服务的回复中断了，请稍后重试。")
+        outcome = "ok"
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    finally:
+        release_upstream(permit, outcome)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, mode="stream", outcome=outcome)
+    logger.debug("流式API调用完成")
+
+# 创建聊天函数，使用requests直接调用SiliconFlow API
+def chat_with_siliconflow(message, history, session=None):
+    """与SiliconFlow API交互的聊天函数，session为空时使用一次性连接"""
+    try:
+        return request_completion(message, history, session=session)
+    except AIServiceError as e:
+        return e.reply
     except Exception as e:
         logger.error(f"未预期的错误: {str(e)}")
         return f"很抱歉，处理您的请求时发生错误: {str(e)}"
 
-# 创建Gradio聊天界面
-if __name__ == "__main__":
-    logger.info("启动川小农AI小助手...")
-    
-    # 设置界面标题和描述
-    interface = gr.ChatInterface(
-        fn=chat_with_siliconflow,
-        title="川小农AI小助手",
-        description="四川农业大学AI小助手，为您提供学习、生活和校园相关的帮助。",
-        theme=gr.themes.Soft()
-    )
-    
-    # 启动界面，根据系统要求设置share=True
-    logger.info("正在启动Gradio界面...")
-    interface.launch(share=True)
+def stream_chat_with_siliconflow(message, history, session=None):
+    """以流式方式调用SiliconFlow API，逐段产出回复文本，出错时产出提示文本"""
+    try:
+        yield from stream_completion(message, history, session=session)
+    except AIServiceError as e:
+        yield e.reply
+    except Exception as e:
+        logger.error(f"未预期的错误: {str(e)}")
+        yield f"很抱歉，处理您的请求时发生错误: {str(e)}"
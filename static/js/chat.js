@@ -0,0 +1,447 @@
+// 聊天室页面脚本（用户名和聊天室由chat.html的body data属性传入）
+document.addEventListener('DOMContentLoaded', function() {
+    const username = document.body.dataset.username;
+    const room = document.body.dataset.room;
+    // 从URL获取服务器地址参数
+    const urlParams = new URLSearchParams(window.location.search);
+    const serverUrl = urlParams.get('server');
+    
+    // 如果有服务器地址参数，使用它创建Socket.IO连接
+    const socket = serverUrl ? io(serverUrl) : io();
+    console.log('连接到服务器:', serverUrl || '当前域名');
+    
+    // 显示错误消息并返回登录页面
+    function showJoinError(message) {
+        alert(message);
+        window.location.href = '/';
+    }
+    
+    // 处理加入聊天室失败的事件
+    socket.on('join_error', function(data) {
+        showJoinError(data.message);
+    });
+    
+    // DOM元素
+    const messagesContainer = document.getElementById('messages-container');
+    const messageForm = document.getElementById('message-form');
+    const messageInput = document.getElementById('message-input');
+    const usersList = document.getElementById('users-list');
+    const onlineCount = document.getElementById('online-count');
+    const logoutBtn = document.getElementById('logout-btn');
+    const emojiBtn = document.getElementById('emoji-btn');
+    const emojiPicker = document.getElementById('emoji-picker');
+    const helpBtn = document.getElementById('help-btn');
+    const helpModal = document.getElementById('help-modal');
+    const closeHelp = document.getElementById('close-help');
+    
+    // 紧凑传输格式（服务端WIRE_FORMAT='compact'）的短键名 -> 原键名，与wire_format.py中的SHORT_KEYS对应
+    const LONG_KEYS = {
+        u: 'username', m: 'message', t: 'timestamp', mu: 'mentioned_users', ai: 'is_ai',
+        sy: 'is_system', mv: 'is_movie', url: 'movie_url', mn: 'is_mention', mt: 'mention_target',
+        id: 'message_id', s: 'seq', v: 'version', d: 'delta', a: 'asker', q: 'queue_depth'
+    };
+    
+    function isBinary(data) {
+        return data instanceof ArrayBuffer || ArrayBuffer.isView(data);
+    }
+    
+    // 还原紧凑格式的数据：恢复原键名，毫秒时间戳转换为 HH:MM:SS（默认格式的数据不受影响）
+    function expandCompact(data) {
+        const result = {};
+        Object.keys(data).forEach(function(key) {
+            result[LONG_KEYS[key] || key] = data[key];
+        });
+        if (typeof result.timestamp === 'number') {
+            result.timestamp = new Date(result.timestamp).toTimeString().slice(0, 8);
+        }
+        return result;
+    }
+    
+    // 注册聊天室广播事件的处理函数，紧凑格式的二进制负载先解码再交给处理函数
+    function onRoomEvent(event, handler) {
+        socket.on(event, function(data) {
+            if (isBinary(data)) {
+                data = expandCompact(JSON.parse(new TextDecoder().decode(data)));
+            }
+            handler(data);
+        });
+    }
+    
+    // 连接Socket.IO并加入聊天室，重连时带上最后收到的消息序号，服务端只补发缺失的消息
+    socket.on('connect', function() {
+        console.log('已连接到服务器');
+        socket.emit('join', { username: username, room: room, last_seq: lastSeq });
+    });
+    
+    // 接收欢迎消息，附带在线列表的完整快照
+    socket.on('welcome_message', function(data) {
+        addSystemMessage(data.message);
+        renderOnlineUsers(data.presence);
+    });
+    
+    // 版本缺失后重新获取的完整快照
+    socket.on('presence_snapshot', function(data) {
+        renderOnlineUsers(data);
+    });
+    
+    // 接收新消息
+    onRoomEvent('new_message', function(data) {
+        if (!acceptSeq(data.seq)) {
+            return;
+        }
+        // AI回复到达时替换对应的"思考中"占位消息
+        if (data.message_id && replacePendingMessage(data)) {
+            return;
+        }
+        addMessage(data);
+    });
+    
+    // 服务端开启广播合并时，多个事件合并为一个message_batch帧（UTF-8 JSON字节），按顺序分发给对应的处理函数
+    socket.on('message_batch', function(payload) {
+        JSON.parse(new TextDecoder().decode(payload)).forEach(function(item) {
+            // 紧凑格式的短键名在这里还原，默认格式的数据原样通过
+            const data = expandCompact(item[1]);
+            socket.listeners(item[0]).forEach(function(handler) {
+                handler(data);
+            });
+        });
+    });
+    
+    // 接收加入前（或断线期间）错过的消息，一次性补发
+    socket.on('message_backlog', function(data) {
+        if (data.reset) {
+            seenSeqs.clear();
+            lastSeq = 0;
+        }
+        if (data.truncated && lastSeq > 0) {
+            addSystemMessage('断线期间的部分消息已无法补发');
+        }
+        data.messages.forEach(function(message) {
+            if (!acceptSeq(message.seq)) {
+                return;
+            }
+            if (!(message.message_id && replacePendingMessage(message))) {
+                addMessage(message);
+            }
+        });
+        lastSeq = Math.max(lastSeq, data.latest_seq);
+    });
+    
+    // 接收AI"思考中"占位消息
+    onRoomEvent('ai_thinking', function(data) {
+        const waiting = data.queue_depth > 0 ? `（前面还有 ${data.queue_depth} 个问题）` : '';
+        const element = addMessage({
+            username: data.username,
+            message: `正在思考 ${data.asker} 的问题…${waiting}`,
+            timestamp: data.timestamp,
+            is_ai: true
+        });
+        element.dataset.messageId = data.message_id;
+        element.classList.add('pending-message');
+    });
+    
+    // 接收AI流式回复片段，追加到同一个消息气泡
+    onRoomEvent('ai_delta', function(data) {
+        const pending = messagesContainer.querySelector(`[data-message-id="${data.message_id}"]`);
+        if (!pending) {
+            return;
+        }
+        const content = pending.querySelector('.message-content');
+        if (pending.classList.contains('pending-message')) {
+            // 收到第一段内容时清空"思考中"提示
+            pending.classList.remove('pending-message');
+            content.textContent = '';
+        }
+        content.textContent += data.delta;
+        scrollToBottom();
+    });
+    
+    // AI流式回复结束，用完整内容重新渲染
+    onRoomEvent('ai_done', function(data) {
+        if (!acceptSeq(data.seq)) {
+            return;
+        }
+        if (!replacePendingMessage(data)) {
+            addMessage(data);
+        }
+    });
+    
+    // 接收用户加入消息
+    onRoomEvent('user_joined', function(data) {
+        addSystemMessage(`${data.username} 加入了聊天室`);
+        applyPresenceChange(data.version, function() {
+            addOnlineUser(data.username);
+        });
+    });
+    
+    // 接收用户离开消息
+    onRoomEvent('user_left', function(data) {
+        addSystemMessage(`${data.username} 离开了聊天室`);
+        applyPresenceChange(data.version, function() {
+            removeOnlineUser(data.username);
+        });
+    });
+    
+    // 请求被频率限制拒绝，提示用户稍后再试
+    socket.on('rate_limited', function(data) {
+        const wait = data.retry_after ? `（约 ${Math.ceil(data.retry_after)} 秒后可再试）` : '';
+        addSystemMessage(`${data.message}${wait}`);
+    });
+    
+    // 表单提交处理
+    messageForm.addEventListener('submit', function(e) {
+        e.preventDefault();
+        const message = messageInput.value.trim();
+        if (message) {
+            socket.emit('send_message', { message: message });
+            messageInput.value = '';
+        }
+    });
+    
+    // 退出按钮处理
+    logoutBtn.addEventListener('click', function() {
+        socket.emit('leave');
+        window.location.href = '/';
+    });
+    
+    // Emoji选择器
+    emojiBtn.addEventListener('click', function() {
+        emojiPicker.classList.toggle('hidden');
+    });
+    
+    // 点击页面其他区域关闭Emoji选择器
+    document.addEventListener('click', function(e) {
+        if (!emojiBtn.contains(e.target) && !emojiPicker.contains(e.target)) {
+            emojiPicker.classList.add('hidden');
+        }
+    });
+    
+    // 选择Emoji
+    const emojiGrid = emojiPicker.querySelector('.emoji-grid');
+    emojiGrid.addEventListener('click', function(e) {
+        if (e.target.textContent) {
+            messageInput.value += e.target.textContent;
+            messageInput.focus();
+        }
+    });
+    
+    // 帮助弹窗
+    helpBtn.addEventListener('click', function() {
+        helpModal.classList.remove('hidden');
+    });
+    
+    closeHelp.addEventListener('click', function() {
+        helpModal.classList.add('hidden');
+    });
+    
+    // 点击弹窗外部关闭
+    window.addEventListener('click', function(e) {
+        if (e.target === helpModal) {
+            helpModal.classList.add('hidden');
+        }
+    });
+    
+    // 添加消息到聊天区域
+    function addMessage(data) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('message');
+        
+        // 根据消息类型添加不同样式
+        if (data.is_system) {
+            messageElement.classList.add('system-message');
+        } else if (data.is_ai) {
+            messageElement.classList.add('ai-message');
+        } else if (data.username === username) {
+            messageElement.classList.add('my-message');
+        } else {
+            messageElement.classList.add('other-message');
+        }
+        
+        // 构建消息内容
+        let messageHTML = '';
+        if (!data.is_system) {
+            const isBot = data.username === '川小农';
+            messageHTML += `<div class="message-header">
+                <span class="message-username ${isBot ? 'bot-username' : ''}">${data.username}${isBot ? ' 🤖' : ''}</span>
+                <span class="message-time">${data.timestamp}</span>
+            </div>`;
+        }
+        
+        // 处理电影链接
+        if (data.is_movie && data.movie_url) {
+            messageHTML += `<div class="message-content movie-message">
+                <p>🎬 电影链接：<a href="${data.movie_url}" target="_blank">${data.movie_url}</a></p>
+                <!-- 电影播放器 -->
+                <div class="video-container" style="position: relative; padding-bottom: 56.25%; height: 0; overflow: hidden; max-width: 100%;">
+                    <iframe 
+                        src="${data.movie_url}" 
+                        frameborder="0" 
+                        allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture" 
+                        allowfullscreen 
+                        style="position: absolute; top: 0; left: 0; width: 100%; height: 100%; background-color: #000; z-index: 1;">
+                    </iframe>
+                </div>
+                <div style="margin-top: 8px; font-size: 12px; color: #999;">如果视频无法播放，请点击上方链接在新窗口打开</div>
+            </div>`;
+        } else {
+            // 处理@提醒，添加高亮
+            let content = data.message;
+            if (content.includes('@')) {
+                content = content.replace(/@(\w+)/g, function(match, username) {
+                    return `<span class="mention">${match}</span>`;
+                });
+            }
+            messageHTML += `<div class="message-content">${content}</div>`;
+        }
+        
+        messageElement.innerHTML = messageHTML;
+        messagesContainer.appendChild(messageElement);
+        
+        // 滚动到底部
+        scrollToBottom();
+        return messageElement;
+    }
+    
+    // 用最终消息替换占位消息，找不到占位时返回false
+    function replacePendingMessage(data) {
+        const pending = messagesContainer.querySelector(`[data-message-id="${data.message_id}"]`);
+        if (!pending) {
+            return false;
+        }
+        const element = addMessage(data);
+        element.dataset.messageId = data.message_id;
+        pending.replaceWith(element);
+        return true;
+    }
+    
+    // 添加系统消息
+    function addSystemMessage(message) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('message', 'system-message');
+        messageElement.innerHTML = `<div class="message-content">${message}</div>`;
+        messagesContainer.appendChild(messageElement);
+        scrollToBottom();
+    }
+    
+    // 已显示的聊天室消息序号，用于重连补发时去重
+    let lastSeq = 0;
+    const seenSeqs = new Set();
+    
+    // 记录消息序号，已显示过的消息返回false；没有序号的私有消息总是显示
+    function acceptSeq(seq) {
+        if (seq === undefined) {
+            return true;
+        }
+        if (seenSeqs.has(seq)) {
+            return false;
+        }
+        seenSeqs.add(seq);
+        if (seenSeqs.size > 500) {
+            // 只保留最近的序号
+            seenSeqs.delete(seenSeqs.values().next().value);
+        }
+        lastSeq = Math.max(lastSeq, seq);
+        return true;
+    }
+    
+    // 在线用户列表 {用户名: DOM元素}，按服务端版本号增量更新
+    const onlineUsers = new Map();
+    let presenceVersion = null;
+    
+    // 用完整快照重建在线用户列表
+    function renderOnlineUsers(snapshot) {
+        usersList.innerHTML = '';
+        onlineUsers.clear();
+        snapshot.users.forEach(addOnlineUser);
+        onlineCount.textContent = onlineUsers.size;
+        presenceVersion = snapshot.version;
+    }
+    
+    // 应用一次在线列表变化：版本连续时直接应用，出现缺失时请求完整快照
+    function applyPresenceChange(version, change) {
+        if (presenceVersion === null || version <= presenceVersion) {
+            // 尚未收到快照，或该变化已包含在快照中
+            return;
+        }
+        if (version !== presenceVersion + 1) {
+            presenceVersion = null;
+            socket.emit('presence_resync');
+            return;
+        }
+        change();
+        presenceVersion = version;
+    }
+    
+    // 添加一个在线用户
+    function addOnlineUser(user) {
+        if (onlineUsers.has(user)) {
+            return;
+        }
+        const userElement = document.createElement('div');
+        userElement.classList.add('user-item');
+        const isBot = user === '川小农';
+        const isMovieUser = user === '电影';
+        
+        // 构建状态标签
+        const statusElement = document.createElement('span');
+        statusElement.classList.add('user-status', 'online');
+        if (isBot) statusElement.classList.add('bot-status');
+        if (isMovieUser) statusElement.classList.add('movie-status');
+        
+        // 构建用户名标签
+        const nameElement = document.createElement('span');
+        nameElement.classList.add('user-name');
+        if (isBot) nameElement.classList.add('bot-name');
+        if (isMovieUser) nameElement.classList.add('movie-name');
+        
+        if (user === username) {
+            userElement.classList.add('current-user-item');
+            nameElement.textContent = user + ' (你)';
+        } else {
+            nameElement.textContent = user + (isBot ? ' 🤖' : isMovieUser ? ' 🎬' : '');
+        }
+        
+        // 组装DOM元素
+        userElement.appendChild(statusElement);
+        userElement.appendChild(nameElement);
+        
+        // 添加点击用户名插入@功能
+        userElement.addEventListener('click', function() {
+            messageInput.value += ' @' + user;
+            messageInput.focus();
+        });
+        
+        usersList.appendChild(userElement);
+        onlineUsers.set(user, userElement);
+        onlineCount.textContent = onlineUsers.size;
+    }
+    
+    // 移除一个在线用户
+    function removeOnlineUser(user) {
+        const userElement = onlineUsers.get(user);
+        if (!userElement) {
+            return;
+        }
+        userElement.remove();
+        onlineUsers.delete(user);
+        onlineCount.textContent = onlineUsers.size;
+    }
+    
+    // 滚动到底部
+    function scrollToBottom() {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+    
+    // 监听按键事件，支持Enter发送消息，Shift+Enter换行
+    messageInput.addEventListener('keydown', function(e) {
+        if (e.key === 'Enter' && !e.shiftKey) {
+            e.preventDefault();
+            messageForm.dispatchEvent(new Event('submit'));
+        }
+    });
+    
+    // 监听窗口关闭事件，发送离开消息
+    window.addEventListener('beforeunload', function() {
+        socket.emit('leave');
+    });
+});
@@ -0,0 +1,175 @@
+# 静态资源与页面的预压缩和缓存
+# 静态文件首次访问时读入内存，计算内容哈希并按需生成gzip（安装brotli后还有br，pip install brotli）压缩版本；
+# 模板中通过 asset_url() 引用带内容哈希的地址（如 /static/css/style.3f2a1b9c0d.css），浏览器可长期缓存，
+# 文件内容变化后地址随之改变；所有响应带ETag，浏览器重新验证时未变化则返回304
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+# 值得压缩的内容类型（图片、字体等已压缩的格式不再压缩）
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 512  # 小于该字节数的内容不压缩
+HASH_LENGTH = 10  # 地址中内容哈希的长度
+
+_brotli = None
+
+
+def _load_brotli():
+    """brotli为可选依赖，未安装时只提供gzip"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+            logger.info("未安装brotli，静态资源只提供gzip压缩（pip install brotli）")
+    return _brotli or None
+
+
+class CompressedBody:
+    """一份响应内容及其压缩版本（按需生成后缓存），按Accept-Encoding选择并处理ETag/304
+
+    compress为False时只提供原始内容；level为gzip压缩级别，brotli使用对应的质量
+    """
+
+    def __init__(self, data, content_type, compress=True, level=9):
+        self.data = data
+        self.content_type = content_type
+        self.digest = hashlib.sha1(data).hexdigest()
+        self.compress = compress and len(data) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES)
+        self.level = level
+        self._encoded = {'identity': data}
+
+    def encodings(self):
+        """可提供的编码，按优先级排列"""
+        if not self.compress:
+            return ['identity']
+        return (['br'] if _load_brotli() else []) + ['gzip', 'identity']
+
+    def body(self, encoding):
+        """指定编码的内容，压缩后不比原始内容小时返回原始内容"""
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == 'br':
+                body = _load_brotli().compress(self.data, quality=min(self.level + 2, 11))
+            else:
+                body = gzip.compress(self.data, compresslevel=self.level, mtime=0)
+            if len(body) >= len(self.data):
+                body = self.data
+            self._encoded[encoding] = body
+        return body
+
+    def response(self, request, cache_control='no-cache'):
+        """按请求头构建响应：选择编码，If-None-Match匹配时返回304"""
+        encoding = choose_encoding(request, self.encodings())
+        etag = self.digest if encoding == 'identity' else f'{self.digest}-{encoding}'
+        response = Response(status=200, content_type=self.content_type)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        if self.compress:
+            response.vary.add('Accept-Encoding')
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            return response
+        body = self.body(encoding)
+        if body is not self.data:
+            response.headers['Content-Encoding'] = encoding
+        response.set_data(body)
+        return response
+
+
+def choose_encoding(request, available):
+    """按Accept-Encoding从available中选择编码，available按服务端优先级排列"""
+    accepted = request.accept_encodings
+    best = 'identity'
+    best_quality = 0
+    for encoding in available:
+        if encoding == 'identity':
+            continue
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StaticAssets:
+    """static目录下的文件，首次访问时读入内存并缓存压缩版本
+
+    max_age: 带内容哈希的地址的缓存时间（秒）；reload为True时每次访问检查文件修改时间（开发时使用）
+    """
+
+    def __init__(self, root, compress=True, max_age=365 * 24 * 3600, reload=False):
+        self.root = os.path.abspath(root)
+        self.compress = compress
+        self.max_age = max_age
+        self.reload = reload
+        self._files = {}  # {相对路径: (修改时间, CompressedBody)}
+
+    def url(self, path):
+        """模板中引用静态资源的地址，文件不存在时返回不带哈希的地址"""
+        asset = self._get(path)
+        if asset is None:
+            return f'/static/{path}'
+        return f'/static/{hashed_path(path, asset.digest)}'
+
+    def response(self, request, filename):
+        """/static/<filename> 的响应，文件不存在时返回None
+
+        带内容哈希的地址内容不会再变化，长期缓存；不带哈希的地址需要浏览器重新验证
+        """
+        path, digest = split_hashed_path(filename)
+        asset = self._get(path) if digest else None
+        if asset is not None and asset.digest.startswith(digest):
+            return asset.response(request, f'public, max-age={self.max_age}, immutable')
+        # 不带哈希的地址，或部署更新后旧页面引用的旧哈希：返回当前内容，由浏览器重新验证
+        asset = self._get(filename) or asset
+        if asset is None:
+            return None
+        return asset.response(request, 'no-cache')
+
+    def _get(self, path):
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep):
+            return None
+        entry = self._files.get(path)
+        if entry is not None and not self.reload:
+            return entry[1]
+        if not os.path.isfile(full_path):
+            return None
+        mtime = os.stat(full_path).st_mtime_ns
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        asset = CompressedBody(data, guess_type(path), compress=self.compress)
+        self._files[path] = (mtime, asset)
+        return asset
+
+
+def hashed_path(path, digest):
+    """在文件名的扩展名前插入内容哈希: css/style.css -> css/style.<hash>.css"""
+    base, ext = os.path.splitext(path)
+    return f'{base}.{digest[:HASH_LENGTH]}{ext}'
+
+
+def split_hashed_path(path):
+    """从带哈希的地址中取出原路径和哈希: css/style.<hash>.css -> (css/style.css, hash)，不带哈希时哈希为None"""
+    base, ext = os.path.splitext(path)
+    stem, dot, digest = base.rpartition('.')
+    if dot and len(digest) == HASH_LENGTH and all(c in '0123456789abcdef' for c in digest):
+        return stem + ext, digest
+    return path, None
+
+
+def guess_type(path):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/javascript':
+        content_type += '; charset=utf-8'
+    return content_type
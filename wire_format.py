@@ -0,0 +1,52 @@
+# 紧凑传输格式
+# 聊天室广播的数据改用短键名，时间改为毫秒时间戳，去掉值为False/None/空列表的字段，
+# 整个负载预先编码为UTF-8 JSON字节，作为Socket.IO二进制附件发送；配合broadcast_manager，
+# 每次广播的负载和数据包都只编码一次，发给每个客户端的都是同一份字节
+import json
+import time
+
+# 长键名 -> 短键名，chat.html 中有对应的反向映射
+SHORT_KEYS = {
+    'username': 'u',
+    'message': 'm',
+    'timestamp': 't',
+    'mentioned_users': 'mu',
+    'is_ai': 'ai',
+    'is_system': 'sy',
+    'is_movie': 'mv',
+    'movie_url': 'url',
+    'is_mention': 'mn',
+    'mention_target': 'mt',
+    'message_id': 'id',
+    'seq': 's',
+    'version': 'v',
+    'delta': 'd',
+    'asker': 'a',
+    'queue_depth': 'q',
+}
+
+
+def compact(data, created_ms=None):
+    """转换为短键名格式：timestamp替换为事件产生时刻的毫秒时间戳（未指定时为当前时刻），省略值为False、None或空列表的字段"""
+    result = {}
+    for key, value in data.items():
+        if key == 'timestamp':
+            value = created_ms if created_ms is not None else int(time.time() * 1000)
+        elif value is False or value is None or value == []:
+            continue
+        result[SHORT_KEYS.get(key, key)] = value
+    return result
+
+
+def encode(data, created_ms=None):
+    """编码单个事件的数据，返回bytes；created_ms为事件产生时刻的毫秒时间戳"""
+    return _dumps(compact(data, created_ms))
+
+
+def encode_batch(batch):
+    """编码一批事件 [[event, data, created_ms], ...]，返回bytes；每个事件使用各自产生时刻的时间戳，而不是发送时刻"""
+    return _dumps([[event, compact(data, created_ms)] for event, data, created_ms in batch])
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')